@@ -0,0 +1,242 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# streaming audio conversion, audio streams "i.e. youtube m4a / webm" converted to mp3, aac, or ogg used to wait for
+# the whole download, then ffmpeg read temp file again and converted it, for long audio this adds minutes after
+# download is done.
+# instead, an ffmpeg process is started with download and reads from its stdin, file manager reports every merged
+# segment, and a feeder thread sends the merged part of temp file to ffmpeg in file order, so conversion runs while
+# audio is downloading, and converted file is ready shortly after last segment is merged.
+# it is used only when temp file is written in order "fragmented streams or single connection", if ffmpeg fails
+# "i.e. input format can't be read from a pipe" file manager falls back to normal conversion after download.
+# every stream takes a slot of post processing pool while running, if pool is busy audio is converted after download.
+
+import os
+import subprocess
+import tempfile
+import time
+from threading import Thread, Condition
+
+from . import config
+from . import postproc
+from . import transcode
+from .config import Status
+from .utils import log, delete_file
+
+FORMATS = ('mp3', 'aac', 'ogg')  # target formats converted while downloading
+CHUNK_SIZE = 1024 * 1024  # bytes read from temp file and sent to ffmpeg at once
+
+
+def eligible(d):
+    """
+    check if download item's audio can be converted while downloading
+    :param d: DownloadItem
+    :return: True or False
+    """
+    container = os.path.splitext(d.name)[1].lstrip('.').lower()
+    if not config.stream_audio_conversion or d.type != 'audio' or container not in FORMATS:
+        return False
+
+    # hls and dash have their own ffmpeg processing, pieces verification might rewrite data already sent to ffmpeg
+    if 'hls' in d.subtype_list or 'dash' in d.subtype_list or d.piece_hashes:
+        return False
+
+    if not config.ffmpeg_actual_path or not d.segments:
+        return False
+
+    # temp file must be written in order, otherwise ffmpeg waits for missing data until download is done
+    ordered = all(not seg.range for seg in d.segments) or len(d.segments) == 1 or config.max_connections == 1
+    return ordered and len(set(seg.tempfile for seg in d.segments)) == 1
+
+
+class AudioStream:
+    """ffmpeg process converting temp file of a download item, fed with merged data while downloading"""
+
+    def __init__(self, d):
+        self.d = d
+        self.file = d.segments[0].tempfile
+        self.container = os.path.splitext(d.name)[1].lstrip('.').lower()
+        self.process = None
+        self.log_file = None
+        self.thread = None
+        self.cond = Condition()
+        self.ranges = []  # merged (start, end) byte ranges of ranged segments, end excluded
+        self.appended = 0  # merged bytes of segments without range, appended in order by file manager
+        self.sent = 0  # bytes sent to ffmpeg
+        self.finished = False  # no more data, all segments merged
+        self.failed = False
+        self.slot = False  # True while holding a post processing pool slot
+        self.start_time = time.time()
+
+        # segments merged before streaming started, i.e. resumed download
+        for seg in d.segments:
+            if seg.completed:
+                self.on_merge(seg)
+
+    @property
+    def available(self):
+        """end of temp file's contiguous merged part, starting from beginning of file"""
+        if not self.ranges:
+            return self.appended
+
+        end = 0
+        for start, stop in sorted(self.ranges):
+            if start > end:
+                break
+            end = max(end, stop)
+        return end
+
+    def start(self):
+        """start ffmpeg and feeder thread, return True on success"""
+        _, acodec = transcode.get_codecs(self.d)
+        mode = transcode.decide(self.container, '', acodec)
+        args = transcode.codec_args(mode, self.container, audio_only=True)
+
+        cmd = [config.ffmpeg_actual_path, '-loglevel', 'error', '-y', '-i', 'pipe:0', *args.split(),
+               self.d.target_file]
+
+        # ffmpeg processes are limited by post processing pool size
+        if not postproc.reserve_slot():
+            log('audio stream> post processing pool is busy, audio will be converted after download', log_level=2)
+            return False
+        self.slot = True
+
+        # startupinfo to hide terminal window on windows
+        startupinfo = None
+        if config.operating_system == 'Windows':
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags = subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = subprocess.SW_HIDE
+
+        try:
+            # ffmpeg output goes to a temporary file, an unread pipe might fill up while downloading and block ffmpeg
+            self.log_file = tempfile.TemporaryFile('w+', errors='replace')
+            self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                            stderr=self.log_file, startupinfo=startupinfo)
+        except Exception as e:
+            log('audio stream> failed to start ffmpeg:', e)
+            self.release_slot()
+            return False
+
+        # killed with download status, see DownloadItem.status property setter
+        self.d.subprocess = self.process
+
+        log(f'audio stream> converting {acodec or "?"} to {self.container} while downloading, mode: {mode}',
+            log_level=2)
+
+        self.thread = Thread(target=self._feeder, daemon=True, name=f'audio_stream_{self.d.num}')
+        self.thread.start()
+        return True
+
+    def on_merge(self, seg):
+        """called by file manager after a segment is merged into temp file, never raises"""
+        with self.cond:
+            if seg.range:
+                self.ranges.append((seg.range[0], seg.range[0] + seg.size))
+            else:
+                try:
+                    self.appended = os.path.getsize(self.file)
+                except Exception as e:
+                    log('audio stream> error:', e, log_level=2)
+                    self.failed = True  # normal conversion after download
+            self.cond.notify()
+
+    def _feeder(self):
+        """send merged data to ffmpeg in file order"""
+        try:
+            with open(self.file, 'rb') as f:
+                while True:
+                    with self.cond:
+                        while self.sent >= self.available and not self.finished and not self.failed:
+                            self.cond.wait(1)
+
+                        end = self.available
+                        if self.failed or (self.finished and self.sent >= end):
+                            break
+
+                    f.seek(self.sent)
+                    while self.sent < end:
+                        data = f.read(min(CHUNK_SIZE, end - self.sent))
+                        if not data:
+                            break
+                        self.process.stdin.write(data)
+                        self.sent += len(data)
+
+        except Exception as e:
+            # broken pipe if ffmpeg quit, i.e. input format needs seeking
+            if self.d.status not in (Status.cancelled, Status.error):
+                log('audio stream> feeding ffmpeg failed:', e, log_level=2)
+            self.failed = True
+
+        finally:
+            try:
+                self.process.stdin.close()
+            except Exception:
+                pass
+
+    def finish(self):
+        """
+        wait for ffmpeg to convert remaining data, called by file manager after all segments merged
+        :return: True if target file is ready, False if normal conversion is required
+        """
+        with self.cond:
+            self.finished = True
+            self.cond.notify()
+
+        self.thread.join()
+
+        self.process.wait()
+        self.d.subprocess = None
+        self.release_slot()
+
+        success = not self.failed and self.process.returncode == 0 and self.sent >= os.path.getsize(self.file)
+        if success:
+            log(f'audio stream> conversion done {time.time() - self.start_time:.1f} seconds after download start')
+        else:
+            self.log_file.seek(0)
+            log('audio stream> ffmpeg failed, will convert downloaded file instead:', self.log_file.read().strip())
+            delete_file(self.d.target_file)
+
+        self.log_file.close()
+        return success
+
+    def abort(self):
+        """stop ffmpeg and remove partial output, called if download cancelled or failed"""
+        with self.cond:
+            self.failed = True
+            self.cond.notify()
+
+        try:
+            self.process.kill()
+            self.process.wait()
+            self.log_file.close()
+        except Exception:
+            pass
+
+        self.d.subprocess = None
+        self.release_slot()
+        delete_file(self.d.target_file)
+
+    def release_slot(self):
+        if self.slot:
+            self.slot = False
+            postproc.release_slot()
+
+
+def start(d):
+    """
+    start streaming conversion for download item if possible
+    :param d: DownloadItem
+    :return: AudioStream object or None
+    """
+    if not eligible(d):
+        return None
+
+    stream = AudioStream(d)
+    return stream if stream.start() else None
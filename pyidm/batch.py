@@ -0,0 +1,218 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# batch mode for many small files "icons, dataset shards, etc...", a normal download item costs a temp folder,
+# segment files, and 3 threads per file, which is a waste for files downloaded in a single request.
+# batch mode streams every response straight to its final path, all transfers run in one thread over a shared
+# pool of reused curl handles "connections stay alive between files from the same server".
+
+import os
+import time
+from collections import deque
+from urllib.parse import urlparse, unquote
+
+import pycurl
+
+from . import config
+from . import metrics
+from . import dns
+from . import timetable
+from .utils import log, set_curl_options, validate_file_name, delete_file, size_format
+
+
+class BatchResult:
+    """result of a single file in a batch"""
+
+    def __init__(self, url, name=''):
+        self.url = url
+        self.name = name
+        self.file = ''  # final file path
+        self.status = 'pending'  # pending, completed, failed, or skipped
+        self.error = ''
+        self.response_code = 0
+        self.size = 0
+        self.elapsed = 0  # seconds
+        self.too_large = False  # file is larger than config.batch_max_file_size, should be downloaded normally
+
+    def __repr__(self):
+        return f'BatchResult({self.status}, {self.url}, {self.error})'
+
+
+def name_from_url(url):
+    """get file name from url path, i.e. 'http://ex.com/icons/a%20b.png?x=1' ==> 'a b.png'"""
+    try:
+        name = os.path.basename(unquote(urlparse(url).path))
+    except Exception:
+        name = ''
+    return validate_file_name(name) if name else ''
+
+
+def unique_name(name, folder, taken):
+    """
+    rename file to avoid clash with existing files or other files in same batch
+    :param name: file name without path
+    :param folder: target folder
+    :param taken: set of file names already used in this batch, will be updated
+    :return: new name
+    """
+    base, ext = os.path.splitext(name)
+    new_name = name
+    i = 2
+    while new_name in taken or os.path.exists(os.path.join(folder, new_name)):
+        new_name = f'{base}_{i}{ext}'
+        i += 1
+
+    taken.add(new_name)
+    return new_name
+
+
+def download_batch(items, folder=None, connections=None, callback=None, cancel=None):
+    """
+    download many small files over a pool of reused connections, every file is written directly to its final path
+    :param items: list of urls or (url, file name) tuples
+    :param folder: target folder, default to config.download_folder
+    :param connections: number of parallel transfers, default to config.batch_connections
+    :param callback: optional function called with every finished BatchResult
+    :param cancel: optional function, batch stops if it returns True
+    :return: list of BatchResult objects in same order as items
+    """
+    folder = folder or config.download_folder
+    connections = connections or config.batch_connections
+    os.makedirs(folder, exist_ok=True)
+
+    results = []
+    taken = set()
+    for i, item in enumerate(items):
+        url, name = item if isinstance(item, (tuple, list)) else (item, '')
+        result = BatchResult(url.strip(), validate_file_name(name) if name else name_from_url(url) or f'file_{i + 1}')
+        result.name = unique_name(result.name, folder, taken)
+        result.file = os.path.join(folder, result.name)
+        results.append(result)
+
+    dns.prefetch([r.url for r in results])
+
+    queue = deque(results)
+    multi = pycurl.CurlMulti()
+    if config.max_connections_per_host:
+        multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, config.max_connections_per_host)
+
+    handles = [pycurl.Curl() for _ in range(min(connections, len(results)) or 1)]
+    free_handles = handles[:]
+    active = {}  # {curl handle: (result, file object, start time)}
+    start_time = time.time()
+
+    def start(c, result):
+        c.reset()  # options only, connections cache stays alive
+        set_curl_options(c)
+        c.setopt(pycurl.URL, result.url)
+        dns.apply(c, result.url, wait=False)  # hosts prefetched below, never block the transfers loop
+        c.setopt(pycurl.FAILONERROR, 1)  # don't write error pages "4xx, 5xx" into target file
+        if config.batch_max_file_size:
+            c.setopt(pycurl.MAXFILESIZE_LARGE, config.batch_max_file_size)
+        speed_limit = timetable.global_speed_limit()  # might be changed by bandwidth profiles
+        if speed_limit:
+            c.setopt(pycurl.MAX_RECV_SPEED_LARGE, max(speed_limit // connections, 1))
+
+        f = open(result.file, 'wb')
+        c.setopt(pycurl.WRITEDATA, f)
+        multi.add_handle(c)
+        active[c] = (result, f, time.time())
+
+    def finish(c, error=None):
+        multi.remove_handle(c)
+        result, f, t = active.pop(c)
+        f.close()
+
+        result.elapsed = time.time() - t
+        result.response_code = c.getinfo(pycurl.RESPONSE_CODE)
+        result.size = int(c.getinfo(pycurl.SIZE_DOWNLOAD))
+
+        if error:
+            errno, msg = error
+            result.status = 'failed'
+            if errno == pycurl.E_HTTP_RETURNED_ERROR:
+                result.error = f'server refuse connection: {result.response_code}'
+            else:
+                result.error = f'error({errno}, {msg})'
+            result.too_large = errno == pycurl.E_FILESIZE_EXCEEDED
+            delete_file(result.file)
+            log('batch> failed:', result.url, result.error, log_level=2)
+        else:
+            result.status = 'completed'
+            log('batch> completed:', result.name, size_format(result.size), log_level=3)
+
+        metrics.inc('pyidm_batch_files_total', status=result.status)
+        free_handles.append(c)
+
+        if callback:
+            callback(result)
+
+    try:
+        while queue or active:
+            if config.terminate or (cancel and cancel()):
+                break
+
+            # fill free handles with new transfers
+            while queue and free_handles:
+                result = queue.popleft()
+                c = free_handles.pop()
+                try:
+                    start(c, result)
+                except Exception as e:
+                    free_handles.append(c)
+                    result.status = 'failed'
+                    result.error = str(e)
+                    log('batch> failed:', result.url, e)
+                    metrics.inc('pyidm_batch_files_total', status=result.status)
+                    if callback:
+                        callback(result)
+
+            while True:
+                ret, num_handles = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+
+            # collect finished transfers
+            while True:
+                num_q, ok_list, err_list = multi.info_read()
+                for c in ok_list:
+                    finish(c)
+                for c, errno, msg in err_list:
+                    finish(c, (errno, msg))
+                if num_q == 0:
+                    break
+
+            if active:
+                multi.select(0.1)
+
+    finally:
+        # cancelled, remove incomplete files
+        for c in list(active):
+            result, f, _ = active.pop(c)
+            multi.remove_handle(c)
+            f.close()
+            delete_file(result.file)
+            result.status = 'skipped'
+            result.error = 'cancelled'
+
+        for c in handles:
+            c.close()
+        multi.close()
+
+    for result in results:
+        if result.status == 'pending':
+            result.status = 'skipped'
+            result.error = 'cancelled'
+
+    completed = len([r for r in results if r.status == 'completed'])
+    elapsed = time.time() - start_time
+    log(f'batch> done, {completed} of {len(results)} files completed in {elapsed:.1f} seconds',
+        f'({completed * 60 / max(elapsed, 0.001):.0f} files/minute)')
+
+    return results
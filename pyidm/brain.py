@@ -10,16 +10,30 @@ import io
 import os
 import time
 from threading import Thread
+from queue import Queue, Empty
 import concurrent.futures
+import heapq
 
 from .video import merge_video_audio, unzip_ffmpeg, pre_process_hls, post_process_hls, \
-    convert_audio, download_subtitles  # unzip_ffmpeg required here for ffmpeg callback
+    convert_audio, download_subtitles, refresh_media_urls  # unzip_ffmpeg required here for ffmpeg callback
 from . import config
 from .config import Status, active_downloads, APP_NAME
 from .utils import (log, size_format, popup, notify, delete_folder, delete_file, rename_file, load_json, save_json,
-                    print_object, calc_md5, calc_sha256)
-from .worker import Worker
+                    print_object, calc_md5, calc_sha256, preallocate, get_block_size, copy_file_data,
+                    read_speed, log_enabled)
+from .worker import Worker, get_multiplexer, http2_supported
 from .downloaditem import Segment
+from .mirrors import MirrorPool
+from .metalink import PieceVerifier, verify_file
+from . import connections
+from . import metrics
+from . import retry
+from . import planner
+from . import sampler
+from . import timetable
+from . import governor
+from . import postproc
+from . import audiostream
 
 
 def brain(d=None, downloader=None):
@@ -51,9 +65,11 @@ def brain(d=None, downloader=None):
             success = pre_process_hls(d)
             if not success:
                 d.status = Status.error
+                governor.release(d)  # might be reserved by scheduler
                 return
         except Exception as e:
             d.status = Status.error
+            governor.release(d)
             log('pre_process_hls()> error: ', e, showpopup=True)
             if config.TEST_MODE:
                 raise e
@@ -68,6 +84,29 @@ def brain(d=None, downloader=None):
     # load progress info
     d.load_progress_info()
 
+    # reserve disk space, segments files, temp file, and post processing output exist together on disk
+    # items started by scheduler already have their reservation
+    if not governor.reserve(d):
+        d.status = Status.error
+        space = governor.available(d.folder, exclude=d) or 0
+        log(f'Not enough disk space to download "{d.name}", required: {size_format(governor.peak_need(d))}, '
+            f'available: {size_format(max(space, 0))}', showpopup=True)
+        return
+
+    # mirrors, segments will be spread over all valid mirrors
+    d.mirror_pool = None
+    if d.mirrors and 'hls' not in d.subtype_list:
+        d.mirror_pool = MirrorPool(d)
+        d.mirror_pool.start()
+
+    # reset completion, failed jobs, and errors queues, they might have segments from previous session
+    d.completed_q = Queue()
+    d.jobs_q = Queue()
+    d.error_q = Queue()
+
+    # sample download speed in background
+    sampler.watch(d)
+
     # run file manager in a separate thread
     Thread(target=file_manager, daemon=True, args=(d, keep_segments)).start()
 
@@ -97,6 +136,12 @@ def brain(d=None, downloader=None):
         # d.callback()
         globals()[d.callback]()
 
+    if d.mirror_pool:
+        log('mirrors stats:\n' + d.mirror_pool.summary(), log_level=2)
+        d.mirror_pool = None
+
+    governor.release(d)
+
     # report quitting
     log(f'brain {d.num}: quitting')
 
@@ -105,6 +150,10 @@ def brain(d=None, downloader=None):
             log('MD5:', calc_md5(file_name=d.target_file))
             log('SHA256:', calc_sha256(file_name=d.target_file))
 
+        # benchmark sequential read speed of downloaded file, useful to check fragmentation effect
+        if log_enabled(3) and os.path.isfile(d.target_file):
+            log(f'{d.name} sequential read speed: {size_format(read_speed(d.target_file), "/s")}', log_level=3)
+
         # uncomment to debug segments ranges
         # segments = sorted([seg for seg in d.segments], key=lambda seg: seg.range[0])
         # print('d.size:', d.size)
@@ -118,52 +167,166 @@ def file_manager(d, keep_segments=False):
     # create temp files
     temp_files = set([seg.tempfile for seg in d.segments])
     for file in temp_files:
-        open(file, 'ab').close()
+        # preallocate disk space if all segments have ranges "i.e. file size is known", segments without range are
+        # appended to end of temp file and it must be empty
+        segments = [seg for seg in d.segments if seg.tempfile == file]
+        if all(seg.range for seg in segments):
+            size = max(seg.range[1] for seg in segments) + 1
+            method = preallocate(file, size)
+            log(f'preallocate {size_format(size)} for {os.path.basename(file)}, method: {method}', log_level=3)
+        else:
+            open(file, 'ab').close()
+
+    block_size = get_block_size(d.folder)
+
+    # segments which have no range, must be appended to temp file in order otherwise final file will be corrupted,
+    # will keep their order for every temp file, and hold early arrived segments in a reorder buffer until their turn
+    # note: seg.num can't be used as a key since hls key files share same num with their media segments
+    positions = {}  # {id(seg): order of segment in its temp file}
+    next_position = {file: 0 for file in temp_files}
+    reorder_buffer = {file: {} for file in temp_files}  # {tempfile: {position: seg}}
+
+    counters = {file: 0 for file in temp_files}
+    for seg in d.segments:
+        if not seg.range:
+            positions[id(seg)] = counters[seg.tempfile]
+            counters[seg.tempfile] += 1
+
+    completed_num = 0
+    failed = []  # segments failed to merge, will try again later
+
+    # metalink pieces verification
+    verifier = PieceVerifier(d) if d.piece_hashes and d.piece_length else None
+
+    # convert audio while downloading, temp file data is sent to ffmpeg as segments get merged
+    audio_stream = audiostream.start(d)
+
+    # segments downloaded in a previous session will not be reported by workers
+    for seg in d.segments:
+        if seg.completed:
+            completed_num += 1
+        elif seg.downloaded:
+            d.completed_q.put(seg)
+
+    def merge(seg):
+        """append downloaded segment to temp file, mark as completed, return True on success"""
+        start = time.time()
+        try:
+            if seg.merge:
+                # copy in chunks aligned to file system blocks instead of reading whole segment into memory
+                if seg.range:
+                    # use 'rb+' mode if we use seek, 'ab' doesn't work, but it will raise error if file doesn't exist
+                    with open(seg.tempfile, 'rb+') as trgt_file:
+                        with open(seg.name, 'rb') as src_file:
+                            trgt_file.seek(seg.range[0])
+                            copy_file_data(src_file, trgt_file, size=seg.size, block_size=block_size)
+                else:
+                    with open(seg.tempfile, 'ab') as trgt_file:
+                        with open(seg.name, 'rb') as src_file:
+                            copy_file_data(src_file, trgt_file, block_size=block_size)
 
-    while True:
-        time.sleep(0.1)
+            seg.completed = True
+            log('completed segment: ',  seg.basename)
+            metrics.observe('pyidm_merge_seconds', time.time() - start)
 
-        job_list = [seg for seg in d.segments if not seg.completed]
+            if not keep_segments and not config.keep_temp:
+                delete_file(seg.name)
 
-        # print(job_list)
+            if audio_stream:
+                audio_stream.on_merge(seg)
 
-        for seg in job_list:
+        except Exception as e:
+            log('failed to merge segment', seg.name, ' - ', e)
+            if config.TEST_MODE:
+                raise e
+            return False
 
-            # for segments which have no range, it must be appended to temp file in order otherwise final file will be
-            # corrupted, therefore if the first non completed segment is not "downloaded", will exit loop
-            if not seg.downloaded:
-                if not seg.range:
-                    break
-                else:
-                    continue
+        # segment is in temp file now and must be counted, verification errors are not merge errors
+        if verifier:
+            verify(seg)
 
-            # append downloaded segment to temp file, mark as completed
-            try:
-                if seg.merge:
-                    if seg.range:
-                        # use 'rb+' mode if we use seek, 'ab' doesn't work, but it will raise error if file doesn't exist
-                        with open(seg.tempfile, 'rb+') as trgt_file:
-                            with open(seg.name, 'rb') as src_file:
-                                trgt_file.seek(seg.range[0])
-                                trgt_file.write(src_file.read(seg.size))
-                    else:
-                        with open(seg.tempfile, 'ab') as trgt_file:
-                            with open(seg.name, 'rb') as src_file:
-                                trgt_file.write(src_file.read())
+        return True
 
-                seg.completed = True
-                log('completed segment: ',  seg.basename)
+    def verify(seg):
+        """verify pieces covered by merged segment and download failed pieces again"""
+        try:
+            failed_pieces = verifier.on_merge(seg)
+        except Exception as e:
+            d.status = Status.error
+            log('file manager: pieces verification error:', e, showpopup=True)
+            if config.TEST_MODE:
+                raise e
+            return
+
+        if failed_pieces is None:
+            d.status = Status.error
+            log('file manager: pieces verification failed many times, file might be corrupted on server',
+                showpopup=True)
+            return
+
+        for i, range_, urls in failed_pieces:
+            metrics.inc('pyidm_piece_failures_total')
+
+            # mirror which sent bad data shouldn't be used again
+            if d.mirror_pool:
+                for url in urls:
+                    d.mirror_pool.report(url, failed=True, corrupted=True)
 
-                if not keep_segments and not config.keep_temp:
-                    delete_file(seg.name)
+            d.downloaded -= range_[1] - range_[0] + 1  # this piece will be downloaded again
+            piece_seg = Segment(name=os.path.join(d.temp_folder, f'piece_{i}_{verifier.retries[i]}'), range=range_,
+                                url=d.eff_url, tempfile=d.temp_file)
+            d.segments.append(piece_seg)
+
+            # notify thread manager to rebuild its job list
+            d.jobs_q.put(piece_seg)
+
+    # pieces merged in a previous session, temp file might be changed while download was paused
+    if verifier:
+        for seg in list(d.segments):
+            if seg.completed:
+                verify(seg)
+
+    while True:
+        # wait for workers to report downloaded segments
+        try:
+            ready = [d.completed_q.get(timeout=0.1)]
+        except Empty:
+            ready = []
+
+        for _ in range(d.completed_q.qsize()):
+            ready.append(d.completed_q.get())
+
+        # retry failed segments from previous round
+        ready = failed + ready
+        failed = []
+
+        for seg in ready:
+            if seg.completed:
+                continue
+
+            position = positions.get(id(seg))
+            if position is None:
+                # segment with range can be written anywhere in temp file
+                if merge(seg):
+                    completed_num += 1
+                else:
+                    failed.append(seg)
+            else:
+                reorder_buffer[seg.tempfile][position] = seg
+
+        # merge ordered segments which are ready
+        for file, buffer in reorder_buffer.items():
+            while next_position[file] in buffer:
+                seg = buffer[next_position[file]]
+                if not merge(seg):
+                    break
 
-            except Exception as e:
-                log('failed to merge segment', seg.name, ' - ', e)
-                if config.TEST_MODE:
-                    raise e
+                del buffer[next_position[file]]
+                next_position[file] += 1
+                completed_num += 1
 
         # all segments already merged
-        if not job_list:
+        if completed_num >= len(d.segments):
 
             # handle HLS streams
             if 'hls' in d.subtype_list:
@@ -171,7 +334,10 @@ def file_manager(d, keep_segments=False):
                 # Set status to processing
                 d.status = Status.processing
 
-                success = post_process_hls(d)
+                # ffmpeg jobs run in post processing pool
+                success = postproc.run(post_process_hls, d, owner=d, default=False)
+                if d.status == Status.cancelled:
+                    break
                 if not success:
                     d.status = Status.error
                     log('file_manager()>  post_process_hls() failed, file: \n', d.name, showpopup=True)
@@ -185,7 +351,10 @@ def file_manager(d, keep_segments=False):
 
                 # set status to processing
                 d.status = Status.processing
-                error, output = merge_video_audio(d.temp_file, d.audio_file, output_file, d)
+                error, output = postproc.run(merge_video_audio, d.temp_file, d.audio_file, output_file, d, owner=d,
+                                             default=(True, ''))
+                if d.status == Status.cancelled:
+                    break
 
                 if not error:
                     log('done merging video and audio for: ', d.target_file)
@@ -204,7 +373,12 @@ def file_manager(d, keep_segments=False):
             if d.type == 'audio':
                 log('handling audio streams')
                 d.status = Status.processing
-                success = convert_audio(d)
+                success = audio_stream.finish() if audio_stream else False
+                audio_stream = None
+                if not success:
+                    success = postproc.run(convert_audio, d, owner=d, default=False)
+                if d.status == Status.cancelled:
+                    break
                 if not success:
                     d.status = Status.error
                     log('file_manager()>  convert_audio() failed, file:', d.target_file, showpopup=True)
@@ -213,6 +387,19 @@ def file_manager(d, keep_segments=False):
                     d.delete_tempfiles()
 
             else:
+                # metalink whole file hash
+                if d.file_hashes:
+                    try:
+                        verified = verify_file(d.temp_file, d.file_hashes)
+                    except Exception as e:
+                        log('file manager: file verification error:', e)
+                        verified = False
+
+                    if not verified:
+                        d.status = Status.error
+                        log('file manager: file hash mismatch, file might be corrupted:', d.name, showpopup=True)
+                        break
+
                 rename_file(d.temp_file, d.target_file)
                 # delete temp files
                 d.delete_tempfiles()
@@ -230,6 +417,10 @@ def file_manager(d, keep_segments=False):
             # print('--------------file manager cancelled-----------------')
             break
 
+    # download cancelled or failed while converting audio
+    if audio_stream:
+        audio_stream.abort()
+
     # save progress info for future resuming
     if os.path.isdir(d.temp_folder):
         d.save_progress_info()
@@ -243,12 +434,25 @@ def thread_manager(d):
     #   soft start, connections will be gradually increase over time to reach max. number
     #   set by user, this prevent impact on servers/network, and avoid "service not available" response
     #   from server when exceeding multi-connection number set by server.
-    limited_connections = 1
+    #   allowed connections are shared between all downloads from the same host, see connections.py
+
+    # http/2 mode, workers' transfers run as streams on a multiplexer per host instead of a thread per worker,
+    # multiplexers are shared with other downloads from the same host
+    http2 = False
+    if config.use_http2:
+        if http2_supported():
+            http2 = True
+        else:
+            log('Thread Manager()> http/2 is not supported by installed libcurl, will use http/1.1')
+    muxes = {}  # {host name: Multiplexer} used by this download
+    mux_done_q = Queue()  # workers finished their transfers on multiplexers
 
     # create worker/connection list
-    all_workers = [Worker(tag=i, d=d) for i in range(config.max_connections)]
+    all_workers = [Worker(tag=i, d=d, http2=http2) for i in range(config.max_connections)]
     free_workers = set([w for w in all_workers])
     threads_to_workers = dict()
+    workers_hosts = dict()  # {worker: host of its connection}, to charge connection leases to the right host
+    leased_hosts = set()  # hosts this download connected to, video fragments' host might differ from d.eff_url
     executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.max_connections)
     num_live_threads = 0
 
@@ -258,6 +462,9 @@ def thread_manager(d):
     # reverse job_list to process segments in proper order use pop()
     job_list.reverse()
 
+    # failed segments waiting for their retry time, heap of (retry time, id, segment), see retry.py
+    deferred = []
+
     d.remaining_parts = len(job_list)
 
     # error track, if receive many errors with no downloaded data, abort
@@ -265,19 +472,107 @@ def thread_manager(d):
     total_errors = 0
     max_errors = 500
     errors_descriptions = set()  # store unique errors
+    host_errors = {}  # {host name: number of errors}, every host connections budget is controlled separately
     error_timer = 0
-    error_timer2 = 0
     errors_check_interval = 0.2  # in seconds
 
     # speed limit
     sl_timer = time.time()
-
-    log('Thread Manager()> concurrency method:', 'ThreadPoolExecutor' if config.use_thread_pool_executor else 'Individual Threads')
+    applied_speed_limit = None  # limit running workers started with, changes by bandwidth profiles or item limit
+
+    # minimum remaining size of a segment to be split, re-planned as throughput changes, see planner.py
+    split_threshold = planner.split_threshold(d)
+    replan_timer = time.time()
+
+    # expired links, signed video urls might expire while downloading and server will refuse with 403 or 410
+    # new urls will be extracted in background and swapped into remaining segments
+    refresh_q = Queue()  # ({segment name: url}, {download item attribute: value}) sent by refresh thread
+    refreshing = False
+    refresh_timer = 0
+    refresh_interval = 30  # minimum seconds between refresh attempts
+    refresh_attempts = 0
+    max_refresh_attempts = 5  # reset after a successful refresh
+
+    if http2:
+        concurrency_method = 'HTTP/2 Multiplexer'
+    else:
+        concurrency_method = 'ThreadPoolExecutor' if config.use_thread_pool_executor else 'Individual Threads'
+    log('Thread Manager()> concurrency method:', concurrency_method)
 
     def clear_error_q():
-        # clear error queue
-        for _ in range(config.error_q.qsize()):
-            errors_descriptions.add(config.error_q.get())
+        """clear error queue, count errors per host, return number of errors caused by expired links"""
+        expired = 0
+        for _ in range(d.error_q.qsize()):
+            host, description = d.error_q.get()
+            host_errors[host] = host_errors.get(host, 0) + 1
+            errors_descriptions.add(description)
+            error_class = metrics.error_class(description)
+            metrics.inc('pyidm_errors_total', error_class=error_class)
+            if error_class in ('http_403', 'http_410'):
+                expired += 1
+
+        return expired
+
+    def refresh_links():
+        """run in a separate thread, youtube-dl extraction might take several seconds"""
+        try:
+            result = refresh_media_urls(d)
+        except Exception as e:
+            log('Thread Manager()> refresh links error:', e)
+            result = {}, {}
+
+        refresh_q.put(result)
+
+    def rebuild_jobs():
+        """
+        rebuild job list from segments not downloaded yet, segments still waiting for their retry delay go to deferred
+        heap, and download fails if a segment gave up
+        :return: (job_list, deferred)
+        """
+        now = time.time()
+        pending = [seg for seg in d.segments if not seg.downloaded and not seg.locked]
+
+        failed = [seg for seg in pending if retry.gave_up(seg)]
+        if failed:
+            seg = failed[0]
+            d.status = Status.error
+            log(f'Thread manager: failed to download segment {seg.basename} after {seg.attempts} attempts, '
+                f'{seg.last_error} error', showpopup=True)
+
+        jobs = [seg for seg in pending if retry.is_due(seg, now)]
+        jobs.reverse()
+
+        waiting = [(seg.retry_at, id(seg), seg) for seg in pending if not retry.is_due(seg, now)]
+        heapq.heapify(waiting)
+
+        return jobs, waiting
+
+    def lease(url):
+        """
+        choose a mirror for segment url, and get a connection lease from the host budget of the chosen url
+        :param url: segment url
+        :return: url to connect to, or None if no connection is available
+        """
+        if not (d.mirror_pool and url in d.mirror_pool.urls):
+            if connections.acquire(d, url):
+                leased_hosts.add(connections.host_of(url))
+                return url
+            return None
+
+        # spread segments over mirrors according to their throughput, if best mirror's host has no free connections
+        # try next one, origin url is one of the mirrors
+        denied = set()
+        while True:
+            url = d.mirror_pool.select(exclude=denied)
+            if not url:
+                return None
+
+            if connections.acquire(d, url):
+                leased_hosts.add(connections.host_of(url))
+                return url
+
+            d.mirror_pool.release(url)
+            denied.add(url)
 
     def on_completion_callback(future):
         """add worker to free workers once thread is completed, it will be called by future.add_done_callback()"""
@@ -291,56 +586,81 @@ def thread_manager(d):
         time.sleep(0.001)  # a sleep time to while loop to make the app responsive
 
         # Failed jobs returned from workers, will be used as a flag to rebuild job_list --------------------------------
-        if config.jobs_q.qsize() > 0:
-            # rebuild job_list
-            job_list = [seg for seg in d.segments if not seg.downloaded and not seg.locked]
-            job_list.reverse()
-
+        if d.jobs_q.qsize() > 0:
             # empty queue
-            for _ in range(config.jobs_q.qsize()):
-                _ = config.jobs_q.get()
+            for _ in range(d.jobs_q.qsize()):
+                _ = d.jobs_q.get()
                 # job_list.append(job)
 
+            # rebuild job_list, segments still waiting for retry delay go to deferred heap
+            job_list, deferred = rebuild_jobs()
+
+        # failed segments which waited enough go back to job list
+        while deferred and deferred[0][0] <= time.time():
+            seg = heapq.heappop(deferred)[2]
+            if not seg.downloaded and not seg.locked:
+                job_list.append(seg)
+
         # create new workers if user increases max_connections while download is running
         if config.max_connections > len(all_workers):
             extra_num = config.max_connections - len(all_workers)
             index = len(all_workers)
             for i in range(extra_num):
                 index += i
-                worker = Worker(tag=index, d=d)
+                worker = Worker(tag=index, d=d, http2=http2)
                 all_workers.append(worker)
                 free_workers.add(worker)
 
             # redefine executor
             executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.max_connections)
 
-        # allowable connections
-        allowable_connections = min(config.max_connections, limited_connections)
+        # re-plan split threshold
+        if time.time() - replan_timer >= planner.replan_interval:
+            replan_timer = time.time()
+            split_threshold = planner.split_threshold(d)
+
+        # allowable connections, sum of budgets of hosts this download connects to, i.e. all usable mirrors
+        if d.mirror_pool:
+            hosts = set(connections.host_of(url) for url in d.mirror_pool.usable_urls)
+        else:
+            hosts = leased_hosts or {connections.host_of(d.eff_url)}
+        allowable_connections = min(config.max_connections, connections.host_limit(d, hosts))
 
         # dynamic connection manager ---------------------------------------------------------------------------------
         # check every n seconds for connection errors
         if time.time() - error_timer >= errors_check_interval:
             error_timer = time.time()
-            errors_num = config.error_q.qsize()
+            errors_num = d.error_q.qsize()
 
             total_errors += errors_num
             d.errors = total_errors  # update errors property of download item
 
-            clear_error_q()
+            expired = clear_error_q()
+
+            # refresh expired links instead of failing download, only video links can be re-extracted
+            if expired and not refreshing and config.auto_refresh_links and refresh_attempts < max_refresh_attempts \
+                    and (d.format_id or 'hls' in d.subtype_list) and time.time() - refresh_timer >= refresh_interval:
+                log('Thread Manager()> links seem to be expired, refreshing links for:', d.name)
+                refreshing = True
+                refresh_timer = time.time()
+                refresh_attempts += 1
+                Thread(target=refresh_links, daemon=True).start()
+
+            # errors are expected until links refreshed
+            if refreshing:
+                total_errors = 0
+                host_errors.clear()
 
             if total_errors:
                 log('--------------------------------- errors ---------------------------------:', total_errors)
                 log('Errors descriptions:', errors_descriptions, log_level=3)
 
-            if total_errors >= 10 and limited_connections > 1:
-                limited_connections -= 1
-                log('Thread Manager: received server errors, connections limited to:', limited_connections)
-
-            else:
-                if limited_connections < config.max_connections and time.time() - error_timer2 >= 1:
-                    error_timer2 = time.time()
-                    limited_connections += 1
-                    log('Thread Manager: allowable connections:', limited_connections)
+            # control budget of every host separately, errors from one mirror don't limit other mirrors
+            for host in hosts | set(host_errors):
+                if host_errors.get(host, 0) >= 10:
+                    connections.on_errors(d, host)
+                else:
+                    connections.on_success(d, host)
 
             # reset total errors if received any data
             if downloaded != d.downloaded:
@@ -348,6 +668,7 @@ def thread_manager(d):
                 # print('reset errors to zero')
                 total_errors = 0
                 clear_error_q()
+                host_errors.clear()
 
             if total_errors >= max_errors:
                 d.status = Status.error
@@ -355,63 +676,145 @@ def thread_manager(d):
                     start='', sep='\n', showpopup=True)
 
         # speed limit ------------------------------------------------------------------------------------------------
+        # global limit might change by bandwidth profiles, and item might have its own limit, the lower one wins
+        speed_limit = min([x for x in (timetable.global_speed_limit(), d.speed_limit) if x > 0], default=0)
+
         # wait some time for dynamic connection manager to release all connections
         if time.time() - sl_timer < config.max_connections * errors_check_interval:
-            worker_sl = (config.speed_limit // config.max_connections) if config.max_connections else 0
+            worker_sl = (speed_limit // config.max_connections) if config.max_connections else 0
         else:
             # normal calculations
-            worker_sl = (config.speed_limit // allowable_connections) if allowable_connections else 0
+            worker_sl = (speed_limit // allowable_connections) if allowable_connections else 0
+
+        # limit changed, i.e. bandwidth profile window opened or closed, running workers stop and their segments will
+        # be resumed with new limit
+        if applied_speed_limit is not None and speed_limit != applied_speed_limit:
+            log(f'Thread Manager()> speed limit changed to {size_format(speed_limit, "/s") if speed_limit else "none"}'
+                f', restarting running workers')
+            for worker in all_workers:
+                if worker not in free_workers and worker.speed_limit != worker_sl:
+                    worker.restart = True
+        applied_speed_limit = speed_limit
+
+        # swap refreshed links into remaining segments ---------------------------------------------------------------
+        if refreshing and refresh_q.qsize():
+            refreshing = False
+            urls, fields = refresh_q.get()
+            if urls:
+                # new urls are applied here, not in refresh thread, while no new worker or segment is being created
+                for key, value in fields.items():
+                    setattr(d, key, value)
+                leased_hosts.clear()  # new links might be served from other hosts
+
+                count = 0
+                for seg in d.segments:
+                    if not seg.downloaded and seg.name in urls:
+                        seg.url = urls[seg.name]
+                        retry.on_success(seg)
+                        count += 1
+
+                # retry segments which failed with expired links now
+                job_list += [seg for _, _, seg in deferred if not seg.downloaded and not seg.locked]
+                deferred = []
+
+                refresh_attempts = 0
+                metrics.inc('pyidm_link_refreshes_total')
+                log(f'Thread Manager()> links refreshed, updated {count} remaining segments')
+            else:
+                log('Thread Manager()> failed to refresh links for:', d.name)
 
         # Threads ------------------------------------------------------------------------------------------------------
-        if d.status == Status.downloading:
+        # don't start new workers with expired links while refreshing
+        if d.status == Status.downloading and not refreshing:
             if free_workers and num_live_threads < allowable_connections:
                 seg = None
+                url = None
                 if job_list:
-                    seg = job_list.pop()
+                    # get a connection lease from host budget
+                    url = lease(job_list[-1].url)
+                    if url:
+                        seg = job_list.pop()
                 else:
-                    # share segments and help other workers
-                    remaining_segs = [seg for seg in d.segments if seg.remaining > config.segment_size]
-                    remaining_segs = sorted(remaining_segs, key=lambda seg: seg.remaining)
+                    # share segments and help other workers, skip segments waiting for retry delay or gave up.
+                    # data in worker's write buffer isn't on disk yet, so segment file size is behind, use worker's
+                    # own count of received bytes, and only split segments which a live worker is downloading, since
+                    # finished segments files might be already merged and deleted
+                    now = time.time()
+                    received = {}
+                    for worker in all_workers:
+                        seg = worker.seg
+                        if seg and worker not in free_workers and not (seg.downloaded or seg.completed):
+                            received[seg] = max(seg.current_size, worker.start_size + worker.downloaded)
+                    seg = None
+
+                    remaining_segs = [s for s, n in received.items() if s.size - n > split_threshold and
+                                      retry.is_due(s, now) and not retry.gave_up(s)]
+                    remaining_segs = sorted(remaining_segs, key=lambda s: s.size - received[s])
                     # log('x'*20, 'check remaining')
 
-                    if remaining_segs:
+                    url = lease(d.eff_url) if remaining_segs else None
+                    if url:
                         current_seg = remaining_segs.pop()
-                        size = current_seg.remaining // 2
-                        end = current_seg.range[1]
-                        current_seg.range = [current_seg.range[0], current_seg.range[0] + size]
+                        a, end = current_seg.range
+                        received = received[current_seg]
+
+                        position = a + received
+                        start = position + max(current_seg.size - received, 0) // 2
+
+                        # keep metalink pieces boundaries, to verify pieces as soon as segments completed
+                        if d.piece_hashes and d.piece_length:
+                            start = start // d.piece_length * d.piece_length
 
-                        # create new segment
-                        start = current_seg.range[1] + 1
-                        i = len(d.segments)
-                        seg = Segment(name=os.path.join(d.temp_folder, str(i)), url=d.eff_url,
-                                      tempfile=current_seg.tempfile, range=[start, end])
+                        if start > position:
+                            current_seg.range = [a, start - 1]
 
-                        # add to segments
-                        d.segments.append(seg)
-                        print('-' * 20,
-                              f'new segment {i} created from {current_seg.basename} with range {current_seg.range}')
+                            # create new segment
+                            i = len(d.segments)
+                            seg = Segment(name=os.path.join(d.temp_folder, str(i)), url=d.eff_url,
+                                          tempfile=current_seg.tempfile, range=[start, end])
+
+                            # add to segments
+                            d.segments.append(seg)
+                            metrics.inc('pyidm_segment_splits_total')
+                            print('-' * 20,
+                                  f'new segment {i} created from {current_seg.basename} with range {current_seg.range}')
 
                 if seg and not seg.downloaded and not seg.locked:
+                    seg.url = url
                     worker = free_workers.pop()
+                    workers_hosts[worker] = connections.host_of(url)
                     # sometimes download chokes when remaining only one worker, will set higher minimum speed and
                     # less timeout for last workers batch
-                    if len(job_list) + config.jobs_q.qsize() <= allowable_connections:
+                    if len(job_list) + d.jobs_q.qsize() <= allowable_connections:
                         minimum_speed, timeout = 20 * 1024, 10  # worker will abort if speed less than 20 KB for 10 seconds
                     else:
                         minimum_speed = timeout = None  # default as in utils.set_curl_option
 
                     worker.reuse(seg=seg, speed_limit=worker_sl, minimum_speed=minimum_speed, timeout=timeout)
 
-                    if config.use_thread_pool_executor:
-                        thread = executor.submit(worker.run)
-                        thread.add_done_callback(on_completion_callback)
+                    if http2:
+                        host = workers_hosts[worker]
+                        if host not in muxes:
+                            muxes[host] = get_multiplexer(host)
+                        muxes[host].add(worker, mux_done_q)
                     else:
-                        thread = Thread(target=worker.run, daemon=True)
-                        thread.start()
-                    threads_to_workers[thread] = worker
+                        if config.use_thread_pool_executor:
+                            thread = executor.submit(worker.run)
+                            thread.add_done_callback(on_completion_callback)
+                        else:
+                            thread = Thread(target=worker.run, daemon=True)
+                            thread.start()
+                        threads_to_workers[thread] = worker
+
+                elif url and d.mirror_pool:
+                    d.mirror_pool.release(url)  # no segment started, lease is reclaimed by connections.update()
 
         # check thread completion
-        if not config.use_thread_pool_executor:
+        if http2:
+            for _ in range(mux_done_q.qsize()):
+                free_workers.add(mux_done_q.get())
+
+        elif not config.use_thread_pool_executor:
             for thread in list(threads_to_workers.keys()):
                 if not thread.is_alive():
                     worker = threads_to_workers.pop(thread)
@@ -419,19 +822,37 @@ def thread_manager(d):
 
         # update d param -----------------------------------------------------------------------------------------------
         num_live_threads = len(all_workers) - len(free_workers)
-        d.live_connections = num_live_threads
-        d.remaining_parts = d.live_connections + len(job_list) + config.jobs_q.qsize()
+        live_hosts = {}
+        for worker in all_workers:
+            if worker not in free_workers:
+                host = workers_hosts.get(worker, '')
+                live_hosts[host] = live_hosts.get(host, 0) + 1
+        connections.update(d, live_hosts)  # reclaim leases of finished workers
+        d.live_streams = num_live_threads  # running segment transfers
+        if http2:
+            d.live_connections = sum(mux.sockets.get(d.id, 0) for mux in muxes.values())  # estimated
+        else:
+            d.live_connections = num_live_threads  # tcp connections
+        d.multiplexed = http2
+        d.remaining_parts = num_live_threads + len(job_list) + len(deferred) + d.jobs_q.qsize()
 
         # Required check if things goes wrong --------------------------------------------------------------------------
-        if num_live_threads + len(job_list) + config.jobs_q.qsize() == 0:
+        if num_live_threads + len(job_list) + len(deferred) + d.jobs_q.qsize() == 0:
             # rebuild job_list
-            job_list = [seg for seg in d.segments if not seg.downloaded]
-            if not job_list:
+            if all(seg.downloaded for seg in d.segments):
+                # all segments downloaded, wait for file manager to finish, it might add new segments for metalink
+                # pieces which failed verification
+                if d.piece_hashes and d.status == Status.downloading:
+                    time.sleep(0.1)
+                    continue
                 break
             else:
-                # remove an orphan locks
-                for seg in job_list:
-                    seg.locked = False
+                # remove an orphan locks, no worker is running
+                for seg in d.segments:
+                    if not seg.downloaded:
+                        seg.locked = False
+
+                job_list, deferred = rebuild_jobs()
 
         # monitor status change ----------------------------------------------------------------------------------------
         if d.status != Status.downloading:
@@ -439,7 +860,17 @@ def thread_manager(d):
             executor.shutdown(wait=False)
             break
 
+    for mux in muxes.values():
+        mux.release()
+
+    connections.release_all(d)
+
+    # keep measurements for next downloads from the same host
+    planner.measure(d)
+
     # update d param
     d.live_connections = 0
-    d.remaining_parts = num_live_threads + len(job_list) + config.jobs_q.qsize()
+    d.live_streams = 0
+    d.multiplexed = False
+    d.remaining_parts = num_live_threads + len(job_list) + len(deferred) + d.jobs_q.qsize()
     log(f'thread_manager {d.num}: quitting')
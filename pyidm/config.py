@@ -9,6 +9,7 @@
 
 # configurations
 from queue import Queue
+from collections import deque
 import os
 import sys
 import platform
@@ -69,11 +70,22 @@ process_playlist = False  # fetch videos info only if selected, since big playli
 big_playlist_length = 50  # minimum number of videos in big playlist, it will ignore "process_playlist"
 manually_select_dash_audio = False  # if True, will prompt user to select audio format for dash video
 auto_rename = False  # auto rename file if there is an existing file with same name at download folder
+auto_refresh_links = True  # re-extract expired video links automatically while downloading
 
 # connection / network
 speed_limit = 0  # in bytes, zero == no limit
+# bandwidth profiles, speed limit during time windows overriding speed_limit, see timetable.py
+# i.e. [{'start': [1, 0], 'stop': [7, 0], 'days': [], 'speed_limit': 0}], days: weekdays 0=monday, empty for every day
+bandwidth_profiles = []
 max_concurrent_downloads = DEFAULT_CONCURRENT_CONNECTIONS
 max_connections = DEFAULT_CONNECTIONS
+max_connections_per_host = 0  # connections shared by all downloads from the same server, zero == no limit
+max_total_connections = 0  # global cap for all downloads connections, zero == no limit
+max_downloads_per_host = 0  # max concurrent downloads from the same server, zero == no limit
+adaptive_segments = True  # size segments from measured bandwidth-delay product, see planner.py
+planner_overhead = 0.25  # max segment setup time "request round trip, handshakes" as a fraction of its transfer time
+planner_max_segment_size = 64 * 1024 * 1024  # in bytes
+group_weights = {}  # scheduler share for download groups "host name or item's group", i.e. {'example.com': 2}
 use_referer = False
 referer_url = ''  # referer website url
 
@@ -93,7 +105,10 @@ use_proxy_dns = False
 log_entry = ''  # one log line
 max_log_size = 1024 * 1024 * 5  # 5 MB
 log_level = DEFAULT_LOG_LEVEL  # standard=1, verbose=2, debug=3
+log_levels = {}  # override log level for a subsystem, i.e. {'worker': 1}
 log_recorder_q = Queue()
+log_buffer_size = 2000  # max number of log lines waiting to be displayed in main window's log tab
+transfer_stats_size = 500  # max number of segment transfer timing records kept per download item
 
 # use_cookies
 use_cookies = False
@@ -110,6 +125,29 @@ ytdl_abort = False
 keep_temp = False  # keep temp files / folders after done downloading for debugging
 checksum = False  # calculate checksums for completed files MD5 and SHA256
 use_thread_pool_executor = False
+min_free_space = 200 * 1024 * 1024  # keep this free space on download file system, see governor.py
+disk_check_interval = 5  # seconds, how often free space of active downloads' file systems is checked
+max_write_latency = 0.5  # seconds, hold new downloads while disk writes take longer than this, zero to disable
+postprocess_workers = 0  # concurrent ffmpeg jobs "merge, convert, etc...", zero for number of cpu cores
+stream_audio_conversion = True  # convert audio to mp3, aac, or ogg while downloading, see audiostream.py
+writer_threads = 2  # threads which flush workers' buffered data to disk
+write_buffer_size = 1024 * 1024  # flush worker buffer to disk when it reaches this size
+max_write_buffer = 8 * 1024 * 1024  # pause worker's transfer when its unwritten data reaches this size
+speed_sample_interval = 0.5  # seconds, how often speed sampler reads downloaded bytes, see sampler.py
+speed_time_constant = 2  # seconds, speed moving average smoothing, larger values give slower but steadier readings
+speed_window = 10  # seconds, window of average speed used for time left estimation
+max_segment_retries = 10  # give up downloading a segment after n failed attempts in a row
+retry_base_delay = 0.5  # seconds, first retry delay, doubled for every next retry
+retry_max_delay = 60  # seconds, maximum delay between retries
+probe_workers = 8  # concurrent headers requests, i.e. when importing url lists
+headers_cache_ttl = 30  # seconds, reuse headers of recently probed urls, zero to disable cache
+dns_cache_ttl = 60  # seconds, share resolved host addresses between all curl handles, zero to disable, see dns.py
+dns_timeout = 10  # seconds, max time to wait for a host lookup started by another thread
+batch_connections = 8  # parallel transfers in small files batch mode, see batch.py
+batch_max_file_size = 50 * 1024 * 1024  # larger files in a batch are skipped, to be downloaded normally
+use_http2 = False  # multiplex segments as http/2 streams over one connection per host, if server supports it
+metrics_enabled = False  # expose engine metrics on a local http endpoint
+metrics_port = 9925  # metrics url: http://127.0.0.1:9925/metrics
 
 # -------------------------------------------------------------------------------------
 
@@ -145,10 +183,8 @@ update_record_path = os.path.join(current_directory, 'update_record.info')
 # queues
 main_q = Queue()  # used by pyIDM.py
 main_window_q = Queue()  # queue for Main application window
-log_q = Queue()  # queue to hold log messages to be displayed in main window's log tab
+log_q = deque(maxlen=log_buffer_size)  # ring buffer holds log messages to be displayed in main window's log tab
 commands_q = Queue()  # queue to access MainWindow internal methods from threads
-error_q = Queue()  # used by workers to report server refuse connection errors
-jobs_q = Queue()  # # required for failed worker jobs
 
 # settings parameters to be saved on disk
 settings_keys = ['current_theme', 'monitor_clipboard', 'show_download_window', 'auto_close_download_window',
@@ -156,7 +192,10 @@ settings_keys = ['current_theme', 'monitor_clipboard', 'show_download_window', '
                  'update_frequency', 'last_update_check', 'proxy', 'proxy_type', 'raw_proxy', 'enable_proxy',
                  'log_level', 'download_folder', 'manually_select_dash_audio', 'use_referer', 'referer_url',
                  'close_action', 'process_playlist', 'keep_temp', 'auto_rename', 'dynamic_theme_change', 'checksum',
-                 'use_proxy_dns', 'use_thread_pool_executor']
+                 'use_proxy_dns', 'use_thread_pool_executor', 'log_levels', 'metrics_enabled',
+                 'metrics_port', 'use_http2', 'max_downloads_per_host', 'group_weights',
+                 'max_connections_per_host', 'max_total_connections', 'auto_refresh_links',
+                 'adaptive_segments', 'bandwidth_profiles']
 
 
 # -------------------------------------------------------------------------------------
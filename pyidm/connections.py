@@ -0,0 +1,169 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# process-wide connections budget, shared between all downloads from the same host, with an optional global cap.
+# thread manager of every download asks for a connection lease before starting a worker, leases are reclaimed as soon
+# as workers finish, and a download can't take more than its fair share of the host budget while other downloads
+# are waiting. host budget grows gradually "soft start" and shrinks on server errors.
+# leases are charged to the host a worker connects to "mirror host, or new host of refreshed video links", thread
+# manager remembers it for every running worker, and syncs leases per host. workers report errors with their host, so
+# every host budget grows and shrinks on its own, and a multi-source download is allowed the sum of its hosts' budgets.
+
+import math
+import time
+from threading import Lock
+from urllib.parse import urlparse
+
+from . import config
+from .utils import log
+
+_lock = Lock()
+_hosts = {}  # {host name: Host}
+
+
+class Host:
+    def __init__(self, name):
+        self.name = name
+        self.limit = 1  # current allowed connections, soft start from one connection
+        self.leases = {}  # {download id: number of connections}
+        self.waiting = {}  # {download id: time}, downloads denied a connection recently
+        self.increase_timer = 0
+        self.decrease_timer = 0
+
+    @property
+    def max_limit(self):
+        return config.max_connections_per_host or config.max_connections * config.max_concurrent_downloads
+
+    @property
+    def used(self):
+        return sum(self.leases.values())
+
+
+def host_of(url):
+    try:
+        return urlparse(url).hostname or ''
+    except Exception:
+        return ''
+
+
+def get_host(name):
+    host = _hosts.get(name)
+    if host is None:
+        host = _hosts[name] = Host(name)
+    return host
+
+
+def total_used():
+    return sum(host.used for host in _hosts.values())
+
+
+def acquire(d, url=None):
+    """
+    ask for a connection lease for download item
+    :param d: DownloadItem
+    :param url: url worker will connect to, default to d.eff_url
+    :return: True if granted
+    """
+    with _lock:
+        host = get_host(host_of(url or d.eff_url))
+        now = time.time()
+
+        # forget downloads which stopped asking
+        for id_, t in list(host.waiting.items()):
+            if now - t > 1:
+                host.waiting.pop(id_)
+
+        held = host.leases.get(d.id, 0)
+
+        granted = host.used < host.limit and not (config.max_total_connections and
+                                                  total_used() >= config.max_total_connections)
+
+        # fair share, don't exceed equal share of host budget while other downloads wait for connections
+        if granted and any(id_ != d.id for id_ in host.waiting):
+            demanders = set(host.waiting) | set(id_ for id_, n in host.leases.items() if n) | {d.id}
+            granted = held < math.ceil(host.limit / len(demanders))
+
+        if granted:
+            host.leases[d.id] = held + 1
+            host.waiting.pop(d.id, None)
+        else:
+            host.waiting[d.id] = now
+
+        return granted
+
+
+def update(d, live_connections):
+    """
+    sync leases with actual running workers of download item, connections of finished workers are reclaimed here
+    :param d: DownloadItem
+    :param live_connections: dictionary of running workers per host, {host name: number}
+    """
+    with _lock:
+        for name in live_connections:
+            get_host(name)
+
+        for host in _hosts.values():
+            if live_connections.get(host.name):
+                host.leases[d.id] = live_connections[host.name]
+            else:
+                host.leases.pop(d.id, None)
+
+
+def release_all(d):
+    """release all leases held by a download item on any host, called when its thread manager quits"""
+    with _lock:
+        for host in _hosts.values():
+            host.leases.pop(d.id, None)
+            host.waiting.pop(d.id, None)
+
+
+def on_errors(d, name=None):
+    """
+    server errors received, decrease host budget
+    :param d: DownloadItem
+    :param name: host name which sent errors, default to host of d.eff_url
+    """
+    with _lock:
+        host = get_host(name if name is not None else host_of(d.eff_url))
+
+        # multiple downloads might report same errors storm at the same time, decrease once per interval
+        if host.limit > 1 and time.time() - host.decrease_timer >= 0.2:
+            host.decrease_timer = time.time()
+            host.limit -= 1
+            log(f'connections budget: received server errors, {host.name} connections limited to:', host.limit)
+
+
+def on_success(d, name=None):
+    """
+    no errors, increase host budget gradually up to its maximum
+    :param d: DownloadItem
+    :param name: host name, default to host of d.eff_url
+    """
+    with _lock:
+        host = get_host(name if name is not None else host_of(d.eff_url))
+        max_limit = host.max_limit
+
+        if host.limit > max_limit:
+            host.limit = max_limit
+
+        elif host.limit < max_limit and time.time() - host.increase_timer >= 1 and host.used >= host.limit:
+            host.increase_timer = time.time()
+            host.limit += 1
+            log(f'connections budget: {host.name} allowable connections:', host.limit, log_level=2)
+
+
+def host_limit(d, names=None):
+    """
+    current allowed connections for download item, sum of budgets of all hosts it downloads from
+    :param d: DownloadItem
+    :param names: host names in use "i.e. usable mirrors", default to host of d.eff_url
+    """
+    names = set(names or [host_of(d.eff_url)])
+    with _lock:
+        return sum(get_host(name).limit for name in names)
@@ -0,0 +1,190 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# process-wide dns cache, every curl easy handle keeps its own private dns cache, so every new worker, headers probe,
+# or batch handle resolves the same host again, here host names are resolved once and the addresses are handed to
+# curl handles by "CURLOPT_RESOLVE" option.
+# hosts are prefetched in background as soon as a url is pasted or a url list is imported, so the lookup is usually
+# done before the first request needs it.
+# python's resolver doesn't expose records' ttl, cache entries expire after config.dns_cache_ttl seconds instead,
+# failed lookups are not cached, curl will resolve these hosts by itself and report the error as usual.
+
+import ipaddress
+import socket
+import time
+from threading import Lock, Thread, Event
+from urllib.parse import urlparse
+
+import pycurl
+
+from . import config
+from . import metrics
+from .utils import log
+
+_lock = Lock()
+_cache = {}  # {(host, port): (addresses, expiry time, lookup time)}
+_pending = {}  # {(host, port): Event}, lookups in progress
+
+default_ports = {'http': 80, 'https': 443, 'ftp': 21, 'ftps': 990}
+
+# counters
+stats = {'hits': 0, 'misses': 0, 'saved_time': 0.0}  # saved_time: seconds of lookups avoided by cache hits
+
+
+def host_key(url):
+    """
+    get (host, port) of a url
+    :return: tuple (host, port) or None if url host is an ip address or port unknown
+    """
+    try:
+        parsed = urlparse(url)
+        host = parsed.hostname
+        port = parsed.port or default_ports.get(parsed.scheme.lower())
+    except Exception:
+        return None
+
+    if not host or not port:
+        return None
+
+    try:
+        ipaddress.ip_address(host)
+        return None  # no lookup needed
+    except ValueError:
+        pass
+
+    return host.lower(), port
+
+
+def enabled():
+    # with proxy, target host is resolved by proxy server "or resolved by curl just to be sent to socks4 proxy"
+    return config.dns_cache_ttl > 0 and not config.proxy
+
+
+def _lookup(key):
+    """resolve host name, runs once per host at a time, other callers wait for it"""
+    host, port = key
+    addresses = []
+    t = time.time()
+
+    try:
+        for family, _, _, _, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+            address = sockaddr[0]
+            if family == socket.AF_INET6:
+                address = f'[{address}]'
+            if address not in addresses:
+                addresses.append(address)
+    except Exception as e:
+        log('dns> failed to resolve', host, e, log_level=3)
+
+    lookup_time = time.time() - t
+
+    with _lock:
+        if addresses:
+            _cache[key] = (addresses, time.time() + config.dns_cache_ttl, lookup_time)
+        _pending.pop(key).set()
+
+    log(f'dns> resolved {host} in {lookup_time * 1000:.0f} ms:', addresses, log_level=3)
+    return addresses
+
+
+def resolve(key, wait=True):
+    """
+    get cached addresses of a host, resolve it if not cached
+    :param key: (host, port) tuple, see host_key()
+    :param wait: if False, don't block on a cache miss, lookup will run in background and None returned
+    :return: list of addresses or None
+    """
+    now = time.time()
+    owner = False
+
+    with _lock:
+        entry = _cache.get(key)
+        if entry and entry[1] > now:
+            addresses, _, lookup_time = entry
+            stats['hits'] += 1
+            stats['saved_time'] += lookup_time
+        else:
+            addresses = None
+            event = _pending.get(key)
+            if event is None:
+                event = _pending[key] = Event()
+                owner = True
+
+    if addresses:
+        metrics.inc('pyidm_dns_lookups_total', result='hit')
+        metrics.inc('pyidm_dns_saved_seconds_total', lookup_time)
+        return addresses
+
+    if not wait:
+        if owner:
+            Thread(target=_lookup, args=[key], daemon=True).start()
+        return None
+
+    with _lock:
+        stats['misses'] += 1
+    metrics.inc('pyidm_dns_lookups_total', result='miss')
+
+    if owner:
+        return _lookup(key)
+
+    # same host is being resolved by another thread "i.e. prefetch", wait for its result
+    event.wait(config.dns_timeout)
+    with _lock:
+        entry = _cache.get(key)
+    return entry[0] if entry else None
+
+
+def prefetch(urls):
+    """
+    resolve hosts in background
+    :param urls: url or list of urls
+    """
+    if not enabled():
+        return
+
+    if isinstance(urls, str):
+        urls = [urls]
+
+    keys = set(host_key(url) for url in urls)
+    keys.discard(None)
+
+    for key in keys:
+        resolve(key, wait=False)
+
+
+def apply(c, url, wait=True):
+    """
+    hand cached addresses of url's host to a curl handle, should be called after set_curl_options()
+    :param c: pycurl.Curl object
+    :param url: request url, hosts of later redirections are resolved by curl itself
+    :param wait: if False, don't block if host is not cached, i.e. when called from a multi handle's loop
+    """
+    if not enabled():
+        return
+
+    key = host_key(url)
+    if not key:
+        return
+
+    addresses = resolve(key, wait=wait)
+    if not addresses:
+        return
+
+    host, port = key
+    try:
+        # multiple addresses require libcurl 7.59.0, curl tries them in order "happy eyeballs for ipv4 / ipv6"
+        c.setopt(pycurl.RESOLVE, [f'{host}:{port}:{",".join(addresses)}'])
+    except Exception as e:
+        log('dns> failed to set resolve option:', e, log_level=3)
+
+
+def clear():
+    """empty cache, i.e. after network change"""
+    with _lock:
+        _cache.clear()
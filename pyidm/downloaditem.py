@@ -10,6 +10,8 @@
 # Download Item Class
 
 import os
+import csv
+import sys
 import mimetypes
 import time
 from collections import deque
@@ -17,34 +19,96 @@ from queue import Queue
 from threading import Thread, Lock
 from urllib.parse import urljoin
 from .utils import (validate_file_name, get_headers, translate_server_code, size_splitter, get_seg_size, log,
-                    delete_file, delete_folder, save_json, load_json, size_format, get_range_list)
+                    delete_file, delete_folder, save_json, load_json, size_format, get_range_list, update_object,
+                    percentile)
 from . import config
+from . import planner
 from .config import MediaType
 
 
+# fields recorded for every segment transfer, times in seconds measured from transfer start, speed in bytes/sec
+TRANSFER_STATS_FIELDS = ('time', 'segment', 'response_code', 'bytes', 'namelookup_time', 'connect_time',
+                         'appconnect_time', 'starttransfer_time', 'total_time', 'speed_download', 'num_connects')
+TRANSFER_STATS_SUMMARY_FIELDS = ('namelookup_time', 'connect_time', 'appconnect_time', 'starttransfer_time',
+                                 'total_time', 'speed_download')
+
+
 class Segment:
+    # a 10 hours hls video could have tens of thousands of segments, using __slots__ instead of a per-instance __dict__
+    # and sharing common strings "folder, url prefix, tempfile" between segments keeps memory footprint small
+    __slots__ = ('_folder', '_basename', 'num', '_range', 'size', 'downloaded', 'completed', '_tempfile', 'headers',
+                 '_url_prefix', '_url_tail', '_url_query', 'seg_type', 'merge', 'key', 'locked', 'media_type', 'duration',
+                 'attempts', 'last_error', 'retry_at')
+
     def __init__(self, name=None, num=None, range=None, size=None, url=None, tempfile=None, seg_type='', merge=True,
                  media_type=MediaType.general):
         self.name = name  # full path file name
-        # self.basename = os.path.basename(self.name)
         self.num = num
         self._range = range  # a list of start and end bytes
         self.size = size
         self.downloaded = False
         self.completed = False  # done downloading and merging into tempfile
         self.tempfile = tempfile
-        self.headers = {}
+        self.headers = None  # will be created only if requested by get_size()
         self.url = url
         self.seg_type = seg_type
         self.merge = merge
         self.key = None
         self.locked = False  # set True by the worker which is currently downloading this segment
         self.media_type = media_type
+        self.duration = 0  # hls segment duration in seconds
+
+        # retry info, see retry.py
+        self.attempts = 0  # failed attempts
+        self.last_error = ''  # last error class, transient, permanent, or expired
+        self.retry_at = 0  # time of next retry, -1 if gave up
 
         # override size if range available
         if range:
             self.size = range[1] - range[0] + 1
 
+    @property
+    def name(self):
+        if self._basename is None:
+            return None
+        return os.path.join(self._folder, self._basename) if self._folder else self._basename
+
+    @name.setter
+    def name(self, value):
+        if value is None:
+            self._folder = self._basename = None
+        else:
+            folder, self._basename = os.path.split(value)
+            self._folder = sys.intern(folder)  # all segments share the same temp folder string
+
+    @property
+    def url(self):
+        if self._url_tail is None:
+            return None
+        return self._url_prefix + self._url_tail + self._url_query
+
+    @url.setter
+    def url(self, value):
+        if value is None:
+            self._url_prefix = self._url_tail = self._url_query = None
+        else:
+            # fragments / hls segments urls usually differ in the last path part only, while the base path and the
+            # query string "i.e. signed tokens" are the same, share both parts between segments
+            q = value.find('?')
+            q = len(value) if q < 0 else q
+            i = value.rfind('/', 0, q) + 1
+            self._url_prefix = sys.intern(value[:i])
+            self._url_tail = value[i:q]
+            self._url_query = sys.intern(value[q:])
+
+    @property
+    def tempfile(self):
+        return self._tempfile
+
+    @tempfile.setter
+    def tempfile(self, value):
+        self._tempfile = sys.intern(value) if value else value
+
     @property
     def current_size(self):
         try:
@@ -69,8 +133,8 @@ class Segment:
 
     @property
     def basename(self):
-        if self.name:
-            return os.path.basename(self.name)
+        if self._basename:
+            return self._basename
         else:
             return 'undefined'
 
@@ -84,7 +148,9 @@ class Segment:
         return self.size
 
     def __repr__(self):
-        return repr(self.__dict__)
+        return repr({'name': self.name, 'num': self.num, 'range': self.range, 'size': self.size,
+                     'downloaded': self.downloaded, 'completed': self.completed, 'url': self.url,
+                     'tempfile': self.tempfile, 'merge': self.merge, 'media_type': self.media_type})
 
 
 class DownloadItem:
@@ -116,7 +182,9 @@ class DownloadItem:
 
         self._segment_size = config.segment_size
 
-        self.live_connections = 0
+        self.live_connections = 0  # tcp connections, an estimate when multiplexed, see Multiplexer.count_sockets()
+        self.live_streams = 0  # running segment transfers, more than connections when multiplexing http/2 streams
+        self.multiplexed = False  # segment transfers run as http/2 streams by a Multiplexer
         self._downloaded = 0
         self._lock = None  # Lock() to access downloaded property from different threads
         self._status = config.Status.cancelled
@@ -136,6 +204,8 @@ class DownloadItem:
         self.audio_size = 0
         self.is_audio = False
         self.audio_quality = None
+        self.vcodec = ''  # youtube-dl codec names i.e. 'avc1.64001F', used to choose ffmpeg mode, see transcode.py
+        self.acodec = ''
 
         # postprocessing callback is a string represent any function name need to be called after done downloading
         # this function must be available or imported in brain.py namespace
@@ -143,16 +213,38 @@ class DownloadItem:
 
         # schedule download
         self.sched = None  # should be time in (hours, minutes) tuple for scheduling download
-
-        # speed
-        self._speed = 0
-        self.prev_downloaded_value = 0
-        self.speed_buffer = deque()  # store some speed readings for calculating average speed afterwards
-        self.speed_timer = 0
-        self.speed_refresh_rate = 0.5  # calculate speed every n seconds
+        self.sched_stop = None  # (hours, minutes) stop time, see timetable.py
+        self.sched_days = []  # weekdays to repeat schedule on, 0=monday, empty for a single time
+        self.speed_limit = 0  # item speed limit in bytes/sec, 0 for no limit
+        self.priority = 0  # pending queue priority, 1=high, 0=normal, -1=low, see scheduler.Priority
+        self.group = ''  # pending queue fair sharing group, default to host name if empty
+
+        # speed, calculated in background by speed sampler thread, see sampler.py
+        self._speed = 0  # exponentially weighted moving average, bytes/sec
+        self._window_speed = 0  # average over last config.speed_window seconds, bytes/sec
+        self.speed_samples = deque()  # ring buffer of (time, downloaded bytes) samples
+
+        # mirrors, other urls for the same file, segments will be downloaded from all of them
+        self.mirrors = []
+        self.mirror_pool = None  # MirrorPool object, created by brain while downloading
+
+        # metalink pieces, every piece of temp file will be verified against its hash once written
+        self.piece_length = 0
+        self.piece_hash_type = ''  # hashlib name i.e. 'sha1'
+        self.piece_hashes = []
+        self.file_hashes = {}  # whole file hashes, {hashlib name: hex digest}, checked after download is completed
 
         # segments
         self.segments = []
+        self.completed_q = Queue()  # workers put downloaded segments here, to be merged by brain.file_manager()
+        self.jobs_q = Queue()  # workers put back failed segments here, to be retried by brain.thread_manager()
+        self.error_q = Queue()  # (host, error) reported by workers, to control connections by brain.thread_manager()
+
+        # libcurl timing info for last segment transfers, see Worker.record_transfer_stats()
+        self.transfer_stats = deque(maxlen=config.transfer_stats_size)
+
+        # segment sizing decisions made by planner, for debugging, see planner.py
+        self.plan_decisions = deque(maxlen=planner.max_decisions)
 
         # fragmented video parameters will be updated from video subclass object / update_param()
         self.fragment_base_url = None
@@ -212,7 +304,9 @@ class DownloadItem:
                                  '_remaining_parts', 'audio_url', 'audio_size', 'type', 'subtype_list', 'fragments',
                                  'fragment_base_url', 'audio_fragments', 'audio_fragment_base_url',
                                  '_total_size', 'protocol', 'manifest_url', 'selected_subtitles',
-                                 'abr', 'tbr', 'format_id', 'audio_format_id', 'resolution', 'audio_quality']
+                                 'abr', 'tbr', 'format_id', 'audio_format_id', 'resolution', 'audio_quality',
+                                 'mirrors', 'piece_length', 'piece_hash_type', 'piece_hashes', 'file_hashes', 'priority',
+                                 'group', 'sched', 'sched_stop', 'sched_days', 'speed_limit', 'vcodec', 'acodec']
 
         # property to indicate that there is a time consuming operation is running on download item now
         self.busy = False
@@ -246,30 +340,51 @@ class DownloadItem:
 
     @property
     def speed(self):
-        """return an average of some speed values will give a stable speed reading"""
-        if self.status != config.Status.downloading:  # or not self.speed_buffer:
-            self._speed = 0
-        else:
-            if not self.prev_downloaded_value:
-                self.prev_downloaded_value = self.downloaded
+        """current speed in bytes/sec, a moving average updated by speed sampler, reading it has no side effects"""
+        return self._speed if self.status == config.Status.downloading else 0
 
-            time_passed = time.time() - self.speed_timer
-            if time_passed >= self.speed_refresh_rate:
-                self.speed_timer= time.time()
-                delta = self.downloaded - self.prev_downloaded_value
-                self.prev_downloaded_value = self.downloaded
-                _speed = delta / time_passed
+    @property
+    def window_speed(self):
+        """average speed over last config.speed_window seconds, more stable than speed, used for time left"""
+        return self._window_speed if self.status == config.Status.downloading else 0
+
+    def reset_speed(self):
+        """clear speed samples, ring buffer size follows current sampler settings"""
+        size = max(int(config.speed_window / config.speed_sample_interval), 1) + 1
+        self.speed_samples = deque(maxlen=size)
+        self._speed = 0
+        self._window_speed = 0
 
-                # to get a stable speed reading will use an average of multiple speed readings
-                self.speed_buffer.append(_speed)
-                avg_speed = sum(self.speed_buffer) / len(self.speed_buffer)
-                if len(self.speed_buffer) > 10:
-                    self.speed_buffer.popleft()
+    def transfer_stats_summary(self):
+        """
+        calculate median and 95th percentile for transfer timing fields
+        :return: dict {field: (p50, p95)}
+        """
+        records = list(self.transfer_stats)
+        summary = {}
+        for field in TRANSFER_STATS_SUMMARY_FIELDS:
+            values = [record[field] for record in records]
+            summary[field] = (percentile(values, 50), percentile(values, 95))
 
-                if avg_speed:
-                    self._speed = avg_speed if avg_speed > 0 else 0
+        return summary
 
-        return self._speed
+    def export_transfer_stats(self, file):
+        """
+        save transfer timing records as csv file
+        :param file: csv file path
+        :return: True on success
+        """
+        try:
+            with open(file, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=TRANSFER_STATS_FIELDS)
+                writer.writeheader()
+                writer.writerows(list(self.transfer_stats))
+
+            log(f'exported {len(self.transfer_stats)} transfer records to:', file)
+            return True
+        except Exception as e:
+            log('export_transfer_stats()> error:', e)
+            return False
 
     @property
     def lock(self):
@@ -317,7 +432,8 @@ class DownloadItem:
     @property
     def time_left(self):
         if self.status == config.Status.downloading and self.total_size and self.total_size >= self.downloaded:
-            return (self.total_size - self.downloaded) / self.speed if self.speed else -1
+            speed = self.window_speed
+            return (self.total_size - self.downloaded) / speed if speed else -1
         else:
             return '---'
 
@@ -333,6 +449,13 @@ class DownloadItem:
         if self.subprocess and value in (config.Status.cancelled, config.Status.error):
             self.kill_subprocess()
 
+    @property
+    def connections_info(self):
+        """live connections for display, marked with ~ if estimated"""
+        if self.multiplexed:
+            return f'~{self.live_connections} ({self.live_streams} streams)'
+        return str(self.live_connections)
+
     @property
     def num(self):
         return self.id + 1 if isinstance(self.id, int) else self.id
@@ -370,7 +493,7 @@ class DownloadItem:
     @property
     def i(self):
         # This is where we put the animation letter
-        if self.sched:
+        if self.sched and self.status != config.Status.downloading:
             selected_image = self.sched_string
         else:
             icon_list = self.animation_icons.get(self.status, [''])
@@ -400,6 +523,10 @@ class DownloadItem:
         # t = time.localtime(self.sched)
         # text = f"⏳({t.tm_hour}:{t.tm_min})"
         text = f"{self.sched[0]:02}:{self.sched[1]:02}"
+        if self.sched_stop:
+            text += f"-{self.sched_stop[0]:02}:{self.sched_stop[1]:02}"
+        if self.sched_days:
+            text = '↻' + text
         # text = f"⏳{self.sched[0]:02}:{self.sched[1]:02}"
         return text
 
@@ -449,14 +576,19 @@ class DownloadItem:
         except Exception as e:
             log('DownloadItem.kill_subprocess()> error', e)
 
-    def update(self, url):
-        """get headers and update properties (eff_url, name, ext, size, type, resumable, status code/description)"""
+    def update(self, url, headers=None, use_cache=True):
+        """
+        get headers and update properties (eff_url, name, ext, size, type, resumable, status code/description)
+        :param url: url
+        :param headers: headers dictionary if already fetched, see utils.get_headers_many()
+        :param use_cache: False to request fresh headers instead of recently cached ones
+        """
         # log('*'*20, 'update download item')
 
         if url in ('', None):
             return
 
-        headers = get_headers(url)
+        headers = headers if headers is not None else get_headers(url, use_cache=use_cache)
         # print('update d parameters:', headers)
 
         # update headers only if no other update thread created with different url
@@ -541,7 +673,8 @@ class DownloadItem:
             # general files or video files with known sizes and resumable
             if self.resumable and self.size:
                 # get list of ranges i.e. [[0, 100], [101, 2000], ... ]
-                range_list = get_range_list(self.size)
+                range_list = get_range_list(self.size, piece_length=self.piece_length if self.piece_hashes else 0,
+                                            segment_size=planner.initial_segment_size(self))
             else:
                 range_list = [None]  # add None in a list to make one segment with range=None
 
@@ -562,7 +695,7 @@ class DownloadItem:
                     for i, x in enumerate(self.audio_fragments)]
 
             else:
-                range_list = get_range_list(self.audio_size)
+                range_list = get_range_list(self.audio_size, segment_size=planner.initial_segment_size(self))
 
                 audio_segments = [
                     Segment(name=os.path.join(self.temp_folder, str(i) + '_audio'), num=i, range=x,
@@ -625,7 +758,7 @@ class DownloadItem:
                 for i, item in enumerate(progress_info):
                     try:
                         seg = Segment()
-                        seg.__dict__.update(item)
+                        update_object(seg, item)
 
                         # update tempfile and url
                         if seg.media_type == MediaType.audio:
@@ -644,7 +777,7 @@ class DownloadItem:
             elif self.segments:
                 for seg, item in zip(self.segments, progress_info):
                     if seg.name == item.get('name'):
-                        seg.__dict__.update(item)
+                        update_object(seg, item)
                 log('load_progress_info()> updated current segments for:', self.name)
 
             # update self.downloaded
@@ -0,0 +1,280 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# disk governor, a download needs much more disk space than its final size before it is done, segment files and temp
+# file exist together, dash audio and video are merged by ffmpeg into a third file, and audio conversion writes
+# another file, a download which runs out of space fails late, usually while post processing.
+# before starting, every download reserves its peak disk need on its file system, downloads which don't fit wait in
+# pending queue, a monitor thread pauses newest downloads if free space drops "i.e. by other programs", and resumes
+# them when space is available again.
+# new downloads are also held while disk write latency is high, more parallel writers would make it worse.
+
+import math
+import os
+import time
+from threading import Thread, Lock
+
+from . import config
+from .config import Status
+from .utils import log, size_format, get_free_space, execute_command
+
+_lock = Lock()
+_reserved = {}  # {download id: DownloadItem}, downloads which reserved disk space
+_paused = {}  # {download id: DownloadItem}, downloads paused for low disk space, resumed by monitor
+_warned = set()  # download ids which user was told about missing disk space
+_latency = {}  # {file system id: (write latency ewma in seconds, last sample time)}
+_usage = {}  # {download id: (bytes on disk, time)}, cached for one check interval, see used_space()
+_thread = None
+
+
+def fs_id(folder):
+    """file system identifier of a folder, first existing parent is used if folder doesn't exist yet"""
+    folder = os.path.abspath(folder or config.download_folder)
+    while not os.path.exists(folder) and os.path.dirname(folder) != folder:
+        folder = os.path.dirname(folder)
+
+    try:
+        return os.stat(folder).st_dev
+    except Exception:
+        return folder
+
+
+def disk_usage(file):
+    """allocated bytes of a file "preallocated or sparse files count by their real blocks", 0 if missing"""
+    try:
+        st = os.stat(file)
+        return st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size
+    except Exception:
+        return 0
+
+
+def space_factor(d):
+    """
+    peak disk need as a multiple of final size
+    segments + temp file = 2, dash video and audio merged into output file +1, audio conversion output file +1
+    """
+    factor = 2
+    if 'dash' in d.subtype_list:
+        factor += 1
+    if d.type == 'audio':
+        factor += 1
+    return factor
+
+
+def used_space(d):
+    """
+    bytes already on disk for download item's temp files, scanning temp folder costs a stat per segment file, and
+    scheduler checks every pending item twice a second, so result is cached for config.disk_check_interval
+    """
+    now = time.time()
+    with _lock:
+        used, t = _usage.get(d.id, (0, 0))
+    if now - t < config.disk_check_interval:
+        return used
+
+    used = disk_usage(d.temp_file) + disk_usage(d.audio_file)
+    try:
+        with os.scandir(d.temp_folder) as entries:
+            for entry in entries:
+                used += disk_usage(entry.path)
+    except Exception:
+        pass
+
+    with _lock:
+        _usage[d.id] = (used, now)
+    return used
+
+
+def peak_need(d, used=None):
+    """
+    remaining disk space download item still needs until done, including post processing
+    :param d: DownloadItem
+    :param used: bytes already on disk for this item, will be calculated if None
+    :return: bytes, zero if size is unknown
+    """
+    total = d.total_size or d.size or 0
+    if not total:
+        return 0
+
+    used = used_space(d) if used is None else used
+    return max(space_factor(d) * total - used, 0)
+
+
+def available(folder, exclude=None):
+    """
+    free space of folder's file system minus margin and space reserved by other downloads
+    :param folder: folder path
+    :param exclude: download item to be excluded from reservations
+    :return: bytes or None if free space is not available
+    """
+    free = get_free_space(folder)
+    if free is None:
+        return None
+
+    fs = fs_id(folder)
+    with _lock:
+        others = [x for x in _reserved.values() if x is not exclude]
+
+    reserved = sum(peak_need(x) for x in others if fs_id(x.folder) == fs)
+    return free - config.min_free_space - reserved
+
+
+def record_write(fs, seconds):
+    """
+    record disk write latency, called by writer threads for every disk write
+    :param fs: file system id, see fs_id()
+    :param seconds: write duration
+    """
+    now = time.time()
+    with _lock:
+        if fs in _latency:
+            value, t = _latency[fs]
+            alpha = 1 - math.exp(-(now - t) / 2)  # time based moving average, 2 seconds smoothing
+            value += alpha * (seconds - value)
+        else:
+            value = seconds
+        _latency[fs] = (value, now)
+
+
+def write_latency(fs):
+    """current write latency of file system in seconds, decays to zero if no writes recently"""
+    with _lock:
+        value, t = _latency.get(fs, (0, 0))
+    return value if time.time() - t < 10 else 0
+
+
+def can_start(d):
+    """
+    check if download item fits on its file system and disk is not overloaded, used by scheduler before starting
+    :param d: DownloadItem
+    :return: True if download can start now
+    """
+    fs = fs_id(d.folder)
+
+    latency = write_latency(fs)
+    if config.max_write_latency and latency > config.max_write_latency:
+        log(f'governor> disk busy, write latency: {latency * 1000:.0f} ms, holding: {d.name}', log_level=3)
+        return False
+
+    need = peak_need(d)
+    space = available(d.folder, exclude=d)
+    if space is None or need <= space:
+        _warned.discard(d.id)
+        return True
+
+    # tell user once, item will wait in pending queue
+    if d.id not in _warned:
+        _warned.add(d.id)
+        log(f'Not enough disk space to download "{d.name}" now, required: {size_format(need)}, '
+            f'available: {size_format(max(space, 0))}, it will start when space is available', showpopup=True)
+    return False
+
+
+def reserve(d):
+    """
+    reserve disk space for download item before starting
+    :param d: DownloadItem
+    :return: True on success, False if not enough space
+    """
+    with _lock:
+        if d.id in _reserved:
+            return True  # reserved by scheduler when it picked this item
+
+    need = peak_need(d)
+    space = available(d.folder, exclude=d)
+    if space is not None and need > space:
+        return False
+
+    with _lock:
+        _reserved[d.id] = d
+        _paused.pop(d.id, None)
+
+    log(f'governor> reserved {size_format(need)} for {d.name}', log_level=3)
+    start_monitor()
+    return True
+
+
+def release(d):
+    """release download item's reservation, called when brain quits"""
+    with _lock:
+        _reserved.pop(d.id, None)
+        _usage.pop(d.id, None)
+
+
+def check():
+    """pause newest downloads on file systems running out of space, and resume paused downloads if space is back"""
+    with _lock:
+        reserved = list(_reserved.values())
+        paused = list(_paused.values())
+
+    # group downloading items by file system
+    groups = {}
+    for d in reserved:
+        if d.status == Status.downloading:
+            groups.setdefault(fs_id(d.folder), []).append(d)
+
+    for items in groups.values():
+        free = get_free_space(items[0].folder)
+        if free is None:
+            continue
+
+        # pause newest downloads until the rest fits
+        shortage = sum(peak_need(d) for d in items) + config.min_free_space - free
+        for d in reversed(items):
+            if shortage <= 0:
+                break
+            shortage -= peak_need(d)
+            log(f'Low disk space, pausing "{d.name}", free: {size_format(free)}', showpopup=True)
+            with _lock:
+                _paused[d.id] = d
+            d.status = Status.cancelled
+
+    for d in paused:
+        # user started or removed it
+        if d.status != Status.cancelled or d not in config.d_list:
+            with _lock:
+                _paused.pop(d.id, None)
+            continue
+
+        # wait for its brain to quit and release reservation
+        if d.id in _reserved:
+            continue
+
+        if can_start(d):
+            with _lock:
+                _paused.pop(d.id, None)
+            log(f'governor> disk space available, resuming: {d.name}', log_level=2)
+            execute_command('start_download', d, silent=True)
+
+
+def monitor():
+    global _thread
+
+    while not config.terminate:
+        time.sleep(config.disk_check_interval)
+
+        try:
+            check()
+        except Exception as e:
+            log('governor> error:', e)
+            if config.TEST_MODE:
+                raise e
+
+        with _lock:
+            if not _reserved and not _paused:
+                _thread = None
+                break
+
+
+def start_monitor():
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = Thread(target=monitor, daemon=True, name='disk_governor')
+            _thread.start()
@@ -17,18 +17,25 @@ import os
 import time
 import copy
 from threading import Thread, Lock
-from collections import deque
 
 from .utils import *
 from . import setting
 from . import config
 from .config import Status
 from . import update
+from . import metrics
+from . import dns
+from . import scheduler
+from .scheduler import Priority
+from . import timetable
 from .brain import brain
 from . import video
 from .video import Video, check_ffmpeg, download_ffmpeg, unzip_ffmpeg, get_ytdl_options, process_video_info, \
     download_m3u8, parse_subtitles
 from .downloaditem import DownloadItem
+from .metalink import load_metalink, create_download_item
+from .batch import download_batch
+from .urllist import parse_url_list, import_url_list
 from .iconsbase64 import *
 
 # imports for systray icon
@@ -86,7 +93,6 @@ class MainWindow:
         self.requested_quality = None  # it will be used when refresh link pressed to select the same quality for selected item
 
         # download
-        self.pending = deque()  # todo: use normal queue
 
         # download list
         self.d_headers = ['i', 'name', 'progress', 'speed', 'time_left', 'downloaded', 'total_size', 'status']
@@ -112,7 +118,7 @@ class MainWindow:
     @staticmethod
     def startup():
         # start log recorder
-        Thread(target=log_recorder, daemon=True).start()
+        start_log_recorder()
 
         log('-' * 50, 'PyIDM', '-' * 50)
         log('Starting PyIDM version:', config.APP_VERSION, 'Frozen' if config.FROZEN else 'Non-Frozen')
@@ -141,6 +147,13 @@ class MainWindow:
         # update d_list
         self.d_list = config.d_list  # list of DownloadItem() objects
 
+        # scheduled downloads and bandwidth profiles
+        timetable.start()
+
+        # local metrics endpoint
+        if config.metrics_enabled:
+            metrics.start_server()
+
         # set global theme
         self.select_theme()
 
@@ -240,7 +253,7 @@ class MainWindow:
 
             # url entry
             [sg.T('Link:  '),
-            sg.Input(self.d.url, enable_events=True, key='url', size=(49, 1),  right_click_menu=['url', ['copy url', 'paste url']]),
+            sg.Input(self.d.url, enable_events=True, key='url', size=(49, 1),  right_click_menu=['url', ['copy url', 'paste url', 'import metalink', 'import url list', 'batch download']]),
             sg.Button('', key='Retry', tooltip=' retry ', image_data=refresh_icon, **transparent)],
 
             # playlist/video block
@@ -288,7 +301,9 @@ class MainWindow:
         table_right_click_menu = ['Table', ['!Options for selected file:', '---', 'Open File', 'Open File Location',
                                             '▶ Watch while downloading', 'copy webpage url', 'copy direct url',
                                             'copy playlist url', '⏳ Schedule download', '⏳ Cancel schedule!',
-                                            'properties']]
+                                            'add mirrors', 'Priority', ['high priority', 'normal priority',
+                                                                        'low priority'],
+                                            'properties', 'export connection stats']]
 
         # buttons
         resume_btn = sg.Button('', key='Resume', tooltip=' Resume ', image_data=resume_icon, **transparent)
@@ -393,7 +408,10 @@ class MainWindow:
                          enable_events=True, key='manually_select_dash_audio')],
 
             [sg.Checkbox('Auto rename file if same name exists in download folder', default=config.auto_rename,
-                         enable_events=True, key='auto_rename')]
+                         enable_events=True, key='auto_rename')],
+
+            [sg.Checkbox('Refresh expired video links automatically while downloading',
+                         default=config.auto_refresh_links, enable_events=True, key='auto_refresh_links')]
         ]
 
         network = [
@@ -406,13 +424,27 @@ class MainWindow:
                       disabled=False if config.speed_limit else True, enable_events=True),
              sg.T('0', size=(30, 1), key='current_speed_limit'),
              sg.T('*ex: 512 KB or 5 MB', font='any 8')],
+            [sg.T('Time profiles:'),
+             sg.Input(default_text=timetable.format_profiles(config.bandwidth_profiles), size=(40, 1),
+                      key='bandwidth_profiles', enable_events=True,
+                      tooltip=' speed limit during time windows, "[days] start-stop limit" separated by ";" '),
+             sg.T('*ex: 01:00-07:00 unlimited; sat,sun 00:00-24:00 2 MB', font='any 8')],
             # [sg.T('', font='any 1')],  # spacer
             [sg.Text('Max concurrent downloads:      '),
              sg.Combo(values=[x for x in range(1, 101)], size=(5, 1), enable_events=True,
                       key='max_concurrent_downloads', default_value=config.max_concurrent_downloads)],
+            [sg.Text('Max downloads per server:       '),
+             sg.Combo(values=['no limit'] + [x for x in range(1, 101)], size=(7, 1), enable_events=True,
+                      key='max_downloads_per_host', default_value=config.max_downloads_per_host or 'no limit')],
             [sg.Text('Max connections per download:'),
              sg.Combo(values=[x for x in range(1, 101)], size=(5, 1), enable_events=True,
                       key='max_connections', default_value=config.max_connections)],
+            [sg.Text('Max connections per server:    '),
+             sg.Combo(values=['no limit'] + [x for x in range(1, 201)], size=(7, 1), enable_events=True,
+                      key='max_connections_per_host', default_value=config.max_connections_per_host or 'no limit'),
+             sg.Text('Total:'),
+             sg.Combo(values=['no limit'] + [x for x in range(1, 501)], size=(7, 1), enable_events=True,
+                      key='max_total_connections', default_value=config.max_total_connections or 'no limit')],
             [sg.T('', font='any 1')],  # spacer
             [sg.Checkbox('Proxy:', default=config.enable_proxy, key='enable_proxy',
                          enable_events=True),
@@ -496,6 +528,14 @@ class MainWindow:
                          default=config.checksum, key='checksum', enable_events=True, )],
             [sg.Checkbox('Use ThreadPoolExecutor instead of individual threads',
                          default=config.use_thread_pool_executor, key='use_thread_pool_executor', enable_events=True, )],
+            [sg.Checkbox('Use HTTP/2 to multiplex segments over one connection "if supported by server"',
+                         default=config.use_http2, key='use_http2', enable_events=True, )],
+            [sg.Checkbox('Adapt segment size to measured connection latency and throughput',
+                         default=config.adaptive_segments, key='adaptive_segments', enable_events=True, )],
+            [sg.Checkbox('Expose engine metrics on local port', default=config.metrics_enabled, key='metrics_enabled',
+                         enable_events=True, ),
+             sg.Input(config.metrics_port, size=(6, 1), key='metrics_port', enable_events=True),
+             sg.T('/metrics "prometheus", /metrics.json', font='any 8')],
         ]
 
         # layout ----------------------------------------------------------------------------------------------------
@@ -697,8 +737,8 @@ class MainWindow:
         """
         # update log
         # read 10 messages max every time to prevent application freeze, in case of error messages flood by ffmpeg
-        for _ in range(min(100, config.log_q.qsize())):
-            line = config.log_q.get()
+        for _ in range(min(100, len(config.log_q))):
+            line = config.log_q.popleft()
             try:
                 contents = self.window['log'].get()
                 # print(size_format(len(contents)))
@@ -799,10 +839,11 @@ class MainWindow:
                 self.update_table()
 
             # update active and pending downloads
-            self.window['active_downloads'](f' {len(self.active_downloads)} ▼  |  {len(self.pending)} ⏳')
+            self.window['active_downloads'](f' {len(self.active_downloads)} ▼  |  {len(scheduler.pending_items())} ⏳')
 
             # Settings
-            speed_limit = size_format(config.speed_limit) if config.speed_limit > 0 else "_no limit_"
+            speed_limit = timetable.global_speed_limit()
+            speed_limit = size_format(speed_limit) if speed_limit > 0 else "_no limit_"
             self.window['current_speed_limit'](f'Current value: {speed_limit}')
 
             self.window['youtube_dl_update_note'](
@@ -833,7 +874,7 @@ class MainWindow:
                 out = f"{self.selected_row_num + 1}- {self.fit_text(d.name, 75)}\n" \
                       f"Done: {size_format(d.downloaded)} of {size_format(d.total_size)}\n" \
                       f"{speed} \n" \
-                      f"Live connections: {d.live_connections} - Remaining parts: {d.remaining_parts} - ({d.type}, {', '.join(d.subtype_list)}) \n" \
+                      f"Live connections: {d.connections_info} - Remaining parts: {d.remaining_parts} - ({d.type}, {', '.join(d.subtype_list)}) \n" \
                       f"{d.status}  {d.i}"
 
                 # thumbnail
@@ -867,9 +908,10 @@ class MainWindow:
 
             # critical_settings_warning: sometimes user set proxy or speed limit in settings and forget it is
             # already set, which affect the whole application operation, will show a flashing text at main Tab
-            if config.proxy or config.speed_limit:
+            speed_limit = timetable.global_speed_limit()
+            if config.proxy or speed_limit:
                 proxy = 'proxy: active, ' if config.proxy else ''
-                sl = f'Speed Limit: {size_format(config.speed_limit)}' if config.speed_limit else ''
+                sl = f'Speed Limit: {size_format(speed_limit)}' if speed_limit else ''
                 self.window['critical_settings_warning'](proxy + sl)
                 flip_visibility(self.window['critical_settings_warning'])
             else:
@@ -1086,6 +1128,8 @@ class MainWindow:
         try:
 
             if d:
+                priority_names = {Priority.high: 'high', Priority.normal: 'normal', Priority.low: 'low'}
+
                 # General properties
                 text = f'Name: {d.name} \n' \
                        f'Folder: {d.folder} \n' \
@@ -1093,6 +1137,7 @@ class MainWindow:
                        f'Downloaded: {size_format(d.downloaded)} \n' \
                        f'Total size: {size_format(d.total_size)} \n' \
                        f'Status: {d.status} \n' \
+                       f'Priority: {priority_names.get(d.priority, d.priority)} \n' \
                        f'Resumable: {d.resumable} \n' \
                        f'Type: {d.type} - subtype: {", ".join(d.subtype_list)}\n'
 
@@ -1109,10 +1154,52 @@ class MainWindow:
                     text += f'Webpage url: {d.url}\n\n' \
                             f'Direct url: {d.eff_url}\n\n'
 
+                if d.mirrors:
+                    text += 'Mirrors:\n' + '\n'.join(d.mirrors) + '\n\n'
+
+                # connection timing for last segments transfers
+                if d.transfer_stats:
+                    text += f'Connection timing "last {len(d.transfer_stats)} transfers", median / 95th percentile:\n'
+                    for field, (p50, p95) in d.transfer_stats_summary().items():
+                        if field == 'speed_download':
+                            text += f'  speed: {size_format(p50, "/s")} / {size_format(p95, "/s")}\n'
+                        else:
+                            text += f'  {field.replace("_time", "")}: {p50 * 1000:.0f} ms / {p95 * 1000:.0f} ms\n'
+                    reused = sum(1 for record in d.transfer_stats if record['num_connects'] == 0)
+                    text += f'  reused connections: {reused} of {len(d.transfer_stats)}\n'
+
+                # segment planner decisions
+                if d.plan_decisions:
+                    text += '\nSegment planner decisions:\n'
+                    for x in list(d.plan_decisions)[-10:]:
+                        text += f'  {time.strftime("%H:%M:%S", time.localtime(x["time"]))} {x["kind"]}: ' \
+                                f'{size_format(x["size"])} - setup: {(x["setup_time"] or 0) * 1000:.0f} ms, ' \
+                                f'throughput: {size_format(x["throughput"], "/s")} ({x["source"]})\n'
+
                 sg.popup_scrolled(text, title='Download Item properties', size=(50, 20), non_blocking=True)
         except Exception as e:
             log('gui> properties>', e)
 
+    def export_transfer_stats(self, d):
+        """
+        save connection timing records of a download item to a csv file chosen by user
+        :param d: DownloadItem object
+        :return: None
+        """
+        if not d:
+            return
+
+        if not d.transfer_stats:
+            sg.popup_ok('No connection stats recorded for this item yet, stats are collected while downloading',
+                        title='info')
+            return
+
+        file = sg.popup_get_file('Save connection stats as:', save_as=True, default_extension='csv',
+                                 file_types=(('CSV', '*.csv'),), title='Export connection stats',
+                                 initial_folder=d.folder, default_path=os.path.join(d.folder, f'{d.name}_stats.csv'))
+        if file:
+            d.export_transfer_stats(file)
+
     # endregion
 
     def run(self):
@@ -1188,6 +1275,15 @@ class MainWindow:
                 self.window['url'](clipboard.paste().strip())
                 self.on_url_text_change()
 
+            elif event == 'import metalink':
+                self.import_metalink()
+
+            elif event == 'import url list':
+                self.import_url_list()
+
+            elif event == 'batch download':
+                self.batch_download()
+
             # video events
             elif event == 'main_thumbnail':
                 self.show_properties(self.d)
@@ -1244,14 +1340,26 @@ class MainWindow:
                 # right click properties
                 self.show_properties(self.selected_d)
 
+            elif event in ('high priority', 'normal priority', 'low priority'):
+                priorities = {'high priority': Priority.high, 'normal priority': Priority.normal,
+                              'low priority': Priority.low}
+                if self.selected_d:
+                    self.selected_d.priority = priorities[event]
+
+            elif event == 'add mirrors':
+                self.ask_for_mirrors(self.selected_d)
+
+            elif event == 'export connection stats':
+                self.export_transfer_stats(self.selected_d)
+
             elif event in ('⏳ Schedule download', 'schedule_item'):
                 # print('schedule clicked')
                 response = self.ask_for_sched_time(msg=self.selected_d.name)
                 if response:
-                    self.selected_d.sched = response
+                    timetable.schedule_item(self.selected_d, **response)
 
             elif event == '⏳ Cancel schedule!':
-                self.selected_d.sched = None
+                timetable.unschedule(self.selected_d)
 
             elif event == 'Resume':
                 self.resume_btn()
@@ -1294,7 +1402,7 @@ class MainWindow:
                 if response:
                     for d in self.d_list:
                         if d.status in (Status.pending, Status.cancelled):
-                            d.sched = response
+                            timetable.schedule_item(d, **response)
 
             elif event == 'delete_btn':
                 self.delete_btn()
@@ -1359,6 +1467,9 @@ class MainWindow:
             elif event == 'auto_rename':
                 config.auto_rename = values['auto_rename']
 
+            elif event == 'auto_refresh_links':
+                config.auto_refresh_links = values['auto_refresh_links']
+
             # elif event == 'segment_size':
             #     user_input = values['segment_size']
             #
@@ -1443,9 +1554,25 @@ class MainWindow:
                 sl = parse_bytes(sl)
                 config.speed_limit = sl
 
+            elif event == 'bandwidth_profiles':
+                # ignore incomplete text while user is typing
+                try:
+                    config.bandwidth_profiles = timetable.parse_profiles(values['bandwidth_profiles'])
+                    timetable.reload()
+                except Exception:
+                    pass
+
             elif event == 'max_concurrent_downloads':
                 config.max_concurrent_downloads = int(values['max_concurrent_downloads'])
 
+            elif event in ('max_connections_per_host', 'max_total_connections'):
+                value = values[event]
+                setattr(config, event, 0 if value == 'no limit' else int(value))
+
+            elif event == 'max_downloads_per_host':
+                value = values['max_downloads_per_host']
+                config.max_downloads_per_host = 0 if value == 'no limit' else int(value)
+
             elif event == 'max_connections':
                 mc = int(values['max_connections'])
                 if mc > 0:
@@ -1525,6 +1652,31 @@ class MainWindow:
             elif event == 'use_thread_pool_executor':
                 config.use_thread_pool_executor = values['use_thread_pool_executor']
 
+            elif event == 'use_http2':
+                config.use_http2 = values['use_http2']
+
+            elif event == 'adaptive_segments':
+                config.adaptive_segments = values['adaptive_segments']
+
+            elif event == 'metrics_enabled':
+                config.metrics_enabled = values['metrics_enabled']
+                if config.metrics_enabled:
+                    metrics.start_server()
+                else:
+                    metrics.stop_server()
+
+            elif event == 'metrics_port':
+                try:
+                    port = int(values['metrics_port'])
+                except ValueError:
+                    port = 0
+
+                # ignore incomplete input while typing, i.e. "9" of "9100", and restart running server on new port
+                if 1024 <= port <= 65535 and port != config.metrics_port:
+                    config.metrics_port = port
+                    if config.metrics_enabled:
+                        metrics.restart_server()
+
             # log ---------------------------------------------------------------------------------------------------
             elif event == 'log_level':
                 config.log_level = int(values['log_level'])
@@ -1546,13 +1698,6 @@ class MainWindow:
                 # read incoming requests and messages from queue
                 self.read_q()
 
-                # scheduled downloads
-                self.check_scheduled()
-
-                # process pending jobs
-                if self.pending and len(self.active_downloads) < config.max_concurrent_downloads:
-                    self.start_download(self.pending.popleft(), silent=True)
-
             # run active windows
             for win in self.active_windows:
                 win.run()
@@ -1765,10 +1910,10 @@ class MainWindow:
             # add to download list
             self.d_list.append(d)
 
-        # if max concurrent downloads exceeded, this download job will be added to pending queue
-        if len(self.active_downloads) >= config.max_concurrent_downloads:
-            d.status = Status.pending
-            self.pending.append(d)
+        # if max concurrent downloads or max downloads per host exceeded, this download job will be added to pending
+        # queue and will be started by scheduler
+        if scheduler.pending_items() or not scheduler.can_start(d):
+            scheduler.add(d)
             return None
 
         # create download window and append to active list
@@ -1788,7 +1933,7 @@ class MainWindow:
         for d in self.d_list:
             d.status = Status.cancelled
 
-        self.pending.clear()
+        scheduler.clear()
 
     def resume_all_downloads(self):
         response = sg.PopupOKCancel('Resume "ALL" items?',
@@ -1897,10 +2042,10 @@ class MainWindow:
         if d.status == Status.completed:
             return
 
-        d.status = Status.cancelled
-
         if d.status == Status.pending:
-            self.pending.pop(d.id)
+            scheduler.remove(d)
+
+        d.status = Status.cancelled
 
     def delete_btn(self):
         if self.selected_row_num is None:
@@ -1982,7 +2127,7 @@ class MainWindow:
 
         self.url = ''
         self.window['url'](d.url)
-        self.on_url_text_change()
+        self.on_url_text_change(use_cache=False)
 
         self.window['folder'](config.download_folder)
         self.select_tab('Main')
@@ -2579,7 +2724,11 @@ class MainWindow:
     # endregion
 
     # region General
-    def on_url_text_change(self):
+    def on_url_text_change(self, use_cache=True):
+        """
+        create a new download item for url entered by user
+        :param use_cache: False to request fresh headers, i.e. user pressed retry or refresh link
+        """
         url = self.window['url'].get().strip()
 
         if url == self.url:
@@ -2599,7 +2748,10 @@ class MainWindow:
 
             self.d.folder = config.download_folder
 
-            Thread(target=self.fetch_info, args=[url], daemon=True).start()
+            # start host lookup, it will be ready for headers request and workers
+            dns.prefetch(url)
+
+            Thread(target=self.fetch_info, args=[url, use_cache], daemon=True).start()
 
         except Exception as e:
             log('url_text_change()> error', e)
@@ -2608,8 +2760,8 @@ class MainWindow:
         finally:
             self.set_cursor('default')
 
-    def fetch_info(self, url):
-        self.d.update(url)
+    def fetch_info(self, url, use_cache=True):
+        self.d.update(url, use_cache=use_cache)
 
         # use size to identify a direct download links
         # can't depend on mime-type sent by server since it is not reliable
@@ -2619,7 +2771,7 @@ class MainWindow:
 
     def retry(self):
         self.url = ''
-        self.on_url_text_change()
+        self.on_url_text_change(use_cache=False)
 
     def reset(self):
         # create new download item, the old one will be garbage collected by python interpreter
@@ -2730,24 +2882,36 @@ class MainWindow:
         # Force python garbage collector to free up memory
         gc.collect()
 
-    def check_scheduled(self):
-        t = time.localtime()
-        c_t = (t.tm_hour, t.tm_min)
-        for d in self.d_list:
-            if d.sched and d.sched[0] <= c_t[0] and d.sched[1] <= c_t[1]:
-                self.start_download(d, silent=True)  # send for download
-                d.sched = None  # cancel schedule time
-
     def ask_for_sched_time(self, msg=''):
-        """Show a gui dialog to ask user for schedule time for download items, it take one or more of download items"""
+        """Show a gui dialog to ask user for schedule time for download items, it take one or more of download items
+        :return: None or dictionary of timetable.schedule_item() keyword arguments"""
         response = None
 
+        def time_row(key):
+            return [sg.Combo(values=list(range(1, 13)), default_value=1, size=(5, 1), key=f'{key}_hours'), sg.T('H  '),
+                    sg.Combo(values=list(range(0, 60)), default_value=0, size=(5, 1), key=f'{key}_minutes'),
+                    sg.T('m  '),
+                    sg.Combo(values=['AM', 'PM'], default_value='AM', size=(5, 1), key=f'{key}_am pm')]
+
+        def get_time(key):
+            h = int(v[f'{key}_hours'])
+            if v[f'{key}_am pm'] == 'AM' and h == 12:
+                h = 0
+            elif v[f'{key}_am pm'] == 'PM' and h != 12:
+                h += 12
+
+            m = int(v[f'{key}_minutes'])
+            return h, m
+
         layout = [
             [sg.T('schedule download item:')],
             [sg.T(msg)],
-            [sg.Combo(values=list(range(1, 13)), default_value=1, size=(5, 1), key='hours'), sg.T('H  '),
-             sg.Combo(values=list(range(0, 60)), default_value=0, size=(5, 1), key='minutes'), sg.T('m  '),
-             sg.Combo(values=['AM', 'PM'], default_value='AM', size=(5, 1), key='am pm')],
+            [sg.T('Start:', size=(6, 1))] + time_row('start'),
+            [sg.Checkbox('Stop:', size=(5, 1), key='use_stop')] + time_row('stop'),
+            [sg.Checkbox('Repeat on:', key='repeat')] +
+            [sg.Checkbox(day.title(), key=day, default=True) for day in timetable.WEEKDAYS],
+            [sg.T('Speed limit:'), sg.Input('', size=(10, 1), key='speed_limit'),
+             sg.T('*ex: 512 KB, 0 for no limit, empty to keep current limit', font='any 8')],
             [sg.Ok(), sg.Cancel()]
         ]
 
@@ -2756,22 +2920,146 @@ class MainWindow:
         e, v = window()
 
         if e == 'Ok':
-            h = int(v['hours'])
-            if v['am pm'] == 'AM' and h == 12:
-                h = 0
-            elif v['am pm'] == 'PM' and h != 12:
-                h += 12
+            days = [i for i, day in enumerate(timetable.WEEKDAYS) if v[day]] if v['repeat'] else []
 
-            m = int(v['minutes'])
+            # if no units entered will assume it KB
+            sl = v['speed_limit'].strip()
+            sl = parse_bytes(f'{sl} KB' if sl.isdigit() else sl) if sl else None
 
-            # # assign to download item
-            # d.sched = (h, m)
-
-            response = h, m
+            response = {'start': get_time('start'), 'stop': get_time('stop') if v['use_stop'] else None,
+                        'days': days, 'speed_limit': sl}
 
         window.close()
         return response
 
+    def import_metalink(self):
+        """ask user for a metalink file and add its files to download list"""
+        file = sg.popup_get_file('Select metalink file:', title='Import metalink',
+                                 file_types=(('Metalink', '*.meta4 *.metalink'), ('All files', '*.*')))
+        if not file:
+            return
+
+        try:
+            entries = load_metalink(file)
+        except Exception as e:
+            log('import metalink> error:', e, showpopup=True)
+            return
+
+        if not entries:
+            log('import metalink> no downloadable files found in:', file, showpopup=True)
+            return
+
+        log(f'import metalink> found {len(entries)} file(s):', [entry['name'] for entry in entries])
+
+        def add_items(folder):
+            # fetching headers might take long time, run in a separate thread then start downloads from main thread
+            for entry in entries:
+                try:
+                    d = create_download_item(entry, folder)
+                    execute_command('start_download', d, silent=True)
+                except Exception as e:
+                    log('import metalink> error:', entry['name'], e)
+
+        Thread(target=add_items, daemon=True, args=(config.download_folder,)).start()
+
+    def import_url_list(self):
+        """ask user for a url list file "txt or csv" and add its urls to download list"""
+        file = sg.popup_get_file('Select url list file, text file with one url per line, or csv file with\n'
+                                 'url, name, folder columns "name and folder are optional":', title='Import url list',
+                                 file_types=(('Url list', '*.txt *.csv'), ('All files', '*.*')))
+        if not file:
+            return
+
+        try:
+            entries = parse_url_list(file)
+        except Exception as e:
+            log('import url list> error:', e, showpopup=True)
+            return
+
+        if not entries:
+            log('import url list> no valid urls found in:', file, showpopup=True)
+            return
+
+        log(f'import url list> found {len(entries)} url(s) in:', file)
+
+        def on_items(items):
+            execute_command('start_downloads', items)
+
+        # fetching headers takes time, probe in background then add items in bulk from main thread
+        Thread(target=import_url_list, daemon=True, args=(entries, config.download_folder, on_items)).start()
+
+    def start_downloads(self, items):
+        """start many download items silently, extra items go to pending queue"""
+        for d in items:
+            self.start_download(d, silent=True)
+
+    def batch_download(self):
+        """ask user for a text file with urls "one url per line" of small files, and download them in batch mode"""
+        file = sg.popup_get_file('Select a text file with one url per line:', title='Batch download small files',
+                                 file_types=(('Text', '*.txt'), ('All files', '*.*')))
+        if not file:
+            return
+
+        try:
+            with open(file, encoding='utf-8', errors='ignore') as f:
+                urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        except Exception as e:
+            log('batch download> error:', e, showpopup=True)
+            return
+
+        urls = [url for url in dict.fromkeys(urls) if validate_url(url)]  # remove duplicates and invalid urls
+        if not urls:
+            log('batch download> no valid urls found in:', file, showpopup=True)
+            return
+
+        def run(folder):
+            results = download_batch(urls, folder)
+
+            # large files are better downloaded as normal items with multiple connections
+            for result in results:
+                if result.too_large:
+                    try:
+                        d = DownloadItem(url=result.url, folder=folder)
+                        d.update(result.url)
+                        execute_command('start_download', d, silent=True)
+                    except Exception as e:
+                        log('batch download> error:', result.url, e)
+
+            failed = [result for result in results if result.status == 'failed' and not result.too_large]
+            completed = len([result for result in results if result.status == 'completed'])
+            msg = f'Batch download: {completed} of {len(results)} files completed'
+            if failed:
+                msg += f', {len(failed)} failed:\n' + '\n'.join(f'{r.url} - {r.error}' for r in failed[:20])
+            log(msg, showpopup=True)
+
+        log(f'batch download> {len(urls)} urls, folder:', config.download_folder)
+        Thread(target=run, daemon=True, args=(config.download_folder,)).start()
+
+    def ask_for_mirrors(self, d):
+        """Show a gui dialog to edit mirror urls of a download item, one url per line"""
+        if not d:
+            return
+
+        layout = [
+            [sg.T('Mirrors "other urls for the same file", one url per line:')],
+            [sg.T(self.fit_text(d.name, 75), font='any 8')],
+            [sg.Multiline('\n'.join(d.mirrors), size=(70, 8), key='mirrors')],
+            [sg.Ok(), sg.Cancel()]
+        ]
+
+        window = sg.Window('Mirrors', layout, finalize=True)
+
+        e, v = window()
+
+        if e == 'Ok':
+            urls = [url.strip() for url in v['mirrors'].splitlines()]
+            d.mirrors = [url for url in dict.fromkeys(urls) if validate_url(url)]  # remove duplicates and invalid urls
+            log(f'{d.name}: mirrors:', d.mirrors)
+            if d.status == Status.downloading:
+                sg.popup_ok('Changes will take effect after resuming this download', title='Mirrors')
+
+        window.close()
+
     def set_proxy(self):
         enable_proxy = self.window['enable_proxy'].get()
         config.enable_proxy = enable_proxy
@@ -2920,7 +3208,7 @@ class DownloadWindow:
         out = f"File: {name}\n" \
               f"downloaded: {size_format(self.d.downloaded)} out of {size_format(self.d.total_size)}\n" \
               f"speed: {size_format(self.d.speed, '/s') }  {time_format(self.d.time_left)} left \n" \
-              f"live connections: {self.d.live_connections} - remaining parts: {self.d.remaining_parts} {errors}\n"
+              f"live connections: {self.d.connections_info} - remaining parts: {self.d.remaining_parts} {errors}\n"
 
         try:
             self.window['out'](value=out)
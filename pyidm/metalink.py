@@ -0,0 +1,271 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# metalink support, a metalink file "RFC 5854 .meta4 or older v3 .metalink" describes one or more files with mirrors
+# urls, file size, and pieces hashes, mirrors are used as parallel sources and every piece is verified as soon as it
+# is written into temp file, failed pieces only will be downloaded again, and mirror which sent bad data is dropped.
+# whole file hashes are checked after all segments merged.
+
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+
+from .utils import log, validate_file_name
+from .downloaditem import DownloadItem
+
+
+def _local(tag):
+    """remove xml namespace from tag name, i.e. '{urn:ietf:params:xml:ns:metalink}file' ==> 'file'"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(element, name):
+    return [e for e in element if _local(e.tag) == name]
+
+
+def _child(element, name):
+    items = _children(element, name)
+    return items[0] if items else None
+
+
+# preferred whole file hash types, strongest first
+HASH_STRENGTH = ('sha512', 'sha384', 'sha256', 'sha224', 'sha1', 'md5')
+
+
+def hash_name(metalink_type):
+    """convert metalink hash type into hashlib name, i.e. 'sha-256' ==> 'sha256', return None if not supported"""
+    name = metalink_type.lower().replace('-', '')
+    return name if name in hashlib.algorithms_available else None
+
+
+def parse_metalink(data):
+    """
+    parse metalink xml contents
+    :param data: xml string or bytes
+    :return: list of dictionaries, one per file, i.e.
+        [{'name': 'x.iso', 'size': 1000, 'urls': [url1, url2], 'hashes': {'sha256': 'xxx'},
+          'piece_length': 262144, 'piece_hash_type': 'sha1', 'piece_hashes': ['xx', 'yy', ...]}, ...]
+    """
+    root = ET.fromstring(data)
+
+    files = []
+    for f in root.iter():
+        if _local(f.tag) != 'file':
+            continue
+
+        item = {'name': validate_file_name(os.path.basename(f.get('name', ''))), 'size': 0, 'urls': [], 'hashes': {},
+                'piece_length': 0, 'piece_hash_type': '', 'piece_hashes': []}
+
+        size = _child(f, 'size')
+        if size is not None and size.text:
+            item['size'] = int(size.text.strip())
+
+        # v3 keeps hashes inside "verification" and urls inside "resources" elements
+        containers = [f] + _children(f, 'verification') + _children(f, 'resources')
+
+        urls = []  # list of (priority, url), lower priority value is preferred
+        for container in containers:
+            for url in _children(container, 'url'):
+                if not url.text or url.get('type', 'http') not in ('http', 'https', 'ftp'):
+                    continue
+
+                if url.get('priority'):
+                    priority = int(url.get('priority'))
+                else:
+                    priority = 1000 - int(url.get('preference', 0))  # v3 higher preference is better
+                urls.append((priority, url.text.strip()))
+
+            for h in _children(container, 'hash'):
+                name = hash_name(h.get('type', ''))
+                if name and h.text:
+                    item['hashes'][name] = h.text.strip().lower()
+
+            pieces = _child(container, 'pieces')
+            if pieces is not None:
+                name = hash_name(pieces.get('type', ''))
+                if name:
+                    item['piece_length'] = int(pieces.get('length', 0))
+                    item['piece_hash_type'] = name
+                    item['piece_hashes'] = [h.text.strip().lower() for h in _children(pieces, 'hash') if h.text]
+                else:
+                    log('metalink> unsupported pieces hash type:', pieces.get('type'))
+
+        item['urls'] = [url for _, url in sorted(urls, key=lambda x: x[0])]
+
+        if item['name'] and item['urls']:
+            files.append(item)
+        else:
+            log('metalink> skip file entry without name or urls:', item['name'])
+
+    return files
+
+
+def strongest_hash(hashes):
+    """
+    choose strongest whole file hash
+    :param hashes: dictionary, {hashlib name: hex digest}
+    :return: (hashlib name, hex digest) or None
+    """
+    for name in HASH_STRENGTH:
+        if hashes.get(name):
+            return name, hashes[name]
+
+    for name, value in hashes.items():
+        if name in hashlib.algorithms_available and value:
+            return name, value
+
+    return None
+
+
+def verify_file(file, hashes, chunk_size=1024 * 1024):
+    """
+    check a file against strongest of its whole file hashes
+    :param file: file path
+    :param hashes: dictionary, {hashlib name: hex digest}
+    :param chunk_size: bytes read at once
+    :return: True if matched or no usable hash, False if mismatch
+    """
+    choice = strongest_hash(hashes)
+    if not choice:
+        return True
+
+    name, expected = choice
+    h = hashlib.new(name)
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+    if h.hexdigest() != expected.lower():
+        log(f'metalink> {os.path.basename(file)} {name} mismatch, expected: {expected}, found: {h.hexdigest()}')
+        return False
+
+    log(f'metalink> {os.path.basename(file)} {name} verified', log_level=2)
+    return True
+
+
+def load_metalink(file):
+    """
+    read and parse a metalink file from disk
+    :param file: file path
+    :return: list of file entries, see parse_metalink()
+    """
+    with open(file, 'rb') as f:
+        return parse_metalink(f.read())
+
+
+def create_download_item(entry, folder):
+    """
+    create a DownloadItem from a metalink file entry, it will fetch headers from first url
+    :param entry: dictionary, one item of parse_metalink() output
+    :param folder: download folder
+    :return: DownloadItem object
+    """
+    url = entry['urls'][0]
+    d = DownloadItem(url=url, folder=folder)
+    d.update(url)
+
+    d.name = entry['name']
+    d.mirrors = entry['urls'][1:]
+
+    if entry['size']:
+        if d.size and d.size != entry['size']:
+            log(f'metalink> {d.name}: server size {d.size} differs from metalink size {entry["size"]}')
+        d.size = entry['size']
+
+    d.file_hashes = entry['hashes']
+
+    # pieces verification requires a resumable download with known size
+    if entry['piece_hashes'] and d.resumable and d.size:
+        d.piece_length = entry['piece_length']
+        d.piece_hash_type = entry['piece_hash_type']
+        d.piece_hashes = entry['piece_hashes']
+
+    # rebuild segments with new name and pieces boundaries
+    d.build_segments()
+
+    return d
+
+
+class PieceVerifier:
+    """
+    verify pieces of a download item's temp file as soon as they are completely written, it is fed by file manager
+    with every merged segment
+    """
+
+    max_retries = 3  # download a failed piece again n times before giving up
+
+    def __init__(self, d):
+        self.d = d
+        self.length = d.piece_length
+        self.hash_type = d.piece_hash_type
+        self.hashes = d.piece_hashes
+
+        self.merged = {}  # {piece index: [(start, end, url), ...]} merged byte ranges inside this piece and their urls
+        self.retries = {}  # {piece index: number of retries}
+        self.verified = set()
+
+    def piece_range(self, i):
+        start = i * self.length
+        end = min(start + self.length, self.d.size) - 1
+        return start, end
+
+    def is_covered(self, i):
+        start, end = self.piece_range(i)
+        position = start
+        for a, b, _ in sorted(self.merged.get(i, [])):
+            if a > position:
+                return False
+            position = max(position, b + 1)
+        return position > end
+
+    def check(self, i):
+        """hash piece from temp file and compare with metalink hash, return True if matched"""
+        start, end = self.piece_range(i)
+        h = hashlib.new(self.hash_type)
+        with open(self.d.temp_file, 'rb') as f:
+            f.seek(start)
+            h.update(f.read(end - start + 1))
+
+        return h.hexdigest() == self.hashes[i]
+
+    def on_merge(self, seg):
+        """
+        called after a segment is merged into temp file
+        :param seg: merged Segment object
+        :return: list of (piece index, range, urls) for failed pieces which need to be downloaded again, urls are
+                 the sources which sent piece data, or None if a piece failed too many times
+        """
+        if not seg.range or seg.tempfile != self.d.temp_file:
+            return []
+
+        a, b = seg.range
+        failed = []
+        for i in range(a // self.length, min(b // self.length + 1, len(self.hashes))):
+            start, end = self.piece_range(i)
+            self.merged.setdefault(i, []).append((max(a, start), min(b, end), seg.url))
+
+            if not self.is_covered(i):
+                continue
+
+            if self.check(i):
+                self.verified.add(i)
+                log(f'piece {i} verified', log_level=3)
+            else:
+                self.verified.discard(i)
+                urls = set(url for _, _, url in self.merged[i])
+                self.merged[i] = []
+                self.retries[i] = self.retries.get(i, 0) + 1
+                log(f'piece {i} [{start}-{end}] hash mismatch, retry {self.retries[i]} of {self.max_retries}')
+
+                if self.retries[i] > self.max_retries:
+                    return None
+
+                failed.append((i, [start, end], urls))
+
+        return failed
@@ -0,0 +1,272 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# engine metrics, counters and histograms collected from workers, thread manager, and file manager, exposed on a
+# local http endpoint in prometheus text format "/metrics" or json format "/metrics.json"
+
+import json
+import re
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Lock, Thread
+
+from . import config
+from .config import Status
+from .utils import log
+
+# histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+_lock = Lock()
+_counters = {}  # {(name, labels): value}, where labels is a sorted tuple of (key, value) pairs
+_histograms = {}  # {(name, labels): Histogram}
+_help = {}  # {name: description}
+
+_server = None
+start_time = time.time()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # non-cumulative counts, cumulated when exported
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+def describe(name, text):
+    """set help text for a metric"""
+    _help[name] = text
+
+
+def inc(name, value=1, **labels):
+    """increase a counter by value"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """record a value "usually duration in seconds" in a histogram"""
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def error_class(description):
+    """
+    reduce an error description sent by worker into a short class name
+    examples: 'server refuse connection: 503' ==> 'http_503', "error(28, 'Operation timed out')" ==> 'curl_28'
+    """
+    description = str(description)
+
+    match = re.search(r'server refuse connection: (\d+)', description)
+    if match:
+        return f'http_{match.group(1)}'
+
+    match = re.match(r'error\((\d+)', description)
+    if match:
+        return f'curl_{match.group(1)}'
+
+    return re.sub(r'\W+', '_', description.split(':')[0].split('(')[0]).strip('_').lower() or 'unspecified'
+
+
+# help text for known metrics
+describe('pyidm_downloaded_bytes_total', 'bytes received by workers')
+describe('pyidm_errors_total', 'connection / server errors reported by workers')
+describe('pyidm_segment_retries_total', 'segments sent back to thread manager to be downloaded again')
+describe('pyidm_segment_splits_total', 'segments split to help other workers')
+describe('pyidm_write_pauses_total', 'transfers paused because disk writes are slower than network')
+describe('pyidm_link_refreshes_total', 'expired links refreshed while downloading')
+describe('pyidm_batch_files_total', 'files downloaded in small files batch mode')
+describe('pyidm_dns_lookups_total', 'host lookups by shared dns cache, hit or miss')
+describe('pyidm_dns_saved_seconds_total', 'host lookup time saved by shared dns cache hits')
+describe('pyidm_piece_failures_total', 'metalink pieces failed hash verification')
+describe('pyidm_download_live_connections', 'tcp connections, estimated from local ports for http/2 downloads')
+describe('pyidm_live_connections', 'tcp connections of all downloads, estimated from local ports for http/2 downloads')
+describe('pyidm_merge_seconds', 'time taken to merge a segment into temp file')
+describe('pyidm_ffmpeg_seconds', 'time taken by ffmpeg post processing')
+describe('pyidm_postprocess_wait_seconds', 'time post processing jobs waited for a free worker')
+
+
+def collect():
+    """
+    take a snapshot of all metrics
+    :return: list of (name, type, labels dict, value) where value is a number or a Histogram
+    """
+    from . import postproc  # postproc module imports metrics
+
+    samples = []
+
+    with _lock:
+        for (name, labels), value in _counters.items():
+            samples.append((name, 'counter', dict(labels), value))
+
+        for (name, labels), histogram in _histograms.items():
+            h = Histogram(histogram.buckets)
+            h.counts, h.count, h.sum = histogram.counts[:], histogram.count, histogram.sum
+            samples.append((name, 'histogram', dict(labels), h))
+
+    # gauges, read current values
+    total_speed = 0
+    total_connections = 0
+    active = 0
+    jobs = 0
+    errors = 0
+    for d in list(config.d_list):
+        labels = {'id': d.id, 'name': d.name}
+        speed = d.speed
+        total_speed += speed
+        total_connections += d.live_connections
+        active += d.status == Status.downloading
+        jobs += d.jobs_q.qsize()
+        errors += d.error_q.qsize()
+
+        samples.append(('pyidm_download_speed_bytes', 'gauge', labels, round(speed)))
+        samples.append(('pyidm_download_downloaded_bytes', 'gauge', labels, d.downloaded))
+        samples.append(('pyidm_download_total_bytes', 'gauge', labels, d.total_size))
+        samples.append(('pyidm_download_live_connections', 'gauge', labels, d.live_connections))
+        samples.append(('pyidm_download_live_streams', 'gauge', labels, d.live_streams))
+        samples.append(('pyidm_download_errors', 'gauge', labels, d.errors))
+
+    samples.append(('pyidm_speed_bytes', 'gauge', {}, round(total_speed)))
+    samples.append(('pyidm_live_connections', 'gauge', {}, total_connections))
+    samples.append(('pyidm_active_downloads', 'gauge', {}, active))
+    samples.append(('pyidm_queue_depth', 'gauge', {'queue': 'error_q'}, errors))
+    samples.append(('pyidm_queue_depth', 'gauge', {'queue': 'jobs_q'}, jobs))
+    samples.append(('pyidm_queue_depth', 'gauge', {'queue': 'postprocess'}, postproc.queue_depth()))
+    samples.append(('pyidm_postprocess_active_jobs', 'gauge', {}, postproc.active_jobs()))
+    samples.append(('pyidm_uptime_seconds', 'gauge', {}, round(time.time() - start_time)))
+
+    return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    items = []
+    for k, v in labels.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        items.append(f'{k}="{v}"')
+    return '{' + ','.join(items) + '}'
+
+
+def prometheus_text():
+    """export metrics in prometheus text exposition format"""
+    lines = []
+    declared = set()
+
+    for name, type_, labels, value in sorted(collect(), key=lambda x: x[0]):
+        if name not in declared:
+            declared.add(name)
+            if name in _help:
+                lines.append(f'# HELP {name} {_help[name]}')
+            lines.append(f'# TYPE {name} {type_}')
+
+        if type_ == 'histogram':
+            cumulative = 0
+            for bound, count in zip(value.buckets, value.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels({**labels, "le": bound})} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels({**labels, "le": "+Inf"})} {value.count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value.sum}')
+            lines.append(f'{name}_count{_format_labels(labels)} {value.count}')
+        else:
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def json_snapshot():
+    """export metrics as a json string"""
+    data = []
+    for name, type_, labels, value in collect():
+        if type_ == 'histogram':
+            value = {'buckets': dict(zip([str(b) for b in value.buckets], value.counts)), 'count': value.count,
+                     'sum': value.sum}
+        data.append({'name': name, 'type': type_, 'labels': labels, 'value': value})
+
+    return json.dumps({'app': config.APP_NAME, 'version': config.APP_VERSION, 'metrics': data})
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            path = self.path.split('?')[0]
+            if path in ('/', '/metrics'):
+                body, content_type = prometheus_text(), 'text/plain; version=0.0.4; charset=utf-8'
+            elif path == '/metrics.json':
+                body, content_type = json_snapshot(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except Exception as e:
+            log('metrics server> error:', e, log_level=3)
+
+    def log_message(self, format, *args):
+        # silence default stderr logging
+        pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_server(port=None):
+    """start metrics http server on localhost, return True on success"""
+    global _server
+
+    if _server:
+        return True
+
+    port = port or config.metrics_port
+    try:
+        _server = _ThreadingHTTPServer(('127.0.0.1', port), _RequestHandler)
+        Thread(target=_server.serve_forever, daemon=True, name='metrics_server').start()
+        log(f'metrics available at: http://127.0.0.1:{port}/metrics')
+        return True
+    except Exception as e:
+        _server = None
+        log('metrics server> failed to start:', e)
+        return False
+
+
+def stop_server():
+    global _server
+
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+        log('metrics server stopped')
+
+
+def restart_server():
+    """restart metrics server to listen on new config.metrics_port, return True on success"""
+    stop_server()
+    return start_server()
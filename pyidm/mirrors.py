@@ -0,0 +1,159 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# multi-source downloads, segments of one file are fetched from several mirror urls, each mirror gets a share of
+# segments proportional to its measured throughput, mirrors which fail repeatedly are dropped while downloading
+
+from threading import Thread, Lock
+
+from .utils import log, get_headers, size_format
+
+# server response codes mean this mirror doesn't have our file or refuse to serve it anymore
+FATAL_CODES = (401, 403, 404, 410, 416)
+
+
+class Mirror:
+    def __init__(self, url, validated=False):
+        self.url = url
+        self.validated = validated  # mirrors are used only after checking they serve same file as origin
+        self.dropped = False
+
+        self.speed = 0  # bytes/sec, moving average of completed transfers' speed
+        self.active = 0  # number of segments currently downloading from this mirror
+        self.downloaded = 0
+        self.errors = 0  # consecutive errors, reset on success
+
+    def __repr__(self):
+        return f'Mirror({self.url}, speed: {size_format(self.speed, "/s")}, active: {self.active})'
+
+    @property
+    def usable(self):
+        return self.validated and not self.dropped
+
+
+class MirrorPool:
+    """select a mirror url for every segment of a download item"""
+
+    max_errors = 3  # consecutive errors before dropping a mirror
+
+    def __init__(self, d):
+        self.d = d
+        self.lock = Lock()
+
+        # origin url is trusted, other mirrors need validation
+        self.mirrors = [Mirror(d.eff_url, validated=True)]
+        self.mirrors += [Mirror(url) for url in d.mirrors if url and url != d.eff_url]
+
+        self.urls = {m.url: m for m in self.mirrors}
+
+    def start(self):
+        """validate mirrors in a separate thread, segments will use origin url meanwhile"""
+        if len(self.mirrors) > 1:
+            Thread(target=self.validate, daemon=True).start()
+
+    def validate(self):
+        """check every mirror serve same resource as origin, by comparing size and etag"""
+        origin = get_headers(self.d.eff_url)
+        origin_size = int(origin.get('content-length', 0)) or self.d.size
+        origin_etag = origin.get('etag')
+
+        for mirror in self.mirrors[1:]:
+            headers = get_headers(mirror.url)
+
+            reason = ''
+            if headers.get('status_code') not in (200, 206):
+                reason = f'response code {headers.get("status_code")}'
+            elif int(headers.get('content-length', 0)) != origin_size:
+                reason = f'size mismatch {headers.get("content-length")} != {origin_size}'
+            elif origin_etag and headers.get('etag') and headers.get('etag') != origin_etag:
+                reason = f'etag mismatch {headers.get("etag")} != {origin_etag}'
+            elif headers.get('accept-ranges', 'none') == 'none':
+                reason = "server doesn't support ranges"
+
+            if reason:
+                mirror.dropped = True
+                log('mirrors> rejected:', mirror.url, '-', reason)
+            else:
+                mirror.validated = True
+                log('mirrors> accepted:', mirror.url, log_level=2)
+
+    @property
+    def usable_urls(self):
+        """urls of mirrors which can be used now, origin url if all mirrors dropped"""
+        with self.lock:
+            return [m.url for m in self.mirrors if m.usable] or [self.d.eff_url]
+
+    def select(self, exclude=()):
+        """
+        choose mirror with best expected throughput for a new segment
+        :param exclude: urls to skip, i.e. mirrors which their host has no free connections
+        :return: url, or None if all usable mirrors are excluded
+        """
+        with self.lock:
+            usable = [m for m in self.mirrors if m.usable]
+            if not usable:
+                return None if self.d.eff_url in exclude else self.d.eff_url
+
+            candidates = [m for m in usable if m.url not in exclude]
+            if not candidates:
+                return None
+
+            # untested mirrors get optimistic speed to be tried at least once
+            best_speed = max([m.speed for m in usable]) or 1
+
+            # expected share of bandwidth per segment if we add one more segment to this mirror
+            mirror = max(candidates, key=lambda m: (m.speed or best_speed) / (m.active + 1))
+            mirror.active += 1
+
+            return mirror.url
+
+    def release(self, url):
+        """segment didn't start a transfer from selected mirror, i.e. worker preparation failed"""
+        mirror = self.urls.get(url)
+        if mirror:
+            with self.lock:
+                mirror.active = max(0, mirror.active - 1)
+
+    def report(self, url, downloaded=0, duration=0, failed=False, response_code=0, corrupted=False):
+        """
+        update mirror stats after a segment transfer
+        :param url: mirror url used by segment
+        :param downloaded: received bytes
+        :param duration: transfer time in seconds
+        :param failed: True if transfer failed with error
+        :param response_code: http response code
+        :param corrupted: True if data failed verification after transfer was done, mirror will be dropped
+        """
+        mirror = self.urls.get(url)
+        if not mirror:
+            return
+
+        with self.lock:
+            if not corrupted:
+                mirror.active = max(0, mirror.active - 1)
+            mirror.downloaded += downloaded
+
+            if downloaded and duration > 0:
+                speed = downloaded / duration
+                mirror.speed = speed if not mirror.speed else mirror.speed * 0.7 + speed * 0.3
+
+            if not failed:
+                mirror.errors = 0
+                return
+
+            mirror.errors += 1
+            if corrupted or response_code in FATAL_CODES or mirror.errors >= self.max_errors:
+                # keep at least one mirror
+                if len([m for m in self.mirrors if m.usable]) > 1:
+                    mirror.dropped = True
+                    log('mirrors> dropped:', mirror.url, f'- errors: {mirror.errors}, response code: {response_code}',
+                        '- corrupted data' if corrupted else '')
+
+    def summary(self):
+        return '\n'.join(repr(m) + (' - dropped' if m.dropped else '') for m in self.mirrors)
@@ -0,0 +1,139 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# adaptive segment planner, every new segment costs a request round trip "plus dns, tcp and tls handshakes for new
+# connections", during this setup time the connection could have transferred (throughput x setup time) bytes, which is
+# the bandwidth-delay product "bdp" of this connection, a segment should be large enough that its setup cost is a small
+# fraction "config.planner_overhead" of its transfer time, i.e. segment size >= bdp / overhead.
+# small segments on high latency links waste time in round trips, while huge segments make splitting coarse.
+# measurements come from download item's transfer stats "see Worker.record_transfer_stats()", or from previous
+# downloads from the same host if there is no measurements yet.
+
+import time
+from threading import Lock
+from urllib.parse import urlparse
+
+from . import config
+from .utils import log, size_format, percentile
+
+_lock = Lock()
+_hosts = {}  # {host name: (setup time, throughput)}, last measurements for every host
+
+replan_interval = 2  # seconds, how often thread manager re-plan split threshold while downloading
+min_records = 3  # minimum number of transfer records to be considered a measurement
+max_decisions = 50  # number of planner decisions kept per download item for debugging
+
+
+def host_of(d):
+    try:
+        return urlparse(d.eff_url or d.url).hostname or ''
+    except Exception:
+        return ''
+
+
+def measure(d):
+    """
+    measure setup time and per-connection throughput from download item's transfer stats
+    :param d: DownloadItem
+    :return: (setup time in seconds, throughput in bytes/sec) or (None, None) if not enough measurements
+    """
+    records = [r for r in list(d.transfer_stats) if r['response_code'] in (200, 206) and r['bytes']]
+    if len(records) < min_records:
+        return None, None
+
+    # time to first byte includes dns lookup, tcp connect, tls handshake "for new connections" and request round trip
+    setup_time = percentile([r['starttransfer_time'] for r in records], 50)
+    throughput = percentile([r['speed_download'] for r in records], 50)
+
+    # current speed is a better estimate while downloading
+    if d.live_streams and d.speed:
+        throughput = d.speed / d.live_streams
+
+    with _lock:
+        _hosts[host_of(d)] = (setup_time, throughput)
+
+    return setup_time, throughput
+
+
+def estimate(d):
+    """
+    get setup time and throughput for download item, use host history if no measurements available
+    :return: (setup time, throughput, source) where source is 'measured', 'history', or None
+    """
+    setup_time, throughput = measure(d)
+    if setup_time and throughput:
+        return setup_time, throughput, 'measured'
+
+    with _lock:
+        setup_time, throughput = _hosts.get(host_of(d), (None, None))
+
+    if setup_time and throughput:
+        return setup_time, throughput, 'history'
+
+    return None, None, None
+
+
+def record(d, kind, setup_time, throughput, source, **info):
+    """store planner decision in download item for debugging"""
+    decision = {'time': round(time.time(), 3), 'kind': kind, 'source': source,
+                'setup_time': round(setup_time, 4) if setup_time else None, 'throughput': int(throughput or 0), **info}
+    d.plan_decisions.append(decision)
+
+    log(f'planner> {d.name}: {kind} {size_format(info.get("size", 0))}, source: {source}, '
+        f'setup time: {(setup_time or 0) * 1000:.0f} ms, throughput: {size_format(throughput or 0, "/s")}',
+        log_level=2)
+
+
+def calc_segment_size(setup_time, throughput):
+    """
+    calculate minimum useful segment size from measurements
+    :param setup_time: time to first byte in seconds
+    :param throughput: per-connection throughput in bytes/sec
+    :return: size in bytes, never less than config.segment_size
+    """
+    if not config.adaptive_segments or not setup_time or not throughput:
+        return config.segment_size
+
+    bdp = throughput * setup_time
+    size = int(bdp / config.planner_overhead)
+    return min(max(size, config.segment_size), config.planner_max_segment_size)
+
+
+def initial_segment_size(d):
+    """segment size used to build download item segments, see DownloadItem.build_segments()"""
+    setup_time, throughput, source = estimate(d)
+    size = calc_segment_size(setup_time, throughput)
+
+    last = next((x for x in reversed(d.plan_decisions) if x['kind'] == 'initial'), None)
+    if size != config.segment_size and (not last or last['size'] != size):
+        record(d, 'initial', setup_time, throughput, source, size=size)
+
+    return size
+
+
+def split_threshold(d):
+    """
+    minimum remaining size of a segment to be split and shared with another worker, each half should be a useful
+    segment, otherwise new connection's setup time eats the gain, re-planned by thread manager as throughput changes
+    :param d: DownloadItem
+    :return: size in bytes
+    """
+    setup_time, throughput, source = estimate(d)
+    size = calc_segment_size(setup_time, throughput)
+
+    # keep old behaviour until there are measurements
+    threshold = config.segment_size if size == config.segment_size else 2 * size
+
+    # record significant changes only
+    last = next((x for x in reversed(d.plan_decisions) if x['kind'] == 'split'), None)
+    changed = abs(threshold - last['size']) > last['size'] / 5 if last else threshold != config.segment_size
+    if changed:
+        record(d, 'split', setup_time, throughput, source, size=threshold)
+
+    return threshold
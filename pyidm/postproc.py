@@ -0,0 +1,165 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# post processing pool, ffmpeg jobs "merging dash audio / video, hls processing, audio conversion, subtitles
+# conversion" are cpu heavy, running one ffmpeg process for every finished download thrash the cpu when many downloads
+# finish together i.e. a playlist, jobs wait in a priority queue and run by a small pool of threads sized to cpu cores.
+# download's network phase is already done when its job is queued "connections released by thread manager", only its
+# file manager thread waits for the job result.
+# streaming audio conversions "see audiostream.py" run their ffmpeg while downloading, outside this queue, but they
+# take pool slots too, a stream starts only if a slot is free, and pool threads wait while streams use all slots.
+
+import os
+import time
+import itertools
+from queue import PriorityQueue
+from threading import Thread, Lock, Event, Condition
+
+from . import config
+from . import metrics
+from .config import Status
+from .utils import log
+
+_queue = PriorityQueue()  # (-priority, sequence, Job)
+_sequence = itertools.count()  # fifo for jobs with same priority
+_threads = []
+_threads_lock = Lock()
+_slots = Condition(_threads_lock)  # notified when a job or a stream frees its slot
+_active = 0  # running jobs
+_streams = 0  # running streaming conversions
+
+
+class Job:
+    def __init__(self, func, args, kwargs, owner=None, name='', default=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.owner = owner  # DownloadItem, job is skipped if it is cancelled
+        self.name = name or func.__name__
+        self.default = default  # result if job skipped or failed
+        self.result = default
+        self.cancelled = False
+        self.done = Event()
+        self.queued_time = time.time()
+
+    def __repr__(self):
+        return f'Job({self.name}, {self.owner.name if self.owner else ""})'
+
+
+def pool_size():
+    return config.postprocess_workers or os.cpu_count() or 1
+
+
+def queue_depth():
+    """number of jobs waiting for a free worker"""
+    return _queue.qsize()
+
+
+def active_jobs():
+    return _active
+
+
+def _worker_thread():
+    global _active
+
+    while True:
+        _, _, job = _queue.get()
+
+        # all slots might be taken by streaming conversions
+        with _slots:
+            while _active + _streams >= pool_size():
+                _slots.wait(0.5)
+            _active += 1
+
+        if job.cancelled or (job.owner and job.owner.status == Status.cancelled):
+            with _slots:
+                _active -= 1
+                _slots.notify()
+            job.done.set()
+            continue
+
+        wait_time = time.time() - job.queued_time
+        start = time.time()
+        try:
+            job.result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            log(f'post processing> {job.name} error:', e)
+        finally:
+            with _slots:
+                _active -= 1
+                _slots.notify()
+
+            run_time = time.time() - start
+            metrics.observe('pyidm_ffmpeg_seconds', run_time, operation=job.name)
+            metrics.observe('pyidm_postprocess_wait_seconds', wait_time)
+            log(f'post processing> {job}: waited {wait_time:.1f} seconds, done in {run_time:.1f} seconds',
+                log_level=2)
+            job.done.set()
+
+
+def start_pool():
+    """start worker threads, more threads will be added if config.postprocess_workers increased"""
+    with _threads_lock:
+        while len(_threads) < pool_size():
+            t = Thread(target=_worker_thread, daemon=True, name=f'postprocess_{len(_threads)}')
+            t.start()
+            _threads.append(t)
+
+
+def reserve_slot():
+    """
+    take a pool slot for an ffmpeg process running outside the queue, i.e. streaming audio conversion
+    :return: True if a slot was free, False if pool is busy or jobs are waiting
+    """
+    global _streams
+    with _slots:
+        if _active + _streams >= pool_size() or queue_depth():
+            return False
+        _streams += 1
+        return True
+
+
+def release_slot():
+    """free a slot taken by reserve_slot()"""
+    global _streams
+    with _slots:
+        _streams = max(_streams - 1, 0)
+        _slots.notify()
+
+
+def run(func, *args, owner=None, priority=None, name='', default=None, **kwargs):
+    """
+    run a post processing function in pool and wait for its result
+    :param func: function, i.e. video.merge_video_audio
+    :param args: func positional arguments
+    :param owner: DownloadItem, if cancelled while waiting, job is dropped
+    :param priority: higher runs first, default to owner's priority
+    :param name: job name for logging and metrics, default to func name
+    :param default: returned if job was cancelled or raised an exception
+    :param kwargs: func keyword arguments
+    :return: func result or default
+    """
+    start_pool()
+
+    if priority is None:
+        priority = owner.priority if owner else 0
+
+    job = Job(func, args, kwargs, owner=owner, name=name, default=default)
+    _queue.put((-priority, next(_sequence), job))
+
+    depth = queue_depth()
+    if depth and _active >= pool_size():
+        log(f'post processing> {job} queued, {depth} jobs waiting', log_level=2)
+
+    while not job.done.wait(0.5):
+        if owner and owner.status == Status.cancelled:
+            job.cancelled = True  # job will be skipped if not started yet, a running ffmpeg is killed with status
+            return default
+
+    return job.result
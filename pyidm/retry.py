@@ -0,0 +1,141 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# retry policy for failed segments, every failure is classified, transient errors "timeouts, server busy, etc..."
+# are retried after an exponential backoff delay with random jitter, to not hammer a struggling server with a retry
+# storm, permanent errors "i.e. 404 not found" fail fast, and retries per segment are capped.
+
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+from . import config
+from .utils import log
+from .metrics import error_class
+
+# error classes as reduced by metrics.error_class()
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+EXPIRED = 'expired'  # signed link expired, will be retried after links refreshed, see brain.thread_manager()
+
+PERMANENT_HTTP_CODES = (400, 401, 404, 405, 406, 411, 412, 413, 414, 415, 416, 501, 505)
+EXPIRED_HTTP_CODES = (403, 410)
+
+# libcurl errors which won't go away by retrying
+# 1: unsupported protocol, 3: malformed url, 51/60: ssl certificate problems, 67: login denied
+PERMANENT_CURL_CODES = (1, 3, 51, 60, 67)
+
+max_retry_after = 300  # seconds, ignore longer "Retry-After" values from servers
+
+
+def classify(description):
+    """
+    classify an error description reported by worker
+    :param description: error description, i.e. 'server refuse connection: 404' or "error(28, 'Operation timed out')"
+    :return: TRANSIENT, PERMANENT, or EXPIRED
+    """
+    name = error_class(description)
+    kind, _, code = name.partition('_')
+
+    if kind == 'http' and code.isdigit():
+        code = int(code)
+        if code in EXPIRED_HTTP_CODES:
+            return EXPIRED
+        if code in PERMANENT_HTTP_CODES:
+            return PERMANENT
+
+    elif kind == 'curl' and code.isdigit() and int(code) in PERMANENT_CURL_CODES:
+        return PERMANENT
+
+    return TRANSIENT
+
+
+def parse_retry_after(value):
+    """
+    parse "Retry-After" header value
+    :param value: delay in seconds i.e. '120' or http date i.e. 'Wed, 21 Oct 2015 07:28:00 GMT'
+    :return: delay in seconds or None
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        if value.isdigit():
+            delay = int(value)
+        else:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+    except Exception:
+        return None
+
+    return min(max(delay, 0), max_retry_after)
+
+
+def backoff(attempts, retry_after=None):
+    """
+    calculate delay before next retry, exponential backoff with "equal jitter", half the delay is fixed and the
+    other half is random, so workers which failed together don't retry together
+    :param attempts: number of failed attempts so far
+    :param retry_after: server requested delay in seconds, it takes precedence if longer
+    :return: delay in seconds
+    """
+    delay = min(config.retry_base_delay * 2 ** max(attempts - 1, 0), config.retry_max_delay)
+    delay = delay / 2 + random.uniform(0, delay / 2)
+
+    if retry_after:
+        delay = max(delay, retry_after)
+
+    return delay
+
+
+def on_failure(seg, description, retry_after=None, fail_fast=True):
+    """
+    record a failed attempt and schedule segment's next retry
+    :param seg: Segment object
+    :param description: error description reported by worker
+    :param retry_after: value of "Retry-After" response header if any
+    :param fail_fast: if False, permanent errors will be retried like transient ones, i.e. when other mirrors exist
+    :return: True if segment will be retried, False if gave up
+    """
+    seg.attempts += 1
+    seg.last_error = classify(description)
+
+    if seg.last_error == PERMANENT and fail_fast:
+        log('Seg', seg.basename, 'permanent error:', description, log_level=2)
+        seg.retry_at = -1
+        return False
+
+    if seg.attempts > config.max_segment_retries:
+        log('Seg', seg.basename, f'gave up after {seg.attempts} attempts, last error:', description, log_level=2)
+        seg.retry_at = -1
+        return False
+
+    delay = backoff(seg.attempts, parse_retry_after(retry_after))
+    seg.retry_at = time.time() + delay
+    log('Seg', seg.basename, f'retry {seg.attempts} in {delay:.1f} seconds, {seg.last_error} error:', description,
+        log_level=3)
+
+    return True
+
+
+def on_success(seg):
+    """reset retry info, i.e. segment made progress before failing"""
+    seg.attempts = 0
+    seg.last_error = ''
+    seg.retry_at = 0
+
+
+def gave_up(seg):
+    """True if segment exceeded retries or failed with a permanent error, see on_failure()"""
+    return seg.retry_at < 0
+
+
+def is_due(seg, now=None):
+    """True if segment's backoff delay passed"""
+    return seg.retry_at <= (now or time.time())
@@ -0,0 +1,104 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# download speed sampler, a single background thread samples downloaded bytes of all active download items at a
+# fixed rate, and stores (time, bytes) samples in a per-item ring buffer.
+# two rates are calculated at every sample, an exponentially weighted moving average "ewma" which reacts quickly to
+# speed changes, and a windowed average over the whole ring buffer which is more stable for time left estimation.
+# readers "gui, metrics, planner, etc..." just read last calculated values, reading never changes item's state.
+
+import math
+import time
+from threading import Thread, Lock
+
+from . import config
+from .config import Status
+from .utils import log
+
+_lock = Lock()
+_items = []  # watched download items
+_thread = None
+
+
+def watch(d):
+    """
+    start sampling download item's speed, sampling stops automatically when item is not downloading anymore
+    :param d: DownloadItem
+    """
+    global _thread
+
+    d.reset_speed()
+
+    with _lock:
+        if d not in _items:
+            _items.append(d)
+
+        if _thread is None:
+            _thread = Thread(target=_sampler_thread, daemon=True, name='speed_sampler')
+            _thread.start()
+
+
+def sample(d, now):
+    """
+    take a sample of downloaded bytes and update download item's rates
+    :param d: DownloadItem
+    :param now: sample time in seconds
+    """
+    samples = d.speed_samples
+    downloaded = d.downloaded
+
+    if samples:
+        last_time, last_downloaded = samples[-1]
+        interval = now - last_time
+        if interval <= 0:
+            return
+
+        # downloaded bytes might decrease, i.e. a failed segment discarded
+        rate = max(downloaded - last_downloaded, 0) / interval
+
+        if len(samples) == 1:
+            d._speed = rate  # first rate, nothing to average
+        else:
+            # time based smoothing factor, correct even if sampler thread was late
+            alpha = 1 - math.exp(-interval / config.speed_time_constant)
+            d._speed += alpha * (rate - d._speed)
+
+    samples.append((now, downloaded))
+
+    # average over ring buffer, oldest sample is dropped automatically by deque's maxlen
+    first_time, first_downloaded = samples[0]
+    if now > first_time:
+        d._window_speed = max(downloaded - first_downloaded, 0) / (now - first_time)
+
+
+def _sampler_thread():
+    global _thread
+
+    while True:
+        time.sleep(config.speed_sample_interval)
+        now = time.time()
+
+        with _lock:
+            items = _items[:]
+
+        for d in items:
+            try:
+                if d.status == Status.downloading:
+                    sample(d, now)
+                else:
+                    d.reset_speed()
+                    with _lock:
+                        _items.remove(d)
+            except Exception as e:
+                log('speed sampler> error:', e, log_level=3)
+
+        with _lock:
+            if not _items or config.terminate:
+                _thread = None
+                break
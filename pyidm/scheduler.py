@@ -0,0 +1,202 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# pending downloads scheduler, runs in its own thread and starts pending items when there is a free slot, respecting:
+#   - item priority: high priority items start first
+#   - per-host limit: max number of concurrent downloads from the same server
+#   - weighted fair sharing: pending items are grouped "by host unless item has a group name", groups take turns
+#     according to their weights, so 200 items from one host don't block a single item from another host
+#   - aging: low priority items gain priority while waiting until they reach normal priority
+#   - disk: items wait while their file system lacks space or disk is overloaded, see governor.py
+
+import time
+from threading import Thread, Lock
+from urllib.parse import urlparse
+
+from . import config
+from .config import Status
+from .utils import log
+from .brain import brain
+from . import governor
+
+
+class Priority:
+    high = 1
+    normal = 0
+    low = -1
+
+
+_lock = Lock()
+_pending = {}  # {d.id: (d, enqueue time)}
+_passes = {}  # {group: pass value}, stride scheduling, group with lowest pass value is next
+_launched = {}  # {d.id: launch time}, items started but their brain didn't change status yet
+_thread = None
+
+aging_interval = 600  # seconds, low priority item waiting longer than this gets promoted one level
+
+
+def host_of(d):
+    """return host name of download item url"""
+    try:
+        return urlparse(d.eff_url or d.url).hostname or ''
+    except Exception:
+        return ''
+
+
+def group_of(d):
+    return d.group or host_of(d)
+
+
+def effective_priority(d, enqueue_time, now=None):
+    """item priority with aging, aging lifts low priority items up to normal priority only"""
+    if d.priority >= Priority.normal:
+        return d.priority
+
+    now = now or time.time()
+    steps = int((now - enqueue_time) // aging_interval)
+    return min(d.priority + steps, Priority.normal)
+
+
+def active_items():
+    """download items which are downloading now or just started"""
+    now = time.time()
+    for id_, t in list(_launched.items()):
+        if now - t > 5:
+            _launched.pop(id_, None)
+
+    return [d for d in config.d_list if d.status == Status.downloading or (d.id in _launched and
+                                                                           d.status == Status.pending)]
+
+
+def can_start(d, active=None):
+    """check if there is a free slot for download item, considering max concurrent downloads, per-host limit,
+    and disk governor"""
+    active = active_items() if active is None else active
+
+    if len(active) >= config.max_concurrent_downloads:
+        return False
+
+    if config.max_downloads_per_host:
+        host = host_of(d)
+        if len([x for x in active if host_of(x) == host]) >= config.max_downloads_per_host:
+            return False
+
+    # disk space and disk load
+    if not governor.can_start(d):
+        return False
+
+    return True
+
+
+def add(d):
+    """add download item to pending queue"""
+    with _lock:
+        d.status = Status.pending
+        if d.id not in _pending:
+            _pending[d.id] = (d, time.time())
+
+            # new group starts at current minimum pass value, to not get a big share for being idle before
+            group = group_of(d)
+            if group not in _passes:
+                _passes[group] = min(_passes.values()) if _passes else 0
+
+    start()
+
+
+def remove(d):
+    """remove download item from pending queue"""
+    with _lock:
+        _pending.pop(d.id, None)
+
+
+def clear():
+    with _lock:
+        _pending.clear()
+
+
+def pending_items():
+    """return list of pending download items"""
+    with _lock:
+        return [d for d, _ in _pending.values()]
+
+
+def select_next(active):
+    """
+    choose next item to start
+    :param active: list of active download items
+    :return: download item or None
+    """
+    now = time.time()
+    candidates = []
+    for d, enqueue_time in _pending.values():
+        if d.status != Status.pending or not can_start(d, active):
+            continue
+
+        group = group_of(d)
+        weight = config.group_weights.get(group, 1) or 1
+
+        # priority first, then the group with least share of started items relative to its weight, then fifo
+        key = (-effective_priority(d, enqueue_time, now), _passes.get(group, 0), enqueue_time)
+        candidates.append((key, d, group, weight))
+
+    if not candidates:
+        return None
+
+    _, d, group, weight = min(candidates, key=lambda x: x[0])
+    _passes[group] = _passes.get(group, 0) + 1 / weight
+
+    return d
+
+
+def schedule():
+    """start pending items while there are free slots"""
+    while True:
+        with _lock:
+            # remove items which are no longer pending, i.e. cancelled by user
+            for id_, (d, _) in list(_pending.items()):
+                if d.status != Status.pending:
+                    _pending.pop(id_)
+
+            active = active_items()
+            d = select_next(active) if _pending else None
+            if not d:
+                break
+
+            # reserve disk space now, next items picked in this pass must see this reservation
+            if not governor.reserve(d):
+                break
+
+            _pending.pop(d.id)
+            _launched[d.id] = time.time()
+
+        log(f'scheduler> starting: {d.name}, priority: {d.priority}, group: {group_of(d)}', log_level=2)
+        Thread(target=brain, daemon=True, args=(d,)).start()
+
+
+def run():
+    """scheduler thread loop"""
+    while not config.terminate:
+        try:
+            if _pending:
+                schedule()
+        except Exception as e:
+            log('scheduler> error:', e)
+            if config.TEST_MODE:
+                raise e
+
+        time.sleep(0.5)
+
+
+def start():
+    """start scheduler thread if not running"""
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = Thread(target=run, daemon=True, name='scheduler')
+            _thread.start()
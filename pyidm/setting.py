@@ -99,6 +99,7 @@ def load_d_list():
         # clean d_list and load thumbnails
         for d in d_list:
             d.live_connections = 0
+            d.live_streams = 0
 
             # use encode() to convert base64 string to byte, however it does work without it, will keep it to be safe
             d.thumbnail = thumbnails.get(str(d.id), '').encode()
@@ -0,0 +1,333 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# time based rules, download items can have a start / stop time window, optionally repeated on selected weekdays, and
+# an item speed limit, and bandwidth profiles change the global speed limit during time windows "i.e. unlimited speed
+# from 01:00 to 07:00, and config.speed_limit otherwise".
+# all rules are converted to absolute time events in a heap, a single thread sleeps until the next event is due,
+# nothing is polled by gui loop. starting an item goes through MainWindow.start_download() like a user click, so
+# pending queue limits still apply, see scheduler.py.
+
+import datetime
+import heapq
+import itertools
+import time
+from threading import Thread, Condition
+
+from . import config
+from .config import Status
+from .utils import log, execute_command, parse_bytes, size_format
+
+_cond = Condition()
+_events = []  # heap of (time, sequence, kind, download item), kind is 'start', 'stop', or 'profile'
+_sequence = itertools.count()  # tie breaker for events at same time
+_thread = None
+_active_profile = None  # bandwidth profile in effect now, or None
+
+max_sleep = 60  # seconds, wake up at least once a minute to survive system clock changes
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def next_time(hm, after=None, days=None):
+    """
+    find next occurrence of a time of day
+    :param hm: (hour, minute) tuple, hour might be 24 for end of day
+    :param after: timestamp, default to now
+    :param days: list of allowed weekdays, 0=monday, empty or None for any day
+    :return: timestamp
+    """
+    after = after or time.time()
+    today = datetime.datetime.fromtimestamp(after).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    for offset in range(8):
+        day = today + datetime.timedelta(days=offset)
+        if days and day.weekday() not in days:
+            continue
+
+        t = (day + datetime.timedelta(hours=hm[0], minutes=hm[1])).timestamp()
+        if t > after:
+            return t
+
+    return None
+
+
+def in_window(start, stop, days=None, now=None):
+    """
+    check if current time is inside a daily time window, window might pass midnight i.e. 23:00 to 02:00
+    :param start: (hour, minute)
+    :param stop: (hour, minute)
+    :param days: allowed weekdays of window start, empty or None for any day
+    """
+    now = datetime.datetime.fromtimestamp(now or time.time())
+    minute = now.hour * 60 + now.minute
+    start = start[0] * 60 + start[1]
+    stop = stop[0] * 60 + stop[1]
+    weekday = now.weekday()
+
+    if start <= stop:
+        inside = start <= minute < stop
+    elif minute >= start:
+        inside = True
+    else:
+        inside = minute < stop
+        weekday = (weekday - 1) % 7  # window started yesterday
+
+    return inside and (not days or weekday in days)
+
+
+# region bandwidth profiles
+def parse_hm(text):
+    """'07:30' ==> (7, 30)"""
+    h, m = text.strip().split(':')
+    h, m = int(h), int(m)
+    if not (0 <= h <= 24 and 0 <= m < 60) or (h == 24 and m):
+        raise ValueError(f'invalid time: {text}')
+    return h, m
+
+
+def parse_days(text):
+    """'mon,tue,fri' or 'mon-fri' ==> [0, 1, 4] or [0, 1, 2, 3, 4]"""
+    days = []
+    for part in text.lower().split(','):
+        if '-' in part:
+            first, last = (WEEKDAYS.index(x.strip()[:3]) for x in part.split('-'))
+            days.extend(range(first, last + 1))
+        else:
+            days.append(WEEKDAYS.index(part.strip()[:3]))
+    return sorted(set(days))
+
+
+def parse_profiles(text):
+    """
+    parse bandwidth profiles entered by user, profiles separated by ";" each one is "[days] start-stop limit"
+    example: '01:00-07:00 unlimited; sat,sun 00:00-24:00 0; 18:00-23:00 512 KB'
+    :return: list of profile dictionaries, see config.bandwidth_profiles
+    """
+    profiles = []
+    for entry in text.split(';'):
+        parts = entry.split()
+        if not parts:
+            continue
+
+        days = []
+        if not parts[0][0].isdigit():
+            days = parse_days(parts.pop(0))
+
+        start, stop = parts[0].split('-')
+        limit = ' '.join(parts[1:]).strip().lower()
+        speed_limit = 0 if limit in ('', 'unlimited', 'none') else parse_bytes(limit)
+
+        profiles.append({'start': list(parse_hm(start)), 'stop': list(parse_hm(stop)), 'days': days,
+                         'speed_limit': speed_limit})
+
+    return profiles
+
+
+def format_profiles(profiles):
+    """reverse of parse_profiles()"""
+    entries = []
+    for p in profiles:
+        days = ','.join(WEEKDAYS[x] for x in p['days'])
+        limit = size_format(p['speed_limit']) if p['speed_limit'] else 'unlimited'
+        text = f'{p["start"][0]:02}:{p["start"][1]:02}-{p["stop"][0]:02}:{p["stop"][1]:02} {limit}'
+        entries.append(f'{days} {text}' if days else text)
+    return '; '.join(entries)
+
+
+def active_profile(now=None):
+    """first bandwidth profile whose time window includes now, or None"""
+    for p in config.bandwidth_profiles:
+        if in_window(p['start'], p['stop'], p['days'], now):
+            return p
+    return None
+
+
+def global_speed_limit():
+    """speed limit in effect now, bytes/sec, 0 for no limit"""
+    p = _active_profile
+    return p['speed_limit'] if p else config.speed_limit
+# endregion
+
+
+# region download items
+def schedule_item(d, start, stop=None, days=None, speed_limit=None):
+    """
+    set download item's time window
+    :param d: DownloadItem
+    :param start: (hour, minute) start time
+    :param stop: (hour, minute) stop time or None
+    :param days: list of weekdays "0=monday" to repeat on, empty or None for a single time
+    :param speed_limit: item speed limit in bytes/sec, 0 for no limit, None to keep current limit
+    """
+    d.sched = tuple(start)
+    d.sched_stop = tuple(stop) if stop else None
+    d.sched_days = list(days or [])
+    if speed_limit is not None:
+        d.speed_limit = speed_limit
+    log(f'timetable> {d.name} scheduled: {d.sched_string}', log_level=2)
+
+    start_if_open(d)
+    reload()
+
+
+def unschedule(d):
+    """remove item's time window, item speed limit isn't part of schedule and is kept"""
+    d.sched = None
+    d.sched_stop = None
+    d.sched_days = []
+    reload()
+
+
+def start_if_open(d, now=None):
+    """
+    start download item now if its time window is already open, otherwise it waits for next window start
+    called when a window is registered "item scheduled or app started", not for every events rebuild
+    """
+    if d.sched and d.sched_stop and in_window(d.sched, d.sched_stop, d.sched_days, now):
+        handle('start', d)
+
+
+def item_events(d, now):
+    """next start and stop events of download item"""
+    events = []
+    if d.status == Status.completed:
+        return events
+
+    start = next_time(d.sched, now, d.sched_days) if d.sched else None
+    if start:
+        events.append((start, 'start'))
+
+    if d.sched_stop:
+        if start and not d.sched_days:
+            # a single time window stops after it starts
+            stop = next_time(d.sched_stop, start)
+        else:
+            days = d.sched_days
+            if days and d.sched and tuple(d.sched_stop) <= tuple(d.sched):
+                days = [(x + 1) % 7 for x in days]  # window passes midnight, it stops next day
+            stop = next_time(d.sched_stop, now, days)
+
+        if stop:
+            events.append((stop, 'stop'))
+
+    return events
+
+
+def start_item(d):
+    if d.status in (Status.downloading, Status.completed, Status.processing):
+        return
+
+    log(f'timetable> starting scheduled download: {d.name}', log_level=2)
+    execute_command('start_download', d, silent=True)
+
+
+def stop_item(d):
+    if d.status in (Status.downloading, Status.pending):
+        log(f'timetable> stopping scheduled download: {d.name}', log_level=2)
+        d.status = Status.cancelled
+# endregion
+
+
+def build_events(now=None):
+    """convert all rules into a heap of absolute time events"""
+    global _active_profile
+
+    now = now or time.time()
+    events = []
+
+    for d in list(config.d_list):
+        for t, kind in item_events(d, now):
+            events.append((t, next(_sequence), kind, d))
+
+    # re-evaluate profiles at every window edge
+    edges = set()
+    for p in config.bandwidth_profiles:
+        edges.add(next_time(p['start'], now))
+        edges.add(next_time(p['stop'], now))
+    for t in edges:
+        events.append((t, next(_sequence), 'profile', None))
+
+    heapq.heapify(events)
+
+    profile = active_profile(now)
+    if profile is not _active_profile:
+        _active_profile = profile
+        limit = global_speed_limit()
+        log('timetable> speed limit:', size_format(limit, '/s') if limit else 'unlimited', log_level=2)
+
+    return events
+
+
+def handle(kind, d):
+    if kind == 'start':
+        if not d.sched_days:
+            d.sched = None  # single time schedule done
+        start_item(d)
+
+    elif kind == 'stop':
+        if not d.sched_days:
+            d.sched_stop = None
+        stop_item(d)
+
+
+def run():
+    """timetable thread, sleeps until next event is due"""
+    global _events
+
+    # windows which opened while app was closed
+    for d in list(config.d_list):
+        try:
+            start_if_open(d)
+        except Exception as e:
+            log('timetable> error:', e)
+
+    with _cond:
+        _events = build_events()
+
+    while not config.terminate:
+        with _cond:
+            now = time.time()
+            due = []
+            while _events and _events[0][0] <= now:
+                due.append(heapq.heappop(_events))
+
+            if not due:
+                timeout = min(_events[0][0] - now, max_sleep) if _events else max_sleep
+                _cond.wait(timeout)
+                continue
+
+        for _, _, kind, d in due:
+            try:
+                handle(kind, d)
+            except Exception as e:
+                log('timetable> error:', e)
+                if config.TEST_MODE:
+                    raise e
+
+        # recurring rules get their next events
+        with _cond:
+            _events = build_events()
+
+
+def reload():
+    """rebuild events after rules changed, i.e. item scheduled or profiles edited"""
+    global _events
+    with _cond:
+        _events = build_events()
+        _cond.notify()
+
+
+def start():
+    """start timetable thread if not running"""
+    global _thread
+    with _cond:
+        if _thread is None or not _thread.is_alive():
+            _thread = Thread(target=run, daemon=True, name='timetable')
+            _thread.start()
@@ -0,0 +1,188 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# choose ffmpeg processing mode before running it, instead of trying a stream copy and falling back to re-encoding
+# when it fails "a failed copy attempt might run for a long time before failing".
+# codecs are taken from youtube-dl streams info "vcodec, acodec", or probed with ffprobe if not known, then checked
+# against target container, modes are:
+#   copy: remux only, streams copied as they are, very fast
+#   audio: video copied, audio re-encoded, i.e. opus audio into mp4 container
+#   full: re-encode everything, slowest
+# decisions are cached per (container, video codec, audio codec), a failed job is retried with next slower mode, and
+# cache is downgraded only if ffmpeg said codecs don't fit container, other failures "disk full, killed process,
+# corrupted input" don't change the mode of next jobs.
+
+import json
+import os
+from threading import Lock
+
+from . import config
+from .utils import log, run_command
+
+COPY = 'copy'
+AUDIO = 'audio'
+FULL = 'full'
+
+# codecs every container can hold without re-encoding, None means anything
+CONTAINER_CODECS = {
+    'mp4': ({'h264', 'hevc', 'av1', 'vp9', 'mpeg4'}, {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'flac', 'alac'}),
+    'm4a': (set(), {'aac', 'alac'}),
+    'webm': ({'vp8', 'vp9', 'av1'}, {'opus', 'vorbis'}),
+    'mkv': (None, None),
+    'mp3': (set(), {'mp3'}),
+    'aac': (set(), {'aac'}),
+    'ogg': (set(), {'vorbis', 'opus', 'flac'}),
+    'opus': (set(), {'opus'}),
+    'flac': (set(), {'flac'}),
+}
+
+# audio encoder for "audio" mode
+AUDIO_ENCODERS = {'mp4': 'aac', 'm4a': 'aac', 'webm': 'libopus', 'mp3': 'libmp3lame', 'aac': 'aac',
+                  'ogg': 'libvorbis', 'opus': 'libopus', 'flac': 'flac'}
+
+# youtube-dl / rfc 6381 codec names to ffprobe names, matched by prefix
+CODEC_NAMES = [('avc', 'h264'), ('h264', 'h264'), ('hev', 'hevc'), ('hvc', 'hevc'), ('hevc', 'hevc'),
+               ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp08', 'vp8'), ('vp8', 'vp8'), ('av01', 'av1'), ('av1', 'av1'),
+               ('mp4v', 'mpeg4'), ('mp4a.40.34', 'mp3'), ('mp4a.69', 'mp3'), ('mp4a.6b', 'mp3'), ('mp4a', 'aac'),
+               ('aac', 'aac'), ('mp3', 'mp3'), ('opus', 'opus'), ('vorbis', 'vorbis'), ('ac-3', 'ac3'),
+               ('ac3', 'ac3'), ('ec-3', 'eac3'), ('eac3', 'eac3'), ('flac', 'flac'), ('alac', 'alac')]
+
+# ffmpeg error messages, lower case, which mean a codec can't be stored in target container
+MISMATCH_ERRORS = ('could not find tag for codec', 'not currently supported in container', 'incompatible with output',
+                   'codec not supported', 'unsupported codec', 'muxer does not support', 'are supported for webm',
+                   'exactly one mp3 audio stream is required', 'only aac streams can be muxed')
+
+_lock = Lock()
+_decisions = {}  # {(container, video codec, audio codec): mode}
+
+
+def normalize_codec(name):
+    """'avc1.64001F' ==> 'h264', 'mp4a.40.2' ==> 'aac', 'none' or unknown ==> ''"""
+    name = (name or '').lower().strip()
+    if name in ('', 'none'):
+        return ''
+
+    for prefix, codec in CODEC_NAMES:
+        if name.startswith(prefix):
+            return codec
+
+    return name
+
+
+def ffprobe_path():
+    """ffprobe executable next to ffmpeg, or system wide"""
+    ffmpeg = config.ffmpeg_actual_path or 'ffmpeg'
+    folder, name = os.path.split(ffmpeg)
+    return os.path.join(folder, name.replace('ffmpeg', 'ffprobe'))
+
+
+def probe(file):
+    """
+    get codec names of a media file using ffprobe
+    :param file: media file path
+    :return: dictionary {'video': codec name, 'audio': codec name}, empty values if not found or ffprobe failed
+    """
+    codecs = {'video': '', 'audio': ''}
+
+    cmd = f'"{ffprobe_path()}" -v error -show_entries stream=codec_type,codec_name -of json "{file}"'
+    error, output = run_command(cmd, verbose=False, hide_window=True)
+    if error:
+        log('ffprobe failed:', output, log_level=3)
+        return codecs
+
+    try:
+        for stream in json.loads(output).get('streams', []):
+            kind = stream.get('codec_type')
+            if kind in codecs and not codecs[kind]:
+                codecs[kind] = normalize_codec(stream.get('codec_name'))
+    except Exception as e:
+        log('ffprobe output error:', e, log_level=3)
+
+    return codecs
+
+
+def get_codecs(d, video_file=None, audio_file=None):
+    """
+    codecs of download item, from youtube-dl streams info if available, otherwise probed from downloaded files
+    :return: (video codec, audio codec)
+    """
+    vcodec = normalize_codec(d.vcodec)
+    acodec = normalize_codec(d.acodec)
+
+    if video_file and not vcodec and d.type != 'audio':
+        probed = probe(video_file)
+        vcodec = probed['video']
+        acodec = acodec or probed['audio']
+
+    if audio_file and not acodec:
+        acodec = probe(audio_file)['audio']
+
+    return vcodec, acodec
+
+
+def decide(container, vcodec, acodec):
+    """
+    choose processing mode for target container and source codecs
+    :param container: output file extension without dot, i.e. 'mp4'
+    :param vcodec: normalized video codec or '' for audio only
+    :param acodec: normalized audio codec or '' for no audio
+    :return: COPY, AUDIO, or FULL
+    """
+    key = (container, vcodec, acodec)
+    with _lock:
+        if key in _decisions:
+            return _decisions[key]
+
+    if container not in CONTAINER_CODECS:
+        mode = FULL  # unknown container, let ffmpeg choose
+    elif not vcodec and not acodec:
+        mode = COPY  # codecs unknown, try remux first, mode is downgraded if it fails
+    else:
+        video_ok, audio_ok = CONTAINER_CODECS[container]
+        video_fits = not vcodec or video_ok is None or vcodec in video_ok
+        audio_fits = not acodec or audio_ok is None or acodec in audio_ok
+
+        mode = COPY if video_fits and audio_fits else AUDIO if video_fits else FULL
+
+    with _lock:
+        _decisions[key] = mode
+
+    return mode
+
+
+def is_mismatch(output):
+    """check if ffmpeg output shows that codecs don't fit target container"""
+    output = (output or '').lower()
+    return any(error in output for error in MISMATCH_ERRORS)
+
+
+def downgrade(container, vcodec, acodec, mode, output=''):
+    """
+    a mode failed, get next slower mode to retry the job with
+    :param output: ffmpeg output of failed job, mode is downgraded for this format pair from now on only if output
+                   shows a codec / container mismatch
+    :return: new mode
+    """
+    new_mode = AUDIO if mode == COPY else FULL
+    if is_mismatch(output):
+        with _lock:
+            _decisions[(container, vcodec, acodec)] = new_mode
+    return new_mode
+
+
+def codec_args(mode, container, audio_only=False):
+    """ffmpeg output options for mode"""
+    if mode == COPY:
+        return '-c copy'
+    elif mode == AUDIO:
+        encoder = AUDIO_ENCODERS.get(container)
+        audio = f'-c:a {encoder}' if encoder else ''
+        return f'-vn {audio}' if audio_only else f'-c:v copy {audio}'
+    else:
+        return ''
@@ -0,0 +1,144 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# import download items from url list files, a plain text file with one url per line, or a csv file with url, name,
+# and folder columns "name and folder are optional".
+# headers of all urls are fetched concurrently by utils.get_headers_many(), duplicate urls "same effective url after
+# redirections" are dropped, and ready items are handed over in bulk as soon as their probes complete.
+
+import csv
+import time
+
+from . import config
+from . import dns
+from .utils import log, validate_url, validate_file_name, get_headers_many
+from .downloaditem import DownloadItem
+from .batch import unique_name
+
+
+def parse_url_list(file):
+    """
+    read url list file
+    :param file: path to .txt file "one url per line" or .csv file "url, name, folder columns"
+    :return: list of dictionaries [{'url': url, 'name': name, 'folder': folder}, ...]
+    """
+    entries = []
+    with open(file, encoding='utf-8', errors='ignore', newline='') as f:
+        if file.lower().endswith('.csv'):
+            rows = [row for row in csv.reader(f) if row and row[0].strip()]
+
+            # optional header row, columns can be in any order
+            columns = ['url', 'name', 'folder']
+            if rows and 'url' in [x.strip().lower() for x in rows[0]]:
+                columns = [x.strip().lower() for x in rows.pop(0)]
+
+            for row in rows:
+                entry = {k: v.strip() for k, v in zip(columns, row)}
+                entries.append(entry)
+        else:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    entries.append({'url': line})
+
+    return [{'url': x.get('url', ''), 'name': x.get('name', ''), 'folder': x.get('folder', '')}
+            for x in entries if validate_url(x.get('url', ''))]
+
+
+def probe(entry, folder, headers):
+    """
+    create download item from fetched url headers
+    :param entry: dictionary {'url': url, 'name': name, 'folder': folder}
+    :param folder: default download folder
+    :param headers: url headers, see utils.get_headers()
+    :return: DownloadItem or None if server refused
+    """
+    d = DownloadItem(url=entry['url'], folder=entry['folder'] or folder)
+    d.update(d.url, headers=headers)
+
+    if not d.eff_url or not 200 <= (d.status_code or 0) < 300:
+        log('import url list> failed:', d.url, d.status_code_description, log_level=2)
+        return None
+
+    if entry['name']:
+        d.name = validate_file_name(entry['name'])
+
+    return d
+
+
+def import_url_list(entries, folder, on_items, workers=None, batch_interval=0.5, cancel=None):
+    """
+    probe url list entries concurrently and hand over ready download items in bulk
+    :param entries: list of entries, see parse_url_list()
+    :param folder: default download folder for entries without folder
+    :param on_items: function called with a list of new DownloadItem objects, might be called many times
+    :param workers: max concurrent probes, default to config.probe_workers
+    :param batch_interval: seconds, hand over ready items at most once per interval
+    :param cancel: optional function, import stops if it returns True
+    :return: dictionary with counts, {'added': n, 'duplicates': n, 'failed': n}
+    """
+    stats = {'added': 0, 'duplicates': 0, 'failed': 0}
+
+    # urls already in download list
+    seen = set(d.eff_url for d in config.d_list if d.eff_url)
+
+    # file names used by download list items, new items get unique names to not overwrite or resume other items
+    taken = {}  # {folder: set of names}
+    for d in config.d_list:
+        taken.setdefault(d.folder, set()).add(d.name)
+
+    ready = []
+    timer = time.time()
+
+    # resolve all hosts in background, probes of same host will share one lookup
+    dns.prefetch([entry['url'] for entry in entries])
+
+    # entries which share the same url are probed once
+    url_entries = {}
+    for entry in entries:
+        url_entries.setdefault(entry['url'], []).append(entry)
+
+    results = get_headers_many(list(url_entries), workers=workers)
+    try:
+        for url, headers in results:
+            if config.terminate or (cancel and cancel()):
+                break
+
+            for entry in url_entries[url]:
+                try:
+                    d = probe(entry, folder, headers)
+                except Exception as e:
+                    log('import url list> error:', e)
+                    d = None
+
+                if d is None:
+                    stats['failed'] += 1
+                elif d.eff_url in seen:
+                    stats['duplicates'] += 1
+                    log('import url list> duplicate url skipped:', d.url, log_level=2)
+                else:
+                    seen.add(d.eff_url)
+                    d.name = unique_name(d.name, d.folder, taken.setdefault(d.folder, set()))
+                    ready.append(d)
+
+            if ready and time.time() - timer >= batch_interval:
+                timer = time.time()
+                stats['added'] += len(ready)
+                on_items(ready)
+                ready = []
+    finally:
+        results.close()  # cancel remaining probes
+
+    if ready:
+        stats['added'] += len(ready)
+        on_items(ready)
+
+    log(f'import url list> done, added: {stats["added"]}, duplicates: {stats["duplicates"]}, '
+        f'failed: {stats["failed"]}')
+    return stats
@@ -21,6 +21,8 @@ import subprocess
 import shlex
 import re
 import json
+import threading
+import concurrent.futures
 import pyperclip as clipboard
 try:
     from PIL import Image
@@ -127,12 +129,27 @@ def set_curl_options(c):
     c.setopt(pycurl.AUTOREFERER, 1)
 
 
-def get_headers(url, verbose=False):
-    """return dictionary of headers"""
+# get_headers() keeps a small pool of curl handles, a recycled handle keeps its connections alive, so next probes
+# to the same server skip dns lookup, tcp and tls handshakes, and results are cached for a short time because the same
+# url is probed many times "on url change, streams size, segments size, etc..."
+_probe_lock = threading.Lock()
+_probe_handles = []  # free curl handles
+_headers_cache = {}  # {url: (time, headers)}
+max_probe_handles = 16
 
-    log('get_headers()> getting headers for:', url, log_level=3)
+
+def _probe(url, method, verbose=False):
+    """
+    send a single headers request
+    :param url: url
+    :param method: 'range' for "GET with Range: bytes=0-0", 'head' for HEAD request, or 'get' for a GET request which
+                   is aborted as soon as body data arrives
+    :return: headers dictionary
+    """
+    from . import dns  # dns module imports utils
 
     curl_headers = {}
+    state = {'aborted': False}
 
     def header_callback(header_line):
         # quit if main window terminated
@@ -142,6 +159,11 @@ def get_headers(url, verbose=False):
         header_line = header_line.decode('iso-8859-1')
         header_line = header_line.lower()
 
+        # new status line after redirection, drop headers of previous response
+        if header_line.startswith('http/'):
+            curl_headers.clear()
+            return
+
         if ':' not in header_line:
             return
 
@@ -153,42 +175,129 @@ def get_headers(url, verbose=False):
             print(name, ':', value)
 
     def write_callback(data):
+        # accept the single byte of a range request, otherwise server is sending the whole file, abort
+        if method == 'range' and len(data) <= 1:
+            return
+        state['aborted'] = True
         return -1  # send terminate flag
 
-    def debug_callback(handle, type, data, size=0, userdata=''):
-        """it takes output from curl verbose and pass it to my log function"""
+    with _probe_lock:
+        c = _probe_handles.pop() if _probe_handles else pycurl.Curl()
+
+    try:
+        # set general curl options
+        set_curl_options(c)
+
+        # set special curl options
+        c.setopt(pycurl.URL, url)
+        dns.apply(c, url)  # shared dns cache
+        c.setopt(pycurl.WRITEFUNCTION, write_callback)
+        c.setopt(pycurl.HEADERFUNCTION, header_callback)
+        if method == 'range':
+            c.setopt(pycurl.RANGE, '0-0')
+        elif method == 'head':
+            c.setopt(pycurl.NOBODY, 1)
+
         try:
-            log(data.decode("utf-8"))
-        except:
-            pass
-        return 0
+            c.perform()
+        except Exception as e:
+            # aborted intentionally by write callback
+            if not state['aborted']:
+                log('get_headers()>', e)
 
-    # region curl options
-    c = pycurl.Curl()
+        # add status code and effective url to headers
+        curl_headers['status_code'] = c.getinfo(pycurl.RESPONSE_CODE)
+        curl_headers['eff_url'] = c.getinfo(pycurl.EFFECTIVE_URL)
 
-    # set general curl options
-    set_curl_options(c)
+    finally:
+        # reset options only, connections stay alive for next probes
+        c.reset()
+        with _probe_lock:
+            if len(_probe_handles) < max_probe_handles:
+                _probe_handles.append(c)
+            else:
+                c.close()
 
-    # set special curl options
-    c.setopt(pycurl.URL, url)
-    c.setopt(pycurl.WRITEFUNCTION, write_callback)
-    c.setopt(pycurl.HEADERFUNCTION, header_callback)
-    # endregion
+    # range response, i.e. content-range: bytes 0-0/12345, report it as a normal response for the whole file
+    if method == 'range' and curl_headers['status_code'] == 206:
+        total = curl_headers.get('content-range', '').rsplit('/', 1)[-1].strip()
+        if total.isdigit():
+            curl_headers['content-length'] = total
+        else:
+            curl_headers.pop('content-length', None)  # unknown size 'bytes 0-0/*'
+        curl_headers.pop('content-range', None)
+        curl_headers.setdefault('accept-ranges', 'bytes')
+        curl_headers['status_code'] = 200
 
-    try:
-        c.perform()
-    except Exception as e:
-        if 'Failed writing body' not in str(e):
-            log('get_headers()>', e)
+    return curl_headers
 
-    # add status code and effective url to headers
-    curl_headers['status_code'] = c.getinfo(pycurl.RESPONSE_CODE)
-    curl_headers['eff_url'] = c.getinfo(pycurl.EFFECTIVE_URL)
+
+def get_headers(url, verbose=False, use_cache=True):
+    """
+    return dictionary of headers, it sends a 'Range: bytes=0-0' request first, which doesn't waste a connection by
+    aborting a running download, then falls back to HEAD, then to a GET request aborted as soon as data arrives
+    :param url: url
+    :param verbose: print headers
+    :param use_cache: return cached headers if url probed less than config.headers_cache_ttl seconds ago
+    :return: headers dictionary, with extra 'status_code' and 'eff_url' keys
+    """
+    if use_cache and config.headers_cache_ttl:
+        with _probe_lock:
+            t, headers = _headers_cache.get(url, (0, None))
+        if headers and time.time() - t < config.headers_cache_ttl:
+            log('get_headers()> cached headers for:', url, log_level=3)
+            return dict(headers)
+
+    log('get_headers()> getting headers for:', url, log_level=3)
+
+    # some servers refuse range requests "i.e. 416 for empty files" or HEAD requests "i.e. 405, or 403 for signed urls"
+    for method in ('range', 'head', 'get'):
+        curl_headers = _probe(url, method, verbose=verbose)
+        if curl_headers['status_code'] not in (400, 403, 405, 416, 501):
+            break
+        log(f'get_headers()> {method} request failed with status code:', curl_headers['status_code'], log_level=3)
+
+    if 0 < curl_headers['status_code'] < 400 and config.headers_cache_ttl:
+        with _probe_lock:
+            # remove expired items
+            if len(_headers_cache) > 1000:
+                now = time.time()
+                for key in [k for k, (t, _) in _headers_cache.items() if now - t >= config.headers_cache_ttl]:
+                    _headers_cache.pop(key)
+            _headers_cache[url] = (time.time(), dict(curl_headers))
 
     # return headers
     return curl_headers
 
 
+def get_headers_many(urls, workers=None, use_cache=True):
+    """
+    get headers for many urls concurrently, results are yielded as soon as every probe completes, closing generator
+    early cancels probes which didn't start yet
+    :param urls: list of urls, duplicates are probed once
+    :param workers: max probes in flight, default to config.probe_workers
+    :param use_cache: see get_headers()
+    :return: generator of (url, headers dictionary), empty dictionary if probe failed
+    """
+    urls = list(dict.fromkeys(urls))
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or config.probe_workers)
+    futures = {executor.submit(get_headers, url, use_cache=use_cache): url for url in urls}
+
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                headers = future.result()
+            except Exception as e:
+                log('get_headers_many()> error:', futures[future], e)
+                headers = {}
+
+            yield futures[future], headers
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
 def download(url, file_name=None, verbose=True):
     """
     simple file download, into bytesio buffer and store it on disk if file_name is given
@@ -205,12 +314,15 @@ def download(url, file_name=None, verbose=True):
     if verbose:
         log('download()> downloading', url)
 
+    from . import dns  # dns module imports utils
+
     def set_options():
         # set general curl options
         set_curl_options(c)
 
         # set special curl options
         c.setopt(pycurl.URL, url)
+        dns.apply(c, url)
 
     # pycurl initialize
     c = pycurl.Curl()
@@ -290,44 +402,33 @@ def time_format(t, tail=''):
         return t
 
 
-def log(*args, log_level=1, start='>> ', end='\n', sep=' ', showpopup=False):
+def log_enabled(log_level=1, subsystem=''):
+    """return True if a message with this log level and subsystem will be logged, useful to skip building expensive
+    messages in hot paths"""
+    return log_level <= config.log_levels.get(subsystem, config.log_level)
+
+
+def log(*args, log_level=1, start='>> ', end='\n', sep=' ', showpopup=False, subsystem=''):
     """
-    print messages to stdout and log widget in main menu thru main window queue
+    send messages to log recorder thread which will print it to stdout, write it to log file, and send it to log
+    widget in main menu, formatting is done in log recorder thread, so filtered / queued messages cost almost nothing
     :param args: comma separated messages to be printed
     :param log_level: used to filter messages
     :param start: prefix appended to start of string
     :param end: tail of string
     :param sep: separator used to join text "args"
     :param showpopup: if true will show popup gui message
+    :param subsystem: name of the module / component sending this message, i.e. 'worker', log level for each
+    subsystem can be set in config.log_levels
     :return:
     """
-    if log_level > config.log_level:
+    if log_level > config.log_levels.get(subsystem, config.log_level):
         return
 
-    text = ''
-    for arg in args:
-        text += str(arg)
-        text += sep
-    text = text[:-1]  # remove last space, or sep
-    text = start + text
+    config.log_recorder_q.put((args, start, end, sep, showpopup))
 
-    try:
-        print(text, end=end)
-
-        # one log line, currently used by download window
-        config.log_entry = text
-
-        # sent text to log recorder to write it into log.txt file
-        config.log_recorder_q.put(text + end)
-
-        # send for main menu
-        config.log_q.put(text + end)
-
-        # show popup
-        if showpopup:
-            popup(text)
-    except Exception as e:
-        print(e)
+    if not _log_recorder_started:
+        start_log_recorder()
 
 
 def echo_stdout(func):
@@ -335,7 +436,7 @@ def echo_stdout(func):
 
     def echo(text):
         try:
-            config.log_q.put(('log', text))
+            config.log_q.append(text)
             return func(text)
         except:
             return func(text)
@@ -348,7 +449,7 @@ def echo_stderr(func):
 
     def echo(text):
         try:
-            config.log_q.put(('log', text))
+            config.log_q.append(text)
             return func(text)
         except:
             return func(text)
@@ -760,33 +861,89 @@ def save_json(file=None, data=None):
         log('save_json() > error: ', e)
 
 
+_log_recorder_started = False
+_log_recorder_lock = threading.Lock()
+
+
+def start_log_recorder():
+    """start log recorder thread once for the whole application"""
+    global _log_recorder_started
+    with _log_recorder_lock:
+        if not _log_recorder_started:
+            _log_recorder_started = True
+            threading.Thread(target=log_recorder, daemon=True, name='log_recorder').start()
+
+
 def log_recorder():
-    """write log to disk in real-time"""
+    """format log messages, print them, write them to log file in real-time, and feed log widget's ring buffer"""
     q = config.log_recorder_q
-    buffer = ''
-    file = os.path.join(config.sett_folder, 'log.txt')
+    f = None
+    buffer = ''  # log text waiting for setting folder to be available
 
-    # clear previous file
-    with open(file, 'w') as f:
-        f.write(buffer)
+    def open_log_file(mode):
+        # log file follows setting folder if it changes while running, f.name is checked before every write
+        file = os.path.join(config.sett_folder, 'log.txt')
+        return open(file, mode, encoding="utf-8", errors="ignore")
 
-    while True:
-        time.sleep(0.1)
-        if config.terminate:
-            break
+    def rotate():
+        # keep one previous log file "log.txt.1" and start new one
+        f.close()
+        os.replace(f.name, f.name + '.1')
+        return open_log_file('w')
 
-        # read log messages from queue
+    while True:
+        # block until there is a message
+        records = [q.get()]
         for _ in range(q.qsize()):
-            buffer += q.get()
+            records.append(q.get())
 
-        # write buffer to file
-        if buffer:
+        lines = []
+        for args, start, end, sep, showpopup in records:
             try:
-                with open(file, 'a', encoding="utf-8", errors="ignore") as f:
-                    f.write(buffer)
-                    buffer = ''  # reset buffer
+                text = start + sep.join(str(arg) for arg in args)
             except Exception as e:
-                print('log_recorder()> error:', e)
+                text = f'{start}log_recorder()> error formatting message: {e}'
+
+            lines.append(text + end)
+
+            # one log line, currently used by download window
+            config.log_entry = text
+
+            # send for main menu, it is a bounded buffer, old messages will be dropped if nobody reads it
+            config.log_q.append(text + end)
+
+            # show popup
+            if showpopup:
+                popup(text)
+
+        text = ''.join(lines)
+
+        try:
+            print(text, end='')
+        except Exception as e:
+            print('log_recorder()> error:', e)
+
+        # write to log file
+        try:
+            buffer += text
+            if f is None and config.sett_folder:
+                f = open_log_file('w')  # clear previous file
+
+            # setting folder changed, continue logging in new folder
+            elif f and config.sett_folder and f.name != os.path.join(config.sett_folder, 'log.txt'):
+                f.close()
+                f = open_log_file('a')
+
+            if f:
+                f.write(buffer)
+                f.flush()
+                buffer = ''
+
+                if config.max_log_size and f.tell() > config.max_log_size:
+                    f = rotate()
+        except Exception as e:
+            print('log_recorder()> error:', e)
+            buffer = ''
 
 
 def natural_sort(my_list):
@@ -1000,10 +1157,12 @@ def calc_sha256(file_name=None, buffer=None):
         return f'calc_sha256()> error, {str(e)}'
 
 
-def get_range_list(file_size):
+def get_range_list(file_size, piece_length=0, segment_size=None):
     """
     return a list of ranges depend on config.segment_size and config.max_connections
     :param file_size: file size
+    :param piece_length: if given, segments' boundaries will be aligned to multiples of this value "i.e. metalink pieces"
+    :param segment_size: minimum segment size, default to config.segment_size, see planner.initial_segment_size()
     :return: list of ranges i.e. [[0, 100], [101, 2000], ... ]
     """
 
@@ -1011,10 +1170,14 @@ def get_range_list(file_size):
         return [None]
 
     range_list = []  # size_splitter(self.size, self.segment_size)
-    max_seg_nums = file_size // config.segment_size or 1
+    max_seg_nums = file_size // (segment_size or config.segment_size) or 1
     seg_nums = min(max_seg_nums, config.max_connections)
     seg_size = file_size // seg_nums
 
+    if piece_length:
+        seg_size = max(seg_size // piece_length, 1) * piece_length
+        seg_nums = min(seg_nums, -(-file_size // seg_size))  # ceil division
+
     start = 0
     end = 0
     for i in range(seg_nums):
@@ -1026,6 +1189,110 @@ def get_range_list(file_size):
     return range_list
 
 
+def percentile(values, p):
+    """
+    get percentile of a list of numbers using nearest-rank method
+    :param values: list of numbers
+    :param p: percentile 0 ~ 100, i.e. 50 for median
+    :return: number or None if values is empty
+    """
+    if not values:
+        return None
+
+    values = sorted(values)
+    index = max(0, -(-len(values) * p // 100) - 1)  # ceil(n*p/100) - 1
+    return values[int(index)]
+
+
+def get_block_size(file):
+    """return file system block size for a file or folder, default to 4096"""
+    try:
+        return os.stat(file).st_blksize or 4096
+    except Exception:
+        return 4096
+
+
+def get_free_space(folder):
+    """return free space in bytes for file system of a folder, or None if not available"""
+    try:
+        return shutil.disk_usage(folder).free
+    except Exception:
+        return None
+
+
+def preallocate(file, size):
+    """
+    reserve disk space for a file, this avoid fragmentation and failing late with "no space left on device"
+    use posix_fallocate if available, otherwise fallback to a sparse file by setting file length
+    :param file: file path, will be created if not exist
+    :param size: file size in bytes
+    :return: method used 'fallocate' or 'sparse', or None if failed
+    """
+    try:
+        with open(file, 'ab') as f:
+            if hasattr(os, 'posix_fallocate'):
+                try:
+                    os.posix_fallocate(f.fileno(), 0, size)
+                    return 'fallocate'
+                except OSError as e:
+                    # some file systems don't support it, i.e. "EOPNOTSUPP" on some network file systems
+                    log('preallocate()> posix_fallocate failed:', e, log_level=3)
+
+            f.truncate(size)
+            return 'sparse'
+
+    except Exception as e:
+        log('preallocate()> error:', e)
+        return None
+
+
+def copy_file_data(src_file, trgt_file, size=None, block_size=4096, chunk_size=1024 * 1024):
+    """
+    copy data from source file object into target file object at its current position in chunks, first chunk will
+    fill up to next block boundary, then all writes start at block aligned offsets with block multiple sizes
+    :param src_file: source file object opened for reading
+    :param trgt_file: target file object, already seeked to required position
+    :param size: number of bytes to copy, None to copy until end of source
+    :param block_size: file system block size
+    :param chunk_size: approximate size of every write, rounded to block size multiple
+    :return: number of copied bytes
+    """
+    chunk_size = max(chunk_size // block_size, 1) * block_size
+    head = (-trgt_file.tell()) % block_size  # bytes needed to reach next block boundary
+
+    copied = 0
+    n = head or chunk_size
+    while size is None or copied < size:
+        if size is not None:
+            n = min(n, size - copied)
+        data = src_file.read(n)
+        if not data:
+            break
+        trgt_file.write(data)
+        copied += len(data)
+        n = chunk_size
+
+    return copied
+
+
+def read_speed(file, chunk_size=1024 * 1024):
+    """
+    measure sequential read speed of a file, note: result might be affected by os file cache
+    :return: speed in bytes per second
+    """
+    start = time.time()
+    total = 0
+    with open(file, 'rb', buffering=0) as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            total += len(data)
+
+    duration = time.time() - start
+    return total / duration if duration else 0
+
+
 __all__ = [
     'notify', 'handle_exceptions', 'get_headers', 'download', 'size_format', 'time_format', 'log', 'validate_file_name',
     'size_splitter', 'delete_folder', 'get_seg_size', 'run_command', 'print_object', 'update_object', 'truncate',
@@ -1033,6 +1300,7 @@ __all__ = [
     'rename_file', 'load_json', 'save_json', 'echo_stdout', 'echo_stderr', 'log_recorder', 'natural_sort', 'is_pkg_exist',
     'process_thumbnail', 'parse_bytes', 'set_curl_options', 'execute_command', 'clipboard', 'version_value',
     'reset_queue', 'flip_visibility', 'alternative_to_gtk_clipboard', 'open_folder', 'auto_rename', 'calc_md5',
-    'calc_sha256', 'get_range_list'
+    'calc_sha256', 'get_range_list', 'log_enabled', 'start_log_recorder', 'percentile', 'get_headers_many',
+    'get_block_size', 'get_free_space', 'preallocate', 'copy_file_data', 'read_speed'
 
 ]
@@ -14,6 +14,8 @@ import time
 from urllib.parse import urljoin
 
 from . import config
+from . import postproc
+from . import transcode
 from .downloaditem import DownloadItem, Segment
 from .utils import (log, validate_file_name, get_headers, size_format, run_command, size_splitter, get_seg_size,
                     delete_file, download, process_thumbnail, execute_command, rename_file)
@@ -276,6 +278,8 @@ class Video(DownloadItem):
         self.resolution = stream.resolution
         self.abr = stream.abr
         self.tbr = stream.tbr
+        self.vcodec = stream.vcodec
+        self.acodec = stream.acodec
 
         # set type ---------------------------------------------------------------------------------------
         self.type = 'audio' if stream.mediatype == 'audio' else 'video'
@@ -326,6 +330,7 @@ class Video(DownloadItem):
             self.audio_fragment_base_url = audio_stream.fragment_base_url
             self.audio_fragments = audio_stream.fragments
             self.audio_format_id = audio_stream.format_id
+            self.acodec = audio_stream.acodec
 
             print('downloaditem.select_audio:', self.audio_quality)
         else:
@@ -537,30 +542,50 @@ def check_ffmpeg():
             config.global_sett_folder, 'or', config.current_directory)
 
 
-def merge_video_audio(video, audio, output, d):
-    """merge video file and audio file into output file, d is a reference for current DownloadItem object"""
-    log('merging video and audio')
-
-    # ffmpeg file full location
+def run_ffmpeg(inputs, output, d, operation):
+    """
+    process media files with ffmpeg, processing mode "remux, audio transcode, or full transcode" is chosen up front
+    by transcode module, and downgraded only if it fails
+    :param inputs: list of input files, [video, audio] or [audio]
+    :param output: output file, its extension decides target container
+    :param d: DownloadItem object
+    :param operation: name for logging
+    :return: error (True or False), output (string of ffmpeg output)
+    """
     ffmpeg = config.ffmpeg_actual_path
+    container = os.path.splitext(output)[1].lstrip('.').lower()
+    audio_only = d.type == 'audio'
 
-    # very fast audio just copied, format must match [mp4, m4a] and [webm, webm]
-    cmd1 = f'"{ffmpeg}" -loglevel error -stats -y -i "{video}" -i "{audio}" -c copy "{output}"'
-
-    # slow, mix different formats
-    cmd2 = f'"{ffmpeg}" -loglevel error -stats -y -i "{video}" -i "{audio}" "{output}"'
+    if audio_only:
+        vcodec, acodec = transcode.get_codecs(d, audio_file=inputs[0])
+    else:
+        vcodec, acodec = transcode.get_codecs(d, video_file=inputs[0], audio_file=inputs[1] if inputs[1:] else None)
 
+    mode = transcode.decide(container, vcodec, acodec)
+    input_args = ' '.join(f'-i "{file}"' for file in inputs)
     verbose = True if config.log_level >= 2 else False
 
-    # run command with shell=False if failed will use shell=True option
-    error, output = run_command(cmd1, verbose=verbose, hide_window=True, d=d)
+    while True:
+        cmd = f'"{ffmpeg}" -loglevel error -stats -y {input_args} {transcode.codec_args(mode, container, audio_only)} ' \
+              f'"{output}"'
 
-    # retry on error with cmd2
-    if error:
-        error, output = run_command(cmd2, verbose=verbose, hide_window=True, d=d)
+        start = time.time()
+        error, result = run_command(cmd, verbose=verbose, hide_window=True, d=d)
+        log(f'{operation}()> {vcodec or "?"}/{acodec or "?"} to {container}, mode: {mode}, '
+            f'{"failed" if error else "done"} in {time.time() - start:.1f} seconds')
+
+        if not error or mode == transcode.FULL or d.status == config.Status.cancelled:
+            return error, result
+
+        mode = transcode.downgrade(container, vcodec, acodec, mode, result)
+
+
+def merge_video_audio(video, audio, output, d):
+    """merge video file and audio file into output file, d is a reference for current DownloadItem object"""
+    log('merging video and audio')
+
+    return run_ffmpeg([video, audio], output, d, 'merge_video_audio')
 
-    return error, output
-            
 
 def import_ytdl():
     # import youtube_dl using thread because it takes sometimes 20 seconds to get imported and impact app startup time
@@ -597,6 +622,117 @@ def import_ytdl():
         log('import_ytdl()> error', e)
 
 
+# some servers will change the contents of m3u8 file dynamically, not sure how often
+# ex: https://www.dplay.co.uk/show/help-my-house-is-haunted/video/the-skirrid-inn/EHD_259618B
+# solution is to download master manifest again, then get the updated media url
+# X-STREAM: must have BANDWIDTH, X-MEDIA: must have TYPE, GROUP-ID, NAME=="language name"
+# tbr for videos calculated by youtube-dl == BANDWIDTH/1000
+def refresh_hls_urls(d, m3u8_doc, m3u8_url):
+    """
+    update media playlists urls of download item from master m3u8 file
+    :param d: DownloadItem object
+    :param m3u8_doc: master m3u8 as a text
+    :param m3u8_url: master m3u8 url
+    """
+    # using youtube-dl internal function
+    extract_m3u8_formats = ytdl.extractor.common.InfoExtractor._parse_m3u8_formats
+
+    # get formats list [{'format_id': 'hls-160000mp4a.40.2-spa', 'url': 'http://ex.com/exp=15...'}, ...]
+    # what we need is format_id and url
+    formats = extract_m3u8_formats(None, m3u8_doc, m3u8_url, m3u8_id='hls')  # not sure about  m3u8_id='hls'
+    for item in formats:
+        url = item.get('url')
+        # url = urljoin(d.manifest_url, url)
+        format_id = item.get('format_id')
+
+        # get format id without m3u8-id "hls-"
+        stripped_format_id = format_id.replace('hls-', '') if format_id.startswith('hls-') else format_id
+
+        # video check
+        if d.format_id and (d.format_id == format_id or stripped_format_id in d.format_id):
+            # print('old video url, new video url:\n', d.eff_url, '\n', url)
+            d.eff_url = url
+
+        # audio check
+        if d.audio_format_id and (d.audio_format_id == format_id or stripped_format_id in d.audio_format_id):
+            # print('old video url, new video url:\n', d.audio_url, '\n', url)
+            d.audio_url = url
+
+
+# download item attributes updated by refresh_media_urls()
+REFRESHED_FIELDS = ('eff_url', 'manifest_url', 'fragment_base_url', 'fragments', 'audio_url', 'audio_fragment_base_url',
+                    'audio_fragments')
+
+
+def refresh_media_urls(d):
+    """
+    get fresh media urls for a video download item, signed urls of some websites "i.e. youtube" expire while
+    downloading, new urls are extracted for same format ids.
+    download item isn't changed, workers are reading its urls meanwhile, caller should apply returned fields
+    :param d: DownloadItem object
+    :return: ({segment name: new url}, {download item attribute: new value}), empty dictionaries if failed
+    """
+    log('refresh_media_urls()> refreshing expired links for:', d.name)
+
+    d = copy.copy(d)  # work on a copy, shared lists "segments, fragments" are only read here
+
+    # re-extract video info by youtube-dl, and pick the same formats
+    if ytdl and d.format_id:
+        with ytdl.YoutubeDL(get_ytdl_options()) as ydl:
+            vid_info = ydl.extract_info(d.url, download=False, process=True)
+
+        formats = (vid_info.get('formats') or [vid_info]) if vid_info else []
+        video = [f for f in formats if f.get('format_id') == d.format_id]
+        audio = [f for f in formats if d.audio_format_id and f.get('format_id') == d.audio_format_id]
+
+        if not video:
+            log('refresh_media_urls()> format not found:', d.format_id)
+            return {}, {}
+
+        d.eff_url = video[0].get('url') or d.eff_url
+        d.manifest_url = video[0].get('manifest_url') or d.manifest_url
+        d.fragment_base_url = video[0].get('fragment_base_url') or d.fragment_base_url
+        d.fragments = video[0].get('fragments') or d.fragments
+
+        if audio:
+            d.audio_url = audio[0].get('url') or d.audio_url
+            d.audio_fragment_base_url = audio[0].get('fragment_base_url') or d.audio_fragment_base_url
+            d.audio_fragments = audio[0].get('fragments') or d.audio_fragments
+
+    urls = {}
+    if 'hls' in d.subtype_list:
+        # media playlists urls from master manifest
+        if d.manifest_url:
+            master_m3u8 = download_m3u8(d.manifest_url)
+            if master_m3u8 and "#EXT-X-TARGETDURATION" not in master_m3u8:
+                refresh_hls_urls(d, master_m3u8, d.manifest_url)
+
+        # segments get same names from playlists, see MediaPlaylist.parse_m3u8_doc()
+        streams = [(d.eff_url, 'video')] + ([(d.audio_url, 'audio')] if 'dash' in d.subtype_list else [])
+        for url, stream_type in streams:
+            m3u8_doc = download_m3u8(url)
+            if not m3u8_doc:
+                return {}, {}
+
+            for seg in MediaPlaylist(d, url, m3u8_doc, stream_type).create_segment_list():
+                urls[seg.name] = seg.url
+
+    else:
+        for seg in d.segments:
+            if seg.tempfile == d.audio_file:
+                url, fragments, base_url = d.audio_url, d.audio_fragments, d.audio_fragment_base_url
+            else:
+                url, fragments, base_url = d.eff_url, d.fragments, d.fragment_base_url
+
+            if fragments and seg.num is not None and seg.num < len(fragments):
+                urls[seg.name] = urljoin(base_url, fragments[seg.num].get('path', ''))
+            elif url:
+                urls[seg.name] = url
+
+    fields = {key: getattr(d, key) for key in REFRESHED_FIELDS}
+    return urls, fields
+
+
 def pre_process_hls(d):
     """
     handle m3u8 manifest file, build a local m3u8 file, and build DownloadItem segments
@@ -614,36 +750,6 @@ def pre_process_hls(d):
             log('HLS pre processing Failed:', e, showpopup=True)
             return False
 
-    # some servers will change the contents of m3u8 file dynamically, not sure how often
-    # ex: https://www.dplay.co.uk/show/help-my-house-is-haunted/video/the-skirrid-inn/EHD_259618B
-    # solution is to download master manifest again, then get the updated media url
-    # X-STREAM: must have BANDWIDTH, X-MEDIA: must have TYPE, GROUP-ID, NAME=="language name"
-    # tbr for videos calculated by youtube-dl == BANDWIDTH/1000
-    def refresh_urls(m3u8_doc, m3u8_url):
-        # using youtube-dl internal function
-        extract_m3u8_formats = ytdl.extractor.common.InfoExtractor._parse_m3u8_formats
-
-        # get formats list [{'format_id': 'hls-160000mp4a.40.2-spa', 'url': 'http://ex.com/exp=15...'}, ...]
-        # what we need is format_id and url
-        formats = extract_m3u8_formats(None, m3u8_doc, m3u8_url, m3u8_id='hls')  # not sure about  m3u8_id='hls'
-        for item in formats:
-            url = item.get('url')
-            # url = urljoin(d.manifest_url, url)
-            format_id = item.get('format_id')
-
-            # get format id without m3u8-id "hls-"
-            stripped_format_id = format_id.replace('hls-', '') if format_id.startswith('hls-') else format_id
-
-            # video check
-            if d.format_id and (d.format_id == format_id or stripped_format_id in d.format_id):
-                # print('old video url, new video url:\n', d.eff_url, '\n', url)
-                d.eff_url = url
-
-            # audio check
-            if d.audio_format_id and (d.audio_format_id == format_id or stripped_format_id in d.audio_format_id):
-                # print('old video url, new video url:\n', d.audio_url, '\n', url)
-                d.audio_url = url
-
     def not_supported(m3u8_doc):
         # return msg if there is un supported protocol found in the m3u8 file
 
@@ -673,7 +779,7 @@ def pre_process_hls(d):
     if master_m3u8:
         # master playlist doesn't have "#EXT-X-TARGETDURATION" tag, only media playlist has it
         if not "#EXT-X-TARGETDURATION" in master_m3u8:
-            refresh_urls(master_m3u8, d.manifest_url)
+            refresh_hls_urls(d, master_m3u8, d.manifest_url)
 
     log('video m3u8:        ', d.eff_url)
     video_m3u8 = download_m3u8(d.eff_url)
@@ -878,25 +984,9 @@ def convert_audio(d):
     :return: bool True for success or False when failed
     """
     # famous formats: mp3, aac, wav, ogg
-    infile = d.temp_file
-    outfile = d.target_file
-
-    # look for compatible formats and use "copy" parameter for faster processing
-    cmd1 = f'"{config.ffmpeg_actual_path}" -loglevel error -stats -y -i "{infile}" -acodec copy "{outfile}"'
+    error, _ = run_ffmpeg([d.temp_file], d.target_file, d, 'convert_audio')
 
-    # general command, consume time
-    cmd2 = f'"{config.ffmpeg_actual_path}" -loglevel error -stats -y -i "{infile}" "{outfile}"'
-
-    # run command1
-    error, _ = run_command(cmd1, verbose=True, hide_window=True, d=d)
-
-    if error:
-        error, _ = run_command(cmd2, verbose=True, hide_window=True, d=d)
-
-    if error:
-        return False
-    else:
-        return True
+    return not error
 
 
 # parse m3u8 lines
@@ -1019,7 +1109,8 @@ def download_subtitles(subs, d, ext='srt'):
 
             cmd = f'"{ffmpeg}" -y -i "{file_name}" "{output}"'
 
-            error, _ = run_command(cmd, verbose=False, shell=True)
+            error, _ = postproc.run(run_command, cmd, verbose=False, shell=True, owner=d, name='convert_subtitle',
+                                    default=(True, ''))
             if not error:
                 delete_file(file_name)
                 rename_file(oldname=output, newname=file_name)
@@ -1046,8 +1137,10 @@ def download_subtitles(subs, d, ext='srt'):
 
 
 class Key(Segment):
+    __slots__ = ('method', 'iv', 'raw_line')
+
     def __init__(self):
-        super().__init__(self)
+        super().__init__()
         self.name = None
         self.url = None  # URI
         self.method = None  # encryption method, METHOD: NONE, AES-128, and SAMPLE-AES ,  NONE = no encryption
@@ -1057,9 +1150,10 @@ class Key(Segment):
     def __repr__(self):
         return self.create_line()
 
-    def create_line(self):
+    def create_line(self, url=None):
+        """build key line, with optional url to replace the key uri, i.e. local file path"""
         info = parse_m3u8_line(self.raw_line)
-        return self.raw_line.replace(info.get('URI', '__NONE__'), self.url)
+        return self.raw_line.replace(info.get('URI', '__NONE__'), url or self.url)
 
 
 class MediaPlaylist:
@@ -1163,7 +1257,13 @@ class MediaPlaylist:
         for seg in self.segments:
             print(seg)
 
-    def create_m3u8_doc(self, segments):
+    def create_m3u8_doc(self, segments, local=False):
+        """
+        build m3u8 doc from segments
+        :param segments: list of Segment objects
+        :param local: if True, local file paths will be used instead of remote urls
+        :return: m3u8 doc as a string
+        """
         lines = []
 
         # start of playlist
@@ -1178,9 +1278,9 @@ class MediaPlaylist:
         # segments
         for seg in segments:
             if seg.key:
-                lines.append(seg.key.create_line())
+                lines.append(seg.key.create_line(seg.key.name.replace('\\', '/') if local else None))
             lines.append(f'#EXTINF:{seg.duration},')
-            lines.append(seg.url)
+            lines.append(seg.name.replace('\\', '/') if local else seg.url)
 
         # end of playlist
         lines.append('#EXT-X-ENDLIST')
@@ -1193,14 +1293,8 @@ class MediaPlaylist:
         return self.create_m3u8_doc(self.segments)
 
     def create_local_m3u8_doc(self):
-        segments = copy.deepcopy(self.segments)
-        for seg in segments:
-            seg.url = seg.name.replace('\\', '/')
-
-            if seg.key:
-                seg.key.url = seg.key.name.replace('\\', '/')
-
-        return self.create_m3u8_doc(segments)
+        # no need to deepcopy segments, local paths are substituted while building the doc
+        return self.create_m3u8_doc(self.segments, local=True)
 
     def create_segment_list(self):
 
@@ -9,29 +9,44 @@
 
 # worker class
 import os
+import time
 import pycurl
+from queue import Queue, Empty
+from threading import Thread, Lock
 
-from .config import Status, error_q, jobs_q
-from .utils import log, set_curl_options, size_format
+from .config import Status
+from .utils import log, log_enabled, set_curl_options, size_format, get_block_size
+from .writer import BufferedWriter
+from . import metrics
+from . import retry
+from . import dns
+from .connections import host_of
 
 
 class Worker:
-    def __init__(self, tag=0, d=None):
+    def __init__(self, tag=0, d=None, http2=False):
         self.tag = tag
         self.d = d
         self.seg = None
         self.resume_range = None
+        self.http2 = http2  # request http/2 and allow stream multiplexing, used with Multiplexer
 
         # writing data parameters
-        self.file = None
+        self.file = None  # BufferedWriter object
         self.mode = 'wb'  # file opening mode default to new write binary
+        self.start_size = 0  # segment file size before this transfer, in case of resuming
+        self.paused = False  # transfer paused because write buffer is full
+        self.oversized = False  # received data exceeded segment size
+        self.restart = False  # stop transfer to resume segment with new options, i.e. speed limit changed
 
         self.downloaded = 0
+        self.start_time = 0
 
         # connection parameters
         self.c = pycurl.Curl()
         self.speed_limit = 0
         self.headers = {}
+        self.status_code = 0  # from response status line, getinfo() can't be used while transfer is running
 
         # minimum speed and timeout, abort if download speed slower than n byte/sec during n seconds
         self.minimum_speed = None
@@ -55,13 +70,14 @@ class Worker:
         self.minimum_speed = minimum_speed
         self.timeout = timeout
 
-        msg = f'Seg {self.seg.basename} start, size: {size_format(self.seg.size)} - range: {self.seg.range}'
-        if self.speed_limit:
-            msg += f'- SL= {self.speed_limit}'
-        if self.minimum_speed:
-            msg += f'- minimum speed= {self.minimum_speed}, timeout={self.timeout}'
+        if log_enabled(2, 'worker'):
+            msg = f'Seg {self.seg.basename} start, size: {size_format(self.seg.size)} - range: {self.seg.range}'
+            if self.speed_limit:
+                msg += f'- SL= {self.speed_limit}'
+            if self.minimum_speed:
+                msg += f'- minimum speed= {self.minimum_speed}, timeout={self.timeout}'
 
-        log(msg, ' - worker', self.tag, log_level=2)
+            log(msg, ' - worker', self.tag, log_level=2, subsystem='worker')
 
         self.check_previous_download()
 
@@ -72,7 +88,13 @@ class Worker:
         # reset variables
         self.file = None
         self.mode = 'wb'  # file opening mode default to new write binary
+        self.start_size = 0
+        self.paused = False
+        self.oversized = False
+        self.restart = False
         self.downloaded = 0
+        self.status_code = 0
+        self.headers = {}
         self.resume_range = None
 
     def check_previous_download(self):
@@ -81,7 +103,7 @@ class Worker:
             self.d.downloaded -= self.current_filesize
             self.mode = 'wb'
             log('Seg', self.seg.basename, 'overwrite the previous part-downloaded segment', ' - worker', self.tag,
-                log_level=3)
+                log_level=3, subsystem='worker')
 
         # if file doesn't exist will start fresh
         if not os.path.exists(self.seg.name):
@@ -96,19 +118,20 @@ class Worker:
         # at this point file exists and resume is possible
         # case-1: segment is completed before
         if self.current_filesize == self.seg.size:
-            log('Seg', self.seg.basename, 'already completed before', ' - worker', self.tag, log_level=3)
-            self.seg.downloaded = True
+            log('Seg', self.seg.basename, 'already completed before', ' - worker', self.tag, log_level=3,
+                subsystem='worker')
+            self.report_completed()
 
         # Case-2: over-sized, in case the server sent extra bytes from last session by mistake, truncate file
         elif self.current_filesize > self.seg.size:
             log('Seg', self.seg.basename, 'over-sized', self.current_filesize, 'will be truncated to:',
-                size_format(self.seg.size), ' - worker', self.tag, log_level=3)
+                size_format(self.seg.size), ' - worker', self.tag, log_level=3, subsystem='worker')
 
             # truncate file
             with open(self.seg.name, 'rb+') as f:
                 f.truncate(self.seg.size)
-            self.seg.downloaded = True
             self.d.downloaded -= self.current_filesize - self.seg.size
+            self.report_completed()
 
         # Case-3: Resume, with new range
         elif self.seg.range and self.current_filesize < self.seg.size:
@@ -119,7 +142,8 @@ class Worker:
 
             # report
             log('Seg', self.seg.basename, 'resuming, new range:', self.resume_range,
-                'current segment size:', size_format(self.current_filesize), ' - worker', self.tag, log_level=3)
+                'current segment size:', size_format(self.current_filesize), ' - worker', self.tag, log_level=3,
+                subsystem='worker')
 
         # case-x: overwrite
         else:
@@ -135,19 +159,23 @@ class Worker:
 
     def report_not_completed(self):
         log('Seg', self.seg.basename, 'did not complete', '- done', size_format(self.current_filesize), '- target size:',
-            size_format(self.seg.size), '- left:', size_format(self.seg.size - self.current_filesize), '- worker', self.tag, log_level=3)
+            size_format(self.seg.size), '- left:', size_format(self.seg.size - self.current_filesize), '- worker', self.tag,
+            log_level=3, subsystem='worker')
 
     def report_completed(self):
         # self.debug('worker', self.tag, 'completed', self.seg.name)
         self.seg.downloaded = True
 
-        log('downloaded segment: ',  self.seg.basename, '- worker', self.tag, log_level=2)
+        log('downloaded segment: ',  self.seg.basename, '- worker', self.tag, log_level=2, subsystem='worker')
 
         # in case couldn't fetch segment size from headers
         if not self.seg.size:
             self.seg.size = self.current_filesize
         # print(self.headers)
 
+        # notify file manager, segment is ready to be merged
+        self.d.completed_q.put(self.seg)
+
     def set_options(self):
 
         # set general curl options
@@ -155,6 +183,9 @@ class Worker:
 
         self.c.setopt(pycurl.URL, self.seg.url)
 
+        # pre-resolved host addresses, multiplexed workers are prepared in multiplexer's loop and must not block on dns
+        dns.apply(self.c, self.seg.url, wait=not self.http2)
+
         range_ = self.resume_range or self.seg.range
         if range_:
             self.c.setopt(pycurl.RANGE, f'{range_[0]}-{range_[1]}')  # download segment only not the whole file
@@ -167,6 +198,11 @@ class Worker:
         # verbose
         self.c.setopt(pycurl.VERBOSE, 0)
 
+        # http/2, wait for an existing connection to the same host to multiplex on it instead of opening a new one
+        if self.http2:
+            self.c.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2_0)
+            self.c.setopt(pycurl.PIPEWAIT, 1)
+
         # call back functions
         self.c.setopt(pycurl.HEADERFUNCTION, self.header_callback)
         self.c.setopt(pycurl.WRITEFUNCTION, self.write)
@@ -183,6 +219,14 @@ class Worker:
         header_line = header_line.decode('iso-8859-1')
         header_line = header_line.lower()
 
+        # status line i.e. "HTTP/1.1 403 Forbidden", it might be received more than once with redirections
+        if header_line.startswith('http/'):
+            try:
+                self.status_code = int(header_line.split()[1])
+            except (IndexError, ValueError):
+                pass
+            return
+
         if ':' not in header_line:
             return
 
@@ -204,32 +248,69 @@ class Worker:
         Returning a non-zero value from this callback will cause curl to abort the transfer
         """
 
-        # check termination by user
-        if self.d.status != Status.downloading:
+        # check termination by user, or stop transfer to be resumed with new options, curl options can't be
+        # changed while transfer is running
+        if self.d.status != Status.downloading or self.restart:
             return -1  # abort
 
+        # resume paused transfer when writer threads flushed enough data to disk
+        if self.paused and self.file and self.file.resumable:
+            self.paused = False
+            self.c.pause(pycurl.PAUSE_CONT)
+
+    def record_transfer_stats(self):
+        """store libcurl timing info for last transfer in download item, to find out where time is spent:
+        dns lookup, tcp connect, tls handshake, or waiting for server's first byte"""
+        try:
+            c = self.c
+            self.d.transfer_stats.append({
+                'time': round(time.time(), 3),
+                'segment': self.seg.basename,
+                'response_code': c.getinfo(pycurl.RESPONSE_CODE),
+                'bytes': self.downloaded,
+                'namelookup_time': c.getinfo(pycurl.NAMELOOKUP_TIME),
+                'connect_time': c.getinfo(pycurl.CONNECT_TIME),
+                'appconnect_time': c.getinfo(pycurl.APPCONNECT_TIME),
+                'starttransfer_time': c.getinfo(pycurl.STARTTRANSFER_TIME),
+                'total_time': c.getinfo(pycurl.TOTAL_TIME),
+                'speed_download': c.getinfo(pycurl.SPEED_DOWNLOAD),
+                'num_connects': c.getinfo(pycurl.NUM_CONNECTS),  # 0 means connection reused
+            })
+        except Exception as e:
+            log('record_transfer_stats()> error:', e, log_level=3, subsystem='worker')
+
     def report_error(self, description='unspecified error'):
-        # report server error to thread manager, to dynamically control connections number
-        error_q.put(description)
+        # report server error to thread manager, to dynamically control connections number of segment's host
+        self.d.error_q.put((host_of(self.seg.url), description))
 
-    def run(self):
+    def prepare(self):
+        """
+        lock segment, set curl options, and open segment file
+        :return: True if ready to perform transfer, False if segment should be skipped or preparation failed
+        """
         # check if file completed before and exit
         if self.seg.downloaded or self.seg.locked:
-            return
+            self.release_mirror()
+            return False
 
         # check if segment in use by another worker
         if self.seg.locked:
-            log('Seg', self.seg.basename, 'segment in use by another worker', '- worker', {self.tag}, log_level=2)
-            return
+            log('Seg', self.seg.basename, 'segment in use by another worker', '- worker', {self.tag}, log_level=2,
+                subsystem='worker')
+            self.release_mirror()
+            return False
 
         if not self.seg.url:
-            log('Seg', self.seg.basename, 'segment has no valid url', '- worker', {self.tag}, log_level=2)
+            log('Seg', self.seg.basename, 'segment has no valid url', '- worker', {self.tag}, log_level=2,
+                subsystem='worker')
             self.report_error('invalid_url')
-            return
+            self.release_mirror()
+            return False
 
         try:
             # set lock
             self.seg.locked = True
+            self.start_time = time.time()
 
             # set options
             self.set_options()
@@ -239,63 +320,184 @@ class Worker:
             if not os.path.isdir(target_directory):
                 os.makedirs(target_directory)  # it will also create any intermediate folders in the given path
 
-            # open segment file
-            self.file = open(self.seg.name, self.mode, buffering=0)
+            # open segment file, data will be written to disk by writer threads
+            self.file = BufferedWriter(self.seg.name, self.mode, block_size=get_block_size(target_directory))
+            self.start_size = self.file.position
 
-            # Main Libcurl operation
-            self.c.perform()
+            return True
 
-            # check if download completed
-            completed = self.verify()
-            if completed:
-                self.report_completed()
+        except Exception as e:
+            self.finish(error=e)
+            return False
+
+    def release_mirror(self):
+        """segment skipped before transfer, mirror selected for it is not used"""
+        if self.d.mirror_pool:
+            self.d.mirror_pool.release(self.seg.url)
+
+    def finish(self, error=None):
+        """
+        check transfer result, report errors, and release segment, called after curl transfer is done
+        :param error: exception raised by curl perform or preparation, None if transfer went fine
+        """
+        failed = False
+        description = ''  # failure description
+        response_code = 0
+
+        # flush buffered data and close segment file
+        if self.file:
+            try:
+                self.file.close()
+            except Exception as e:
+                log('Seg', self.seg.basename, '- worker', self.tag, 'failed writing to disk', e, log_level=3,
+                    subsystem='worker')
+                error = error or e
+            self.file = None
+
+        # server sent more data than segment size, or segment range got shorter by thread manager to let another
+        # worker download the rest, write function aborted transfer intentionally
+        if self.oversized and isinstance(error, pycurl.error):
+            error = None
+            size = self.current_filesize
+            if size > self.seg.size:
+                with open(self.seg.name, 'rb+') as f:
+                    f.truncate(self.seg.size)
+                self.d.downloaded -= size - self.seg.size
+
+        try:
+            if error is None:
+                self.record_transfer_stats()
+
+                # check if download completed
+                completed = self.verify()
+                if completed:
+                    self.report_completed()
 
-            # get response code and check for connection errors
-            response_code = self.c.getinfo(pycurl.RESPONSE_CODE)
-            if response_code in range(400, 512):
-                log('server refuse connection', response_code, 'content type:', self.headers.get('content-type'), log_level=3)
+                # get response code and check for connection errors
+                response_code = self.c.getinfo(pycurl.RESPONSE_CODE)
+                if response_code in range(400, 512):
+                    log('server refuse connection', response_code, 'content type:', self.headers.get('content-type'),
+                        log_level=3, subsystem='worker')
 
-                # send error to thread manager, it will reduce connections number to fix this error
-                self.report_error(f'server refuse connection: {response_code}')
+                    # send error to thread manager, it will reduce connections number to fix this error
+                    description = f'server refuse connection: {response_code}'
+                    self.report_error(description)
+                    failed = True
 
         except Exception as e:
+            error = e
+
+        if error is not None:
             # this error generated when user cancel download, or write function abort
-            if any(statement in repr(e) for statement in ('Failed writing body', 'Callback aborted')):
-                error = f'terminated'
-                log('Seg', self.seg.basename, error, 'worker', self.tag, log_level=3)
+            if any(statement in repr(error) for statement in ('Failed writing body', 'Callback aborted')):
+                log('Seg', self.seg.basename, 'terminated', 'worker', self.tag, log_level=3, subsystem='worker')
             else:
-                error = repr(e)
-                log('Seg', self.seg.basename, '- worker', self.tag, 'quitting ...', error, self.seg.url,  log_level=3)
+                self.record_transfer_stats()
+                log('Seg', self.seg.basename, '- worker', self.tag, 'quitting ...', repr(error), self.seg.url,
+                    log_level=3, subsystem='worker')
 
                 # report server error to thread manager
-                self.report_error(repr(e))
-
-        finally:
-            # close segment file handle
+                description = repr(error)
+                self.report_error(description)
+                failed = True
+
+        # update mirror's throughput and errors
+        if self.d.mirror_pool:
+            self.d.mirror_pool.report(self.seg.url, downloaded=self.downloaded,
+                                      duration=time.time() - self.start_time, failed=failed,
+                                      response_code=response_code)
+
+        if self.downloaded:
+            metrics.inc('pyidm_downloaded_bytes_total', self.downloaded)
+
+        # finally if segment not fully downloaded send it back to thread manager to try again
+        if not self.seg.downloaded:
+            self.report_not_completed()
+
+            # schedule next retry after a backoff delay, a segment which made progress starts counting again
+            if self.downloaded:
+                retry.on_success(self.seg)
+            if failed:
+                # other mirrors might have this segment, don't give up for a permanent error on one mirror
+                fail_fast = not (self.d.mirror_pool and len(self.d.mirror_pool.urls) > 1)
+                retry.on_failure(self.seg, description, retry_after=self.headers.get('retry-after'),
+                                 fail_fast=fail_fast)
+
+            # put back to jobs queue to try again
+            self.d.jobs_q.put(self.seg)
+            metrics.inc('pyidm_segment_retries_total')
+
+        # remove segment lock
+        self.seg.locked = False
+
+    def crashed(self, error):
+        """
+        unexpected exception while preparing or finishing transfer, i.e. disk error, report it and send segment back to
+        thread manager to be downloaded again
+        :param error: exception
+        """
+        log('Seg', self.seg.basename, '- worker', self.tag, 'crashed:', repr(error), log_level=2, subsystem='worker')
+        try:
             if self.file:
                 self.file.close()
+        except Exception:
+            pass
+        self.file = None
 
-            # finally if segment not fully downloaded send it back to thread manager to try again
-            if not self.seg.downloaded:
-                self.report_not_completed()
+        self.report_error(repr(error))
+        if not self.seg.downloaded:
+            retry.on_failure(self.seg, repr(error))
+            self.d.jobs_q.put(self.seg)
+        self.seg.locked = False
 
-                # put back to jobs queue to try again
-                jobs_q.put(self.seg)
+    def run(self):
+        if not self.prepare():
+            return
 
-            # remove segment lock
-            self.seg.locked = False
+        # Main Libcurl operation
+        try:
+            self.c.perform()
+        except Exception as e:
+            self.finish(error=e)
+        else:
+            self.finish()
 
     def write(self, data):
         """write to file"""
 
+        # disk error in writer thread
+        if self.file.error:
+            return -1  # abort
+
+        # backpressure, disk can't keep up with network
+        if self.file.full:
+            metrics.inc('pyidm_write_pauses_total')
+
+            # multiplexed transfers share one thread, pause this transfer only, curl will deliver same data again
+            # when resumed from progress callback
+            if self.http2:
+                self.paused = True
+                return pycurl.WRITEFUNC_PAUSE
+
+            # worker has its own thread, wait for writer threads, socket isn't read meanwhile
+            while not self.file.wait_for_room(timeout=1):
+                if self.d.status != Status.downloading:
+                    return -1  # abort
+
+        # discard body of error responses, i.e. "403 forbidden" page of an expired link, it shouldn't be written into
+        # segment file, response code will be checked and reported when transfer is done
+        if self.status_code >= 400:
+            return
+
         content_type = self.headers.get('content-type')
         if content_type and 'text/html' in content_type:
             # some video encryption keys has content-type 'text/html'
             try:
                 if '<html' in data.decode('utf-8') and not self.d.accept_html:
-                    log('Seg', self.seg.basename, '- worker', self.tag, 'received html contents, aborting', log_level=3)
+                    log('Seg', self.seg.basename, '- worker', self.tag, 'received html contents, aborting', log_level=3,
+                        subsystem='worker')
 
-                    log('=' * 20, '\n', data, '=' * 20, '\n', log_level=3)
+                    log('=' * 20, '\n', data, '=' * 20, '\n', log_level=3, subsystem='worker')
 
                     # report server error to thread manager
                     self.report_error('received html contents')
@@ -305,7 +507,16 @@ class Worker:
                 pass
                 # log('worker:', e)
 
-        # write to file
+        # check if we getting over sized, segment file size on disk is behind because of buffering, use counters
+        if self.seg.size and self.start_size + self.downloaded + len(data) > self.seg.size:
+            log('Seg', self.seg.basename, 'oversized:', 'received:', self.start_size + self.downloaded + len(data),
+                'segment size:', self.seg.size, ' - worker', self.tag, log_level=3, subsystem='worker')
+
+            # keep required part only
+            data = data[:max(self.seg.size - self.start_size - self.downloaded, 0)]
+            self.oversized = True
+
+        # write to buffer
         self.file.write(data)
 
         self.downloaded += len(data)
@@ -313,15 +524,183 @@ class Worker:
         # report to download item
         self.d.downloaded += len(data)
 
-        # check if we getting over sized
-        if self.seg.current_size > self.seg.size > 0:
-            log('Seg', self.seg.basename, 'oversized:',
-                'current segment size:', self.current_filesize, ' - worker', self.tag, log_level=3)
+        if self.oversized:
+            return -1  # abort, segment will be reported completed by finish()
 
-            # re-adjust value of total downloaded data
-            self.d.downloaded -= self.current_filesize - self.seg.size
-            self.report_completed()
-            return -1  # abort
 
 
 
+
+def http2_supported():
+    """check if installed libcurl is built with http/2 support and pycurl exposes needed options"""
+    try:
+        return bool(pycurl.version_info()[4] & pycurl.VERSION_HTTP2) and hasattr(pycurl, 'PIPEWAIT') and \
+               hasattr(pycurl, 'PIPE_MULTIPLEX')
+    except Exception:
+        return False
+
+
+# one multiplexer per host, shared by all downloads from this host, so their transfers run as streams over the same
+# http/2 connection
+_muxes = {}  # {host name: Multiplexer}
+_muxes_lock = Lock()
+
+
+def get_multiplexer(host):
+    """
+    get running multiplexer for a host or start a new one, must be released by Multiplexer.release() when not needed
+    :param host: host name
+    :return: Multiplexer object
+    """
+    with _muxes_lock:
+        mux = _muxes.get(host)
+        if mux is None:
+            mux = _muxes[host] = Multiplexer(host)
+            mux.start()
+        mux.users += 1
+        return mux
+
+
+class Multiplexer:
+    """
+    run workers' transfers on one curl multi handle in a single thread, with http/2 many range requests to the same
+    host are sent as streams over one connection instead of a connection per segment.
+    libcurl manages flow control window for every stream, and speed limit is applied per stream by each worker.
+    """
+
+    def __init__(self, host=''):
+        self.host = host
+        self.m = self.new_multi()
+
+        self.new_q = Queue()  # (worker, done queue) waiting to be added to multi handle
+        self.workers = {}  # {curl handle: (worker, done queue)}
+        self.users = 0  # downloads using this multiplexer, see get_multiplexer()
+
+        self.sockets = {}  # {download id: estimated number of tcp connections used by its transfers}
+
+        self.thread = Thread(target=self.run, daemon=True, name=f'multiplexer_{host}')
+
+    @staticmethod
+    def new_multi():
+        m = pycurl.CurlMulti()
+        m.setopt(pycurl.M_PIPELINING, pycurl.PIPE_MULTIPLEX)
+        return m
+
+    def start(self):
+        self.thread.start()
+
+    def release(self):
+        """download doesn't need multiplexer anymore, thread quits after all users released it and transfers done"""
+        with _muxes_lock:
+            self.users -= 1
+
+    def add(self, worker, done_q):
+        """
+        add a worker, which got its segment by worker.reuse(), to be processed
+        :param worker: Worker object
+        :param done_q: queue to put worker in when its transfer is done
+        """
+        self.new_q.put((worker, done_q))
+
+    def add_new_workers(self):
+        while True:
+            try:
+                worker, done_q = self.new_q.get_nowait()
+            except Empty:
+                break
+
+            try:
+                if worker.prepare():
+                    self.m.add_handle(worker.c)
+                    self.workers[worker.c] = (worker, done_q)
+                    continue
+            except Exception as e:
+                worker.crashed(e)
+
+            done_q.put(worker)
+
+    def finish(self, c, error=None):
+        worker, done_q = self.workers.pop(c)
+        try:
+            self.m.remove_handle(c)
+            worker.finish(error=error)
+        except Exception as e:
+            worker.crashed(e)
+        done_q.put(worker)
+
+    def fail_all(self, error):
+        """multiplexer loop crashed, fail all transfers and start over with a new multi handle"""
+        for c in list(self.workers):
+            self.finish(c, error=error)
+
+        try:
+            self.m.close()
+        except Exception:
+            pass
+        self.m = self.new_multi()
+
+    def count_sockets(self):
+        """
+        estimate tcp connections of every download, streams share a connection when they use the same local port.
+        it is an approximation, a handle reports local port of its last used connection, which might be closed already
+        or not connected yet, and connections to different servers might have the same local port
+        :return: {download id: number of connections}
+        """
+        ports = {}
+        for c, (worker, _) in self.workers.items():
+            try:
+                port = c.getinfo(pycurl.LOCAL_PORT)
+                if port:
+                    ports.setdefault(worker.d.id, set()).add(port)
+            except Exception:
+                pass
+
+        return {id_: len(x) for id_, x in ports.items()}
+
+    def run(self):
+        timer = 0
+        while True:
+            try:
+                self.add_new_workers()
+
+                if not self.workers:
+                    self.sockets = {}
+                    with _muxes_lock:
+                        if self.users <= 0 and self.new_q.empty():
+                            _muxes.pop(self.host, None)
+                            break
+
+                    time.sleep(0.01)
+                    continue
+
+                # run transfers
+                while True:
+                    ret, _ = self.m.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+
+                # process completed transfers
+                while True:
+                    num_q, ok_list, err_list = self.m.info_read()
+                    for c in ok_list:
+                        self.finish(c)
+                    for c, errno, errmsg in err_list:
+                        self.finish(c, error=pycurl.error(errno, errmsg))
+                    if num_q == 0:
+                        break
+
+                # update connection accounting
+                if time.time() - timer >= 0.5:
+                    timer = time.time()
+                    self.sockets = self.count_sockets()
+
+                # wait for network activity, select returns -1 when there is no file descriptors to wait on
+                if self.m.select(0.1) == -1:
+                    time.sleep(0.01)
+
+            except Exception as e:
+                # an exception here would kill this thread and leave all running transfers hanging
+                log(f'multiplexer {self.host}: error:', repr(e), log_level=2, subsystem='worker')
+                self.fail_all(e)
+
+        log(f'multiplexer {self.host}: quitting', log_level=2, subsystem='worker')
@@ -0,0 +1,155 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# buffered disk writer, workers put received data chunks in a per-worker bounded buffer, and a small pool of writer
+# threads flush buffers to disk in large block aligned writes, this way a slow disk doesn't block network reads,
+# when a buffer is full worker stops reading from socket until buffer is flushed "backpressure"
+
+import os
+import time
+from collections import deque
+from queue import Queue
+from threading import Thread, Lock, Condition
+
+from . import config
+from . import governor
+from .utils import log
+
+_queue = Queue()  # writers which have data ready to be flushed
+_threads = []
+_threads_lock = Lock()
+
+
+def _writer_thread():
+    while True:
+        writer = _queue.get()
+        try:
+            writer.flush()
+        except Exception as e:
+            log('writer thread> error:', e)
+
+
+def start_writer_threads():
+    """start writer threads pool if not running"""
+    with _threads_lock:
+        while len(_threads) < max(config.writer_threads, 1):
+            t = Thread(target=_writer_thread, daemon=True, name=f'writer_{len(_threads)}')
+            t.start()
+            _threads.append(t)
+
+
+class BufferedWriter:
+    """file like object for one segment file, write() never touches disk, data is flushed by writer threads"""
+
+    def __init__(self, name, mode='wb', block_size=4096):
+        self.file = open(name, mode)
+        self.position = self.file.tell()  # file offset of next disk write
+        self.fs = governor.fs_id(os.path.dirname(name))  # file system id, to report write latency
+
+        self.block_size = block_size
+
+        # flush before buffer is half full, a paused transfer resumes only when buffer drops below half
+        flush_size = min(config.write_buffer_size, config.max_write_buffer // 2)
+        self.flush_size = max(flush_size // block_size, 1) * block_size
+
+        self.chunks = deque()
+        self.buffered = 0  # bytes in chunks
+        self.in_flight = 0  # bytes being written to disk now
+        self.scheduled = False  # True if this writer is in queue or being flushed by a writer thread
+
+        self.lock = Lock()
+        self.idle = Condition(self.lock)
+        self.error = None
+
+        start_writer_threads()
+
+    @property
+    def pending(self):
+        """bytes not written to disk yet"""
+        return self.buffered + self.in_flight
+
+    @property
+    def full(self):
+        return self.pending >= config.max_write_buffer
+
+    @property
+    def resumable(self):
+        """buffer has enough room to resume paused transfer"""
+        return self.pending < config.max_write_buffer // 2
+
+    def wait_for_room(self, timeout=None):
+        """block until buffer has enough room to resume writing, return False on timeout"""
+        with self.lock:
+            return self.idle.wait_for(lambda: self.resumable or self.error, timeout)
+
+    def write(self, data):
+        with self.lock:
+            self.chunks.append(data)
+            self.buffered += len(data)
+
+            if (self.buffered >= self.flush_size or self.full) and not self.scheduled:
+                self.scheduled = True
+                _queue.put(self)
+
+    def take(self, final=False):
+        """get buffered data as one bytes object, must be called with lock acquired"""
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+
+        # keep the tail which exceeds block boundary to be written with next batch
+        if not final:
+            tail = (self.position + len(data)) % self.block_size
+            if 0 < tail < len(data):
+                self.chunks.append(data[-tail:])
+                data = data[:-tail]
+
+        self.buffered -= len(data)
+        return data
+
+    def flush(self):
+        """write buffered data to disk, called by writer threads only"""
+        while True:
+            with self.lock:
+                if (self.buffered < self.flush_size and not self.full) or self.error:
+                    self.scheduled = False
+                    self.idle.notify_all()
+                    return
+
+                data = self.take()
+                self.in_flight = len(data)
+
+            try:
+                t = time.time()
+                self.file.write(data)
+                governor.record_write(self.fs, time.time() - t)
+            except Exception as e:
+                self.error = e
+
+            with self.lock:
+                self.position += len(data)
+                self.in_flight = 0
+                self.idle.notify_all()
+
+    def close(self):
+        """wait for writer threads, write remaining data, and close file, raise disk errors if any"""
+        with self.lock:
+            while self.scheduled:
+                self.idle.wait()
+
+            data = self.take(final=True)
+
+        try:
+            if data and not self.error:
+                self.file.write(data)
+                self.position += len(data)
+        finally:
+            self.file.close()
+
+        if self.error:
+            raise self.error
@@ -39,7 +39,7 @@ setuptools.setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/pyIDM/PyIDM ",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['tests']),
     keywords="internet download manager youtube downloader pycurl curl youtube-dl PySimpleGUI",
     project_urls={
         'Source': 'https://github.com/pyIDM/PyIDM',
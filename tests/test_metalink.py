@@ -0,0 +1,186 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# tests for metalink parsing and pieces verification, see pyidm/metalink.py
+
+import hashlib
+from types import SimpleNamespace
+
+import pytest
+
+from pyidm import config
+from pyidm import metalink
+from pyidm.downloaditem import Segment
+from pyidm.utils import get_range_list
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+PIECE = 4096
+
+
+def piece_hashes(data, length=PIECE):
+    return [hashlib.sha1(data[i:i + length]).hexdigest() for i in range(0, len(data), length)]
+
+
+META4 = f'''<?xml version="1.0" encoding="UTF-8"?>
+<metalink xmlns="urn:ietf:params:xml:ns:metalink">
+  <file name="dir/data.bin">
+    <size>{len(DATA)}</size>
+    <hash type="sha-256">{hashlib.sha256(DATA).hexdigest().upper()}</hash>
+    <hash type="md5">{hashlib.md5(DATA).hexdigest()}</hash>
+    <hash type="unknown-hash">xyz</hash>
+    <pieces length="{PIECE}" type="sha-1">{"".join(f"<hash>{h}</hash>" for h in piece_hashes(DATA))}</pieces>
+    <url priority="2">http://mirror2.example.com/data.bin</url>
+    <url priority="1">http://mirror1.example.com/data.bin</url>
+    <url type="bittorrent">http://example.com/data.torrent</url>
+  </file>
+  <file name="no_urls.bin">
+    <size>10</size>
+  </file>
+</metalink>
+'''
+
+METALINK_V3 = '''<?xml version="1.0" encoding="UTF-8"?>
+<metalink version="3.0" xmlns="http://www.metalinker.org/">
+  <files>
+    <file name="v3.iso">
+      <size>1000</size>
+      <verification>
+        <hash type="sha1">AAAA</hash>
+        <pieces length="500" type="sha1"><hash piece="0">b0</hash><hash piece="1">b1</hash></pieces>
+      </verification>
+      <resources>
+        <url type="ftp" preference="10">ftp://low.example.com/v3.iso</url>
+        <url type="http" preference="100">http://high.example.com/v3.iso</url>
+      </resources>
+    </file>
+  </files>
+</metalink>
+'''
+
+
+# region parsing
+def test_parse_metalink_v4():
+    files = metalink.parse_metalink(META4)
+    assert len(files) == 1  # entry without urls is skipped
+
+    entry = files[0]
+    assert entry['name'] == 'data.bin'  # no folders from metalink file name
+    assert entry['size'] == len(DATA)
+    assert entry['urls'] == ['http://mirror1.example.com/data.bin', 'http://mirror2.example.com/data.bin']
+    assert entry['hashes'] == {'sha256': hashlib.sha256(DATA).hexdigest(), 'md5': hashlib.md5(DATA).hexdigest()}
+    assert entry['piece_length'] == PIECE
+    assert entry['piece_hash_type'] == 'sha1'
+    assert entry['piece_hashes'] == piece_hashes(DATA)
+
+
+def test_parse_metalink_v3():
+    entry = metalink.parse_metalink(METALINK_V3)[0]
+    assert entry['name'] == 'v3.iso'
+    assert entry['urls'] == ['http://high.example.com/v3.iso', 'ftp://low.example.com/v3.iso']
+    assert entry['hashes'] == {'sha1': 'aaaa'}
+    assert entry['piece_length'] == 500
+    assert entry['piece_hashes'] == ['b0', 'b1']
+
+
+def test_hash_name():
+    assert metalink.hash_name('SHA-256') == 'sha256'
+    assert metalink.hash_name('md5') == 'md5'
+    assert metalink.hash_name('tiger-tree') is None
+
+
+def test_strongest_hash():
+    assert metalink.strongest_hash({'md5': 'a', 'sha1': 'b', 'sha256': 'c'}) == ('sha256', 'c')
+    assert metalink.strongest_hash({'md5': 'a'}) == ('md5', 'a')
+    assert metalink.strongest_hash({}) is None
+# endregion
+
+
+# region whole file verification
+def test_verify_file(tmp_path):
+    file = tmp_path / 'data.bin'
+    file.write_bytes(DATA)
+    hashes = metalink.parse_metalink(META4)[0]['hashes']
+
+    assert metalink.verify_file(str(file), hashes, chunk_size=1000)
+    assert metalink.verify_file(str(file), {})  # nothing to check
+
+    file.write_bytes(DATA[:-1] + b'x')
+    assert not metalink.verify_file(str(file), hashes)
+
+    # strongest hash is used, a matching weak hash doesn't hide a mismatch
+    assert not metalink.verify_file(str(file), {'md5': hashlib.md5(DATA[:-1] + b'x').hexdigest(), 'sha256': 'bad'})
+# endregion
+
+
+# region pieces verification
+@pytest.fixture
+def item(tmp_path):
+    temp_file = tmp_path / '_temp_data.bin'
+    temp_file.write_bytes(DATA)
+    return SimpleNamespace(size=len(DATA), temp_file=str(temp_file), piece_length=PIECE, piece_hash_type='sha1',
+                           piece_hashes=piece_hashes(DATA))
+
+
+def merged(d, start, end, url='http://mirror1.example.com/data.bin'):
+    return Segment(name=f'{start}', range=[start, end], url=url, tempfile=d.temp_file)
+
+
+def test_piece_verified_when_covered(item):
+    verifier = metalink.PieceVerifier(item)
+
+    assert verifier.on_merge(merged(item, 0, 2047)) == []
+    assert not verifier.verified  # piece 0 isn't complete yet
+
+    assert verifier.on_merge(merged(item, 2048, 5000)) == []
+    assert verifier.verified == {0}
+
+    assert verifier.on_merge(merged(item, 5001, len(DATA) - 1)) == []
+    assert verifier.verified == {0, 1, 2}  # last piece is shorter
+
+
+def test_piece_failure_reports_urls(item, monkeypatch):
+    monkeypatch.setattr(metalink.PieceVerifier, 'max_retries', 1)
+    with open(item.temp_file, 'r+b') as f:
+        f.seek(PIECE + 10)
+        f.write(b'corrupted')
+
+    verifier = metalink.PieceVerifier(item)
+    verifier.on_merge(merged(item, 0, PIECE + 99, url='http://a/'))
+    failed = verifier.on_merge(merged(item, PIECE + 100, len(DATA) - 1, url='http://b/'))
+
+    assert failed == [(1, [PIECE, 2 * PIECE - 1], {'http://a/', 'http://b/'})]
+    assert verifier.verified == {0, 2}
+
+    # piece downloaded again with same bad data, too many failures
+    assert verifier.on_merge(merged(item, PIECE, 2 * PIECE - 1)) is None
+# endregion
+
+
+# region segments aligned to pieces
+@pytest.mark.parametrize('size, piece_length, segment_size, connections', [
+    (10 * 1024 * 1024, 3 * 1024 * 1024, 1024 * 1024, 8),
+    (10 * 1024 * 1024, 256 * 1024, 1024 * 1024, 8),
+    (10 * 1024 * 1024 + 17, 256 * 1024, 1024 * 1024, 3),
+    (1000, 4096, 100, 8),  # file smaller than one piece
+])
+def test_range_list_piece_boundaries(monkeypatch, size, piece_length, segment_size, connections):
+    monkeypatch.setattr(config, 'max_connections', connections)
+    ranges = get_range_list(size, piece_length=piece_length, segment_size=segment_size)
+
+    assert ranges[0][0] == 0 and ranges[-1][1] == size - 1
+    assert all(a[1] + 1 == b[0] for a, b in zip(ranges, ranges[1:]))  # contiguous, no gaps or overlaps
+    assert all(start % piece_length == 0 for start, _ in ranges)
+    assert len(ranges) <= connections
+
+
+def test_range_list_without_pieces(monkeypatch):
+    monkeypatch.setattr(config, 'max_connections', 4)
+    assert get_range_list(1000, segment_size=100) == [[0, 249], [250, 499], [500, 749], [750, 999]]
+    assert get_range_list(0) == [None]
+# endregion
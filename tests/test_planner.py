@@ -0,0 +1,87 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# tests for adaptive segment planner, see pyidm/planner.py
+
+from types import SimpleNamespace
+
+import pytest
+
+from pyidm import config
+from pyidm import planner
+
+KB = 1024
+MB = 1024 * KB
+
+
+@pytest.fixture(autouse=True)
+def planner_settings(monkeypatch):
+    monkeypatch.setattr(config, 'adaptive_segments', True)
+    monkeypatch.setattr(config, 'segment_size', 512 * KB)
+    monkeypatch.setattr(config, 'planner_overhead', 0.25)
+    monkeypatch.setattr(config, 'planner_max_segment_size', 64 * MB)
+    monkeypatch.setattr(planner, '_hosts', {})
+
+
+def download_item(records=(), url='http://example.com/file.bin'):
+    stats = [{'response_code': 206, 'bytes': MB, 'starttransfer_time': setup_time, 'speed_download': speed}
+             for setup_time, speed in records]
+    return SimpleNamespace(name='file.bin', url=url, eff_url=url, transfer_stats=stats, live_streams=0, speed=0,
+                           plan_decisions=[])
+
+
+def test_calc_segment_size_bdp():
+    # 100 ms setup at 10 MB/s, bdp is 1 MB, setup cost is 25% of transfer time at 4 MB
+    assert planner.calc_segment_size(0.1, 10 * MB) == 4 * MB
+
+
+def test_calc_segment_size_limits():
+    assert planner.calc_segment_size(0.001, 100 * KB) == config.segment_size  # fast link, never below default
+    assert planner.calc_segment_size(2, 100 * MB) == config.planner_max_segment_size
+
+
+@pytest.mark.parametrize('setup_time, throughput', [(None, 10 * MB), (0.1, None), (0, 0)])
+def test_calc_segment_size_without_measurements(setup_time, throughput):
+    assert planner.calc_segment_size(setup_time, throughput) == config.segment_size
+
+
+def test_calc_segment_size_disabled(monkeypatch):
+    monkeypatch.setattr(config, 'adaptive_segments', False)
+    assert planner.calc_segment_size(0.1, 10 * MB) == config.segment_size
+
+
+def test_measure_needs_min_records():
+    d = download_item([(0.1, 10 * MB)] * (planner.min_records - 1))
+    assert planner.measure(d) == (None, None)
+
+
+def test_measure_median():
+    d = download_item([(0.1, 10 * MB), (0.2, 20 * MB), (5, 1)])
+    assert planner.measure(d) == (0.2, 10 * MB)
+
+    # running download's speed is a better estimate
+    d.live_streams, d.speed = 4, 8 * MB
+    assert planner.measure(d) == (0.2, 2 * MB)
+
+
+def test_estimate_uses_host_history():
+    planner.measure(download_item([(0.1, 10 * MB)] * 3))
+
+    assert planner.estimate(download_item()) == (0.1, 10 * MB, 'history')
+    assert planner.estimate(download_item(url='http://other.com/file.bin')) == (None, None, None)
+
+
+def test_split_threshold():
+    d = download_item()
+    assert planner.split_threshold(d) == config.segment_size
+    assert not d.plan_decisions
+
+    d = download_item([(0.1, 10 * MB)] * 3)
+    assert planner.split_threshold(d) == 8 * MB  # each half is a useful segment
+    assert d.plan_decisions[-1]['kind'] == 'split'
@@ -0,0 +1,92 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# tests for segments retry policy, see pyidm/retry.py
+
+import time
+
+import pytest
+
+from pyidm import config
+from pyidm import retry
+from pyidm.downloaditem import Segment
+
+
+@pytest.fixture(autouse=True)
+def retry_settings(monkeypatch):
+    monkeypatch.setattr(config, 'retry_base_delay', 0.5)
+    monkeypatch.setattr(config, 'retry_max_delay', 60)
+    monkeypatch.setattr(config, 'max_segment_retries', 3)
+
+
+@pytest.mark.parametrize('attempts, delay', [(0, 0.5), (1, 0.5), (2, 1), (3, 2), (4, 4), (8, 60), (50, 60)])
+def test_backoff_range(attempts, delay):
+    # equal jitter, half of the delay is fixed and the other half is random
+    for _ in range(50):
+        assert delay / 2 <= retry.backoff(attempts) <= delay
+
+
+def test_backoff_jitter():
+    assert len(set(retry.backoff(5) for _ in range(20))) > 1
+
+
+def test_backoff_retry_after():
+    assert retry.backoff(1, retry_after=30) == 30
+    assert retry.backoff(10, retry_after=1) >= 30  # server delay shorter than backoff is ignored
+
+
+def test_parse_retry_after():
+    assert retry.parse_retry_after('120') == 120
+    assert retry.parse_retry_after('100000') == retry.max_retry_after
+    assert retry.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0  # date in the past
+    assert retry.parse_retry_after('') is None
+    assert retry.parse_retry_after('soon') is None
+
+
+@pytest.mark.parametrize('description, kind', [
+    ('server refuse connection: 404', retry.PERMANENT),
+    ('server refuse connection: 403', retry.EXPIRED),
+    ('server refuse connection: 503', retry.TRANSIENT),
+    ("error(28, 'Operation timed out')", retry.TRANSIENT),
+    ("error(6, 'Could not resolve host')", retry.TRANSIENT),
+])
+def test_classify(description, kind):
+    assert retry.classify(description) == kind
+
+
+def test_on_failure_schedules_retry():
+    seg = Segment(range=[0, 99])
+    now = time.time()
+
+    assert retry.on_failure(seg, 'server refuse connection: 503')
+    assert seg.attempts == 1
+    assert not retry.gave_up(seg)
+    assert not retry.is_due(seg, now)
+    assert retry.is_due(seg, seg.retry_at)
+
+
+def test_on_failure_permanent_fails_fast():
+    seg = Segment(range=[0, 99])
+    assert not retry.on_failure(seg, 'server refuse connection: 404')
+    assert retry.gave_up(seg)
+
+    # other mirrors might have the segment
+    seg = Segment(range=[0, 99])
+    assert retry.on_failure(seg, 'server refuse connection: 404', fail_fast=False)
+    assert not retry.gave_up(seg)
+
+
+def test_on_failure_gives_up_after_max_retries():
+    seg = Segment(range=[0, 99])
+    results = [retry.on_failure(seg, 'server refuse connection: 503') for _ in range(4)]
+    assert results == [True, True, True, False]
+    assert retry.gave_up(seg)
+
+    retry.on_success(seg)
+    assert seg.attempts == 0 and not retry.gave_up(seg) and retry.is_due(seg)
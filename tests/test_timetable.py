@@ -0,0 +1,128 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# tests for time windows and bandwidth profiles, see pyidm/timetable.py
+
+import datetime
+
+import pytest
+
+from pyidm import config
+from pyidm import timetable
+
+MON, TUE, WED, THU, FRI, SAT, SUN = range(7)
+
+
+def ts(day, hour, minute=0):
+    """local timestamp in week of monday 2026-10-19, day 0 is monday"""
+    return datetime.datetime(2026, 10, 19 + day, hour, minute).timestamp()
+
+
+# region next_time
+def test_next_time_later_today():
+    assert timetable.next_time((7, 30), after=ts(MON, 6)) == ts(MON, 7, 30)
+
+
+def test_next_time_passed_today():
+    assert timetable.next_time((7, 30), after=ts(MON, 8)) == ts(TUE, 7, 30)
+    assert timetable.next_time((7, 30), after=ts(MON, 7, 30)) == ts(TUE, 7, 30)  # strictly after
+
+
+def test_next_time_end_of_day():
+    assert timetable.next_time((24, 0), after=ts(MON, 23)) == ts(TUE, 0)
+
+
+def test_next_time_weekdays():
+    assert timetable.next_time((7, 0), after=ts(MON, 8), days=[FRI]) == ts(FRI, 7)
+    assert timetable.next_time((7, 0), after=ts(MON, 6), days=[MON, FRI]) == ts(MON, 7)
+
+    # same weekday next week
+    assert timetable.next_time((7, 0), after=ts(MON, 8), days=[MON]) == ts(MON, 7) + 7 * 24 * 3600
+# endregion
+
+
+# region in_window
+@pytest.mark.parametrize('now, inside', [
+    (ts(MON, 8, 59), False),
+    (ts(MON, 9), True),
+    (ts(MON, 16, 59), True),
+    (ts(MON, 17), False),
+])
+def test_in_window_same_day(now, inside):
+    assert timetable.in_window((9, 0), (17, 0), now=now) is inside
+
+
+@pytest.mark.parametrize('now, inside', [
+    (ts(MON, 22, 59), False),
+    (ts(MON, 23), True),
+    (ts(MON, 23, 59), True),
+    (ts(TUE, 0), True),
+    (ts(TUE, 1, 59), True),
+    (ts(TUE, 2), False),
+    (ts(TUE, 12), False),
+])
+def test_in_window_crossing_midnight(now, inside):
+    assert timetable.in_window((23, 0), (2, 0), now=now) is inside
+
+
+def test_in_window_crossing_midnight_weekdays():
+    # window starts on friday night, its part after midnight belongs to friday
+    assert timetable.in_window((23, 0), (2, 0), days=[FRI], now=ts(FRI, 23, 30))
+    assert timetable.in_window((23, 0), (2, 0), days=[FRI], now=ts(SAT, 1))
+    assert not timetable.in_window((23, 0), (2, 0), days=[FRI], now=ts(FRI, 1))
+    assert not timetable.in_window((23, 0), (2, 0), days=[FRI], now=ts(SAT, 23, 30))
+
+
+def test_in_window_whole_day():
+    assert timetable.in_window((0, 0), (24, 0), now=ts(WED, 0))
+    assert timetable.in_window((0, 0), (24, 0), now=ts(WED, 23, 59))
+    assert timetable.in_window((0, 0), (24, 0), days=[SAT, SUN], now=ts(SUN, 12))
+    assert not timetable.in_window((0, 0), (24, 0), days=[SAT, SUN], now=ts(MON, 12))
+# endregion
+
+
+# region bandwidth profiles
+def test_parse_hm():
+    assert timetable.parse_hm('07:30') == (7, 30)
+    assert timetable.parse_hm(' 24:00') == (24, 0)
+
+    for text in ('24:30', '25:00', '10:60', '7'):
+        with pytest.raises(ValueError):
+            timetable.parse_hm(text)
+
+
+def test_parse_days():
+    assert timetable.parse_days('mon-fri') == [MON, TUE, WED, THU, FRI]
+    assert timetable.parse_days('sat,Sunday,mon') == [MON, SAT, SUN]
+
+
+def test_parse_profiles():
+    profiles = timetable.parse_profiles('01:00-07:00 unlimited; sat,sun 00:00-24:00 2 MB; 18:00-23:00 512 KB;')
+    assert profiles == [
+        {'start': [1, 0], 'stop': [7, 0], 'days': [], 'speed_limit': 0},
+        {'start': [0, 0], 'stop': [24, 0], 'days': [SAT, SUN], 'speed_limit': 2 * 1024 * 1024},
+        {'start': [18, 0], 'stop': [23, 0], 'days': [], 'speed_limit': 512 * 1024},
+    ]
+
+    assert timetable.parse_profiles(timetable.format_profiles(profiles)) == profiles
+
+
+def test_parse_profiles_invalid():
+    with pytest.raises(ValueError):
+        timetable.parse_profiles('1:00 to 7:00 unlimited')
+
+
+def test_active_profile(monkeypatch):
+    monkeypatch.setattr(config, 'speed_limit', 100)
+    monkeypatch.setattr(config, 'bandwidth_profiles', timetable.parse_profiles('23:00-07:00 unlimited; 18:00-23:00 1 KB'))
+
+    assert timetable.active_profile(ts(MON, 12)) is None
+    assert timetable.active_profile(ts(MON, 19))['speed_limit'] == 1024
+    assert timetable.active_profile(ts(TUE, 3))['speed_limit'] == 0
+# endregion
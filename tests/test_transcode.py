@@ -0,0 +1,86 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# tests for ffmpeg processing mode decisions, see pyidm/transcode.py
+
+import pytest
+
+from pyidm import transcode
+from pyidm.transcode import COPY, AUDIO, FULL
+
+
+@pytest.fixture(autouse=True)
+def clear_decisions(monkeypatch):
+    monkeypatch.setattr(transcode, '_decisions', {})
+
+
+@pytest.mark.parametrize('name, codec', [
+    ('avc1.64001F', 'h264'),
+    ('hev1.1.6.L93.B0', 'hevc'),
+    ('vp09.00.10.08', 'vp9'),
+    ('VP9', 'vp9'),
+    ('av01.0.05M.08', 'av1'),
+    ('mp4a.40.2', 'aac'),
+    ('mp4a.40.34', 'mp3'),
+    ('opus', 'opus'),
+    ('ec-3', 'eac3'),
+    ('none', ''),
+    ('', ''),
+    (None, ''),
+    ('prores', 'prores'),
+])
+def test_normalize_codec(name, codec):
+    assert transcode.normalize_codec(name) == codec
+
+
+@pytest.mark.parametrize('container, vcodec, acodec, mode', [
+    ('mp4', 'h264', 'aac', COPY),
+    ('mp4', 'vp9', 'opus', COPY),
+    ('mkv', 'prores', 'pcm', COPY),
+    ('webm', 'vp9', 'opus', COPY),
+    ('webm', 'vp9', 'aac', AUDIO),
+    ('webm', 'h264', 'opus', FULL),
+    ('m4a', '', 'aac', COPY),
+    ('m4a', '', 'opus', AUDIO),
+    ('mp3', '', 'aac', AUDIO),
+    ('mp3', '', 'mp3', COPY),
+    ('mp4', '', '', COPY),  # codecs unknown, try remux first
+    ('avi', 'h264', 'aac', FULL),  # unknown container
+])
+def test_decide(container, vcodec, acodec, mode):
+    assert transcode.decide(container, vcodec, acodec) == mode
+
+
+def test_downgrade_on_mismatch():
+    assert transcode.decide('mp4', '', '') == COPY
+
+    output = '[mp4 @ 0x1] Could not find tag for codec pcm_s16le in stream #1, codec not currently supported'
+    assert transcode.downgrade('mp4', '', '', COPY, output) == AUDIO
+    assert transcode.decide('mp4', '', '') == AUDIO
+
+    assert transcode.downgrade('mp4', '', '', AUDIO, output) == FULL
+    assert transcode.decide('mp4', '', '') == FULL
+
+
+def test_downgrade_keeps_cache_on_other_errors():
+    assert transcode.decide('mp4', 'h264', 'aac') == COPY
+
+    # disk full or killed process say nothing about codecs, next jobs still try copy
+    assert transcode.downgrade('mp4', 'h264', 'aac', COPY, 'No space left on device') == AUDIO
+    assert transcode.decide('mp4', 'h264', 'aac') == COPY
+
+
+@pytest.mark.parametrize('mode, audio_only, args', [
+    (COPY, False, '-c copy'),
+    (AUDIO, False, '-c:v copy -c:a aac'),
+    (AUDIO, True, '-vn -c:a aac'),
+    (FULL, False, ''),
+])
+def test_codec_args(mode, audio_only, args):
+    assert transcode.codec_args(mode, 'mp4', audio_only=audio_only) == args
@@ -0,0 +1,139 @@
+"""
+    pyIDM
+
+    multi-connections internet download manager, based on "pyCuRL/curl", "youtube_dl", and "PySimpleGUI"
+
+    :copyright: (c) 2019-2020 by Mahmoud Elshahat.
+    :license: GNU LGPLv3, see LICENSE for more details.
+"""
+
+# tests for buffered disk writer, see pyidm/writer.py
+
+import os
+
+import pytest
+
+from pyidm import config
+from pyidm.writer import BufferedWriter
+
+BLOCK = 4096
+
+
+@pytest.fixture(autouse=True)
+def buffer_settings(monkeypatch):
+    monkeypatch.setattr(config, 'write_buffer_size', 16 * BLOCK)
+    monkeypatch.setattr(config, 'max_write_buffer', 64 * BLOCK)
+
+
+def data(size, seed=0):
+    return bytes((seed + i) % 251 for i in range(size))
+
+
+def fill(writer, *chunks):
+    """buffer chunks without scheduling a flush"""
+    for chunk in chunks:
+        writer.chunks.append(chunk)
+        writer.buffered += len(chunk)
+
+
+# region take
+def test_take_keeps_tail_after_block_boundary(tmp_path):
+    w = BufferedWriter(str(tmp_path / 'seg'), block_size=BLOCK)
+    payload = data(10000)
+    fill(w, payload[:3000], payload[3000:])
+
+    with w.lock:
+        taken = w.take()
+
+    assert taken == payload[:2 * BLOCK]
+    assert b''.join(w.chunks) == payload[2 * BLOCK:]
+    assert w.buffered == 10000 - 2 * BLOCK
+    w.close()
+
+
+def test_take_aligns_resumed_file(tmp_path):
+    # resumed segment file, first write completes the partial block on disk
+    file = tmp_path / 'seg'
+    file.write_bytes(data(100))
+
+    w = BufferedWriter(str(file), mode='ab', block_size=BLOCK)
+    assert w.position == 100
+
+    fill(w, data(5000, seed=1))
+    with w.lock:
+        taken = w.take()
+
+    assert len(taken) == BLOCK - 100
+    assert (w.position + len(taken)) % BLOCK == 0
+    w.close()
+
+
+def test_take_aligned_data_has_no_tail(tmp_path):
+    w = BufferedWriter(str(tmp_path / 'seg'), block_size=BLOCK)
+    fill(w, data(3 * BLOCK))
+
+    with w.lock:
+        assert len(w.take()) == 3 * BLOCK
+    assert not w.chunks and w.buffered == 0
+    w.close()
+
+
+def test_take_less_than_a_block(tmp_path):
+    # no block boundary crossed, nothing to align
+    w = BufferedWriter(str(tmp_path / 'seg'), block_size=BLOCK)
+    fill(w, data(100))
+
+    with w.lock:
+        assert len(w.take()) == 100
+    w.close()
+
+
+def test_take_final_returns_everything(tmp_path):
+    w = BufferedWriter(str(tmp_path / 'seg'), block_size=BLOCK)
+    fill(w, data(BLOCK + 10))
+
+    with w.lock:
+        assert len(w.take(final=True)) == BLOCK + 10
+    assert w.buffered == 0
+    w.close()
+# endregion
+
+
+def test_flush_size_is_block_aligned(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'write_buffer_size', 10000)
+    w = BufferedWriter(str(tmp_path / 'seg'), block_size=BLOCK)
+    assert w.flush_size == 2 * BLOCK
+
+    # never more than half of max buffer, so a full buffer is always flushed
+    monkeypatch.setattr(config, 'write_buffer_size', 1024 * BLOCK)
+    w2 = BufferedWriter(str(tmp_path / 'seg2'), block_size=BLOCK)
+    assert w2.flush_size == config.max_write_buffer // 2
+
+    w.close()
+    w2.close()
+
+
+def test_full_and_resumable(tmp_path):
+    w = BufferedWriter(str(tmp_path / 'seg'), block_size=BLOCK)
+    fill(w, data(config.max_write_buffer))
+    assert w.full and not w.resumable
+
+    with w.lock:
+        w.take()
+    assert not w.full and w.resumable
+    w.close()
+
+
+@pytest.mark.parametrize('mode, existing', [('wb', b''), ('ab', data(777, seed=5))])
+def test_write_and_close(tmp_path, mode, existing):
+    file = tmp_path / 'seg'
+    file.write_bytes(existing)
+    payload = data(300000, seed=3)
+
+    w = BufferedWriter(str(file), mode=mode, block_size=BLOCK)
+    for i in range(0, len(payload), 1500):
+        w.write(payload[i:i + 1500])
+    w.close()
+
+    assert file.read_bytes() == existing + payload
+    assert w.position == os.path.getsize(file)